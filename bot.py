@@ -1,15 +1,25 @@
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands
-import json
 import random
 import asyncio
 import datetime
-import sqlite3
+import functools
 import os
-from typing import Optional, List
+from typing import Optional, List, Dict
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
+from config import config
+import database
+from database import DatabaseManager
+from scheduler import BacklogDrain, DrawWorkerPool, LotteryScheduler
+from leader import LeaderElector
+from clock import get_clock
+from join_coalescer import JOIN_MISSING_ROLE, JoinCoalescer
+from rate_limit import RateLimiter
+from idempotency import InteractionLog
+import draw_engine
 
 # 加载环境变量
 load_dotenv()
@@ -21,6 +31,15 @@ BOT_OWNER_ID = int(os.getenv('BOT_OWNER_ID', '0'))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 参与抽奖被拒绝时的提示
+JOIN_REJECTIONS = {
+    database.JOIN_NOT_FOUND: "❌ 找不到指定的抽奖活动！",
+    database.JOIN_CLOSED: "❌ 该抽奖活动已结束或被取消！",
+    database.JOIN_EXPIRED: "❌ 抽奖已过期！",
+    database.JOIN_ALREADY: "❌ 您已经参与了这个抽奖活动！",
+    database.JOIN_FULL: "❌ 该抽奖活动参与人数已满！",
+}
+
 class LotteryBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
@@ -34,78 +53,71 @@ class LotteryBot(commands.Bot):
             help_command=None
         )
         
-        # 初始化数据库
-        self.init_database()
-        
-        # 存储活跃抽奖
-        self.active_lotteries = {}
-    
-    def init_database(self):
-        """初始化SQLite数据库"""
-        self.conn = sqlite3.connect('lottery_bot.db')
-        cursor = self.conn.cursor()
-        
-        # 创建抽奖表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lotteries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                channel_id INTEGER NOT NULL,
-                creator_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                description TEXT,
-                prizes TEXT NOT NULL,  -- JSON格式存储奖品
-                max_participants INTEGER DEFAULT -1,
-                end_time TIMESTAMP,
-                status TEXT DEFAULT 'active',  -- active, ended, cancelled
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                winner_selection_method TEXT DEFAULT 'random',  -- random, weighted
-                allow_multiple_entries BOOLEAN DEFAULT FALSE,
-                required_roles TEXT,  -- JSON格式存储需要的角色ID
-                blacklisted_users TEXT  -- JSON格式存储黑名单用户ID
-            )
-        ''')
-        
-        # 创建参与者表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lottery_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                discord_id TEXT,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                weight INTEGER DEFAULT 1,
-                FOREIGN KEY (lottery_id) REFERENCES lotteries (id),
-                UNIQUE(lottery_id, user_id)
-            )
-        ''')
-        
-        # 创建中奖记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS winners (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lottery_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                prize_name TEXT NOT NULL,
-                won_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
-            )
-        ''')
-        
-        # 创建统计表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS statistics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                total_lotteries INTEGER DEFAULT 0,
-                total_participants INTEGER DEFAULT 0,
-                total_winners INTEGER DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        self.conn.commit()
-        logger.info("数据库初始化完成")
+        # 存储引擎（连接在setup_hook中建立）
+        self.db = DatabaseManager()
+        
+        # 所有调度和过期判断共用的时钟，测试时可替换为模拟时钟
+        self.clock = get_clock()
+        
+        # 进行中抽奖的内存热状态，由数据库层在启动时加载并随写入同步更新
+        self.active_lotteries = self.db.active_lotteries
+        
+        # 超大抽奖的开奖进程池（首次使用时创建）
+        self.draw_pool: Optional[ProcessPoolExecutor] = None
+        
+        # 进行中的开奖 {lottery_id: Task}，同一抽奖的并发调用共享结果
+        self.pending_draws: Dict[int, asyncio.Task] = {}
+        
+        # 按结束时间精确触发自动开奖，到期的抽奖交给有并发上限的工作池
+        self.scheduler = LotteryScheduler(self.draw_due_lottery, clock=self.clock)
+        self.draw_workers = DrawWorkerPool(self.draw_queued_lottery, config.AUTO_DRAW_CONCURRENCY, 
+                                           clock=self.clock)
+        
+        # 停机期间到期的抽奖在启动后分批限速补开
+        self.backlog = BacklogDrain(self.db.get_expired_lotteries, self.submit_backlog_lottery,
+                                    config.BACKLOG_DRAIN_BATCH_SIZE, config.BACKLOG_DRAIN_INTERVAL_SECONDS,
+                                    clock=self.clock)
+        
+        # 多个进程共用数据库时，只有持有租约的leader运行开奖调度
+        self.elector = LeaderElector(self.db.write, 'scheduler', config.LEADER_LEASE_TTL_SECONDS,
+                                     config.LEADER_HEARTBEAT_SECONDS, self.start_scheduling,
+                                     self.stop_scheduling, self.sync_scheduler, clock=self.clock)
+        # 热门抽奖的参与按钮点击按抽奖合并后批量写入
+        self.join_coalescer = JoinCoalescer(self.db.get_lottery_for_join, self.db.join_lottery_many,
+                                            config.JOIN_COALESCE_WINDOW_MS / 1000, config.JOIN_COALESCE_MAX_BATCH,
+                                            clock=self.clock)
+        
+        # 参与限流：按用户的令牌桶，连续点击在defer和数据库操作之前被拒绝
+        self.join_user_limiter = RateLimiter(config.JOIN_USER_BUCKET_CAPACITY, config.JOIN_USER_REFILL_PER_SECOND,
+                                             clock=self.clock)
+        # 按抽奖的令牌桶只用于保护数据库，默认关闭，不限制热门抽奖的参与吞吐
+        self.join_lottery_limiter = None
+        if config.JOIN_LOTTERY_REFILL_PER_SECOND > 0:
+            self.join_lottery_limiter = RateLimiter(config.JOIN_LOTTERY_BUCKET_CAPACITY,
+                                                    config.JOIN_LOTTERY_REFILL_PER_SECOND, clock=self.clock)
+        # 热状态直接判定为重复参与、已满或已过期而提前拒绝的次数
+        self.join_prechecks_rejected = 0
+        
+        # 按interaction.id记录参与和开奖的响应，重复投递的交互直接重放
+        self.interaction_log = InteractionLog(config.INTERACTION_LOG_TTL_SECONDS, config.INTERACTION_LOG_MAX_ENTRIES,
+                                              clock=self.clock)
+        
+        # 调度器已加载的最大抽奖ID，leader心跳时据此发现其他进程创建的抽奖
+        self.scheduled_max_id = 0
+        # 成为leader时的时间界限，此前到期的抽奖归积压补开
+        self.scheduling_cutoff = 0
+    
+    async def setup_hook(self):
+        """登录前的异步初始化"""
+        await self.db.connect()
+    
+    async def close(self):
+        """关闭机器人时释放选主租约、数据库连接和开奖进程池"""
+        await self.elector.stop()
+        await super().close()
+        await self.db.close()
+        if self.draw_pool:
+            self.draw_pool.shutdown(cancel_futures=True)
     
     async def on_ready(self):
         """机器人启动时的回调"""
@@ -119,10 +131,10 @@ class LotteryBot(commands.Bot):
         except Exception as e:
             logger.error(f'同步命令时出错: {e}')
         
-        # 启动定时任务
-        if not self.check_scheduled_lotteries.is_running():
-            self.check_scheduled_lotteries.start()
-            logger.info('定时任务已启动')
+        # 参与选主，成为leader后启动开奖调度（on_ready可能因重连多次触发）
+        self.elector.start()
+        if not self.reconcile_statistics.is_running():
+            self.reconcile_statistics.start()
         
         # 如果没有设置BOT_OWNER_ID，自动设置为应用所有者
         global BOT_OWNER_ID
@@ -131,39 +143,157 @@ class LotteryBot(commands.Bot):
             BOT_OWNER_ID = app_info.owner.id
             logger.info(f'自动设置机器人创建者ID: {BOT_OWNER_ID}')
     
-    @tasks.loop(minutes=1)
-    async def check_scheduled_lotteries(self):
-        """检查定时抽奖"""
-        cursor = self.conn.cursor()
-        current_time = datetime.datetime.now()
-        
-        cursor.execute('''
-            SELECT id, guild_id, channel_id, title, prizes 
-            FROM lotteries 
-            WHERE status = 'active' AND end_time <= ? AND end_time IS NOT NULL
-        ''', (current_time,))
+    async def start_scheduling(self):
+        """成为leader：加载待开奖抽奖并启动调度器、工作池和积压补开"""
+        # 以此刻为界：之后到期的进入调度堆，之前到期的交给积压补开
+        cutoff = self.clock.now()
+        self.scheduler.clear()
+        self.scheduling_cutoff = cutoff
+        # 先记下此刻的最大ID：之后创建的抽奖由心跳发现，之前的由下面的加载或积压补开处理
+        self.scheduled_max_id = await self.db.get_max_lottery_id()
+        for lottery_id, end_time in await self.db.get_scheduled_lotteries(cutoff):
+            self.scheduler.schedule(lottery_id, end_time)
+        self.draw_workers.start()
+        self.scheduler.start()
+        logger.info(f'开奖调度器已启动，待开奖抽奖: {len(self.scheduler)}')
+        
+        overdue = await self.db.count_expired_lotteries(cutoff)
+        if overdue:
+            self.backlog.start(cutoff, overdue)
+            logger.info(f'发现 {overdue} 个已到期未开奖的抽奖，开始分批补开')
+    
+    async def stop_scheduling(self):
+        """失去leader：停止调度，交给新的leader接管"""
+        self.scheduler.stop()
+        self.backlog.stop()
+        self.draw_workers.stop()
+        self.draw_workers.clear()
+        logger.info('开奖调度器已停止')
+    
+    async def sync_scheduler(self):
+        """leader心跳：把其他进程新创建的定时抽奖加入调度堆"""
+        # 只取结束时间晚于cutoff的抽奖，更早到期的只由积压补开限速处理，不会绕过限速或被提交两次
+        for lottery_id, end_time in await self.db.get_scheduled_lotteries(self.scheduling_cutoff,
+                                                                          self.scheduled_max_id):
+            self.scheduler.schedule(lottery_id, end_time)
+            self.scheduled_max_id = max(self.scheduled_max_id, lottery_id)
+    
+    async def draw_due_lottery(self, lottery_id: int):
+        """调度器回调：抽奖到期时放入开奖工作池"""
+        lottery = await self.db.get_lottery(lottery_id)
+        if not lottery or lottery['status'] != 'active':
+            return
         
-        expired_lotteries = cursor.fetchall()
+        await self.draw_workers.submit(lottery['guild_id'], lottery, lottery['end_time'])
+    
+    async def submit_backlog_lottery(self, lottery: Dict):
+        """积压补开回调：放入开奖工作池"""
+        await self.draw_workers.submit(lottery['guild_id'], lottery, lottery['end_time'])
+    
+    async def draw_queued_lottery(self, lottery: Dict):
+        """工作池回调：执行自动开奖"""
+        await self.auto_draw_lottery(lottery['id'], lottery['guild_id'], lottery['channel_id'], 
+                                     lottery['title'], lottery['prizes'])
+    
+    def format_draw_worker_stats(self) -> str:
+        """格式化自动开奖工作池的监控指标"""
+        stats = self.draw_workers.stats()
+        return (f"排队: {stats['queue_depth']} ({stats['queued_guilds']}个服务器)\n" +
+                f"执行中: {stats['in_flight']}/{stats['concurrency']}\n" +
+                f"完成/失败: {stats['completed']}/{stats['failed']}\n" +
+                f"开奖延迟: 平均{stats['lateness']['avg']:.2f}s / P95 {stats['lateness']['p95']:.2f}s\n" +
+                f"开奖耗时: 平均{stats['duration']['avg']:.2f}s / 最大{stats['duration']['max']:.2f}s" +
+                self.format_backlog_progress())
+    
+    def check_join_request(self, user_id: int, lottery_id: int, guild_id: Optional[int] = None) -> Optional[str]:
+        """参与请求的前置检查（不访问数据库），被拒绝时返回提示；guild_id用于限定抽奖所属服务器"""
+        if not self.join_user_limiter.allow(user_id):
+            wait = self.join_user_limiter.retry_after(user_id)
+            return f"⏳ 操作太频繁，请 {wait:.0f} 秒后再试。" if wait >= 1 else "⏳ 操作太频繁，请稍后再试。"
+        
+        entry = self.active_lotteries.get(lottery_id)
+        if entry and guild_id and entry.guild_id != guild_id:
+            entry = None
+        rejection = entry.rejection(user_id, self.clock.now()) if entry else None
+        if rejection:
+            self.join_prechecks_rejected += 1
+            return JOIN_REJECTIONS[rejection]
+        
+        if self.join_lottery_limiter and not self.join_lottery_limiter.allow(lottery_id):
+            return "⏳ 该抽奖当前参与人数过多，请稍后再试。"
+        return None
+    
+    async def respond(self, interaction: discord.Interaction, content: Optional[str] = None, **kwargs):
+        """发送交互响应并记入交互日志，重复投递时原样重放"""
+        self.interaction_log.record(interaction.id, content, kwargs)
+        await self.send_response(interaction, content, **kwargs)
+    
+    @staticmethod
+    async def send_response(interaction: discord.Interaction, content: Optional[str] = None, **kwargs):
+        """交互还未响应时直接回复，否则发送followup"""
+        if interaction.response.is_done():
+            await interaction.followup.send(content, **kwargs)
+        else:
+            await interaction.response.send_message(content, **kwargs)
+    
+    def format_join_stats(self) -> str:
+        """格式化参与限流和合并写入的监控指标"""
+        user = self.join_user_limiter.stats()
+        batches = self.join_coalescer.stats()
+        if self.join_lottery_limiter:
+            lottery = self.join_lottery_limiter.stats()
+            lottery_line = f"抽奖限流拒绝: {lottery['rejected']} (放行 {lottery['allowed']})\n"
+        else:
+            lottery_line = "抽奖限流: 关闭\n"
+        return (f"用户限流拒绝: {user['rejected']} (放行 {user['allowed']})\n" +
+                lottery_line +
+                f"重复/已满提前拒绝: {self.join_prechecks_rejected}\n" +
+                f"合并写入: {batches['batches']}批 / 平均{batches['avg_batch']:.1f}人 / 最大{batches['largest_batch']}人\n" +
+                f"重复投递重放: {self.interaction_log.replays} (记录 {len(self.interaction_log)})")
+    
+    def format_backlog_progress(self) -> str:
+        """格式化积压补开进度，没有积压时为空"""
+        progress = self.backlog.progress()
+        if not progress['total']:
+            return ""
+        state = "进行中" if progress['running'] else "已完成"
+        return (f"\n积压补开: {progress['submitted']}/{progress['total']} ({state}, "
+                f"用时{progress['elapsed']:.0f}s)")
+    
+    @tasks.loop(minutes=config.STATS_RECONCILE_INTERVAL_MINUTES)
+    async def reconcile_statistics(self):
+        """定期按明细表校正服务器统计和用户统计（只在leader上执行）"""
+        if not self.elector.is_leader:
+            return
         
-        for lottery_data in expired_lotteries:
-            lottery_id, guild_id, channel_id, title, prizes_json = lottery_data
-            try:
-                await self.auto_draw_lottery(lottery_id, guild_id, channel_id, title, prizes_json)
-            except Exception as e:
-                logger.error(f'自动开奖失败 (抽奖ID: {lottery_id}): {e}')
+        try:
+            drifted = await self.db.reconcile_guild_stats()
+            if drifted:
+                logger.warning(f'服务器统计校正: 修正了 {drifted} 个服务器的统计')
+            drifted = await self.db.reconcile_user_stats()
+            if drifted:
+                logger.warning(f'用户统计校正: 修正了 {drifted} 条用户统计')
+        except Exception as e:
+            logger.error(f'统计校正失败: {e}')
+    
+    @staticmethod
+    def format_time(timestamp: Optional[int], fmt: str = '%Y-%m-%d %H:%M') -> str:
+        """把数据库中的UTC epoch秒格式化为本地时间"""
+        if not timestamp:
+            return "未知"
+        return datetime.datetime.fromtimestamp(timestamp).strftime(fmt)
     
-    def format_countdown(self, end_time: datetime.datetime) -> str:
-        """格式化倒计时显示"""
+    def format_countdown(self, end_time: Optional[int]) -> str:
+        """格式化倒计时显示，end_time为UTC epoch秒"""
         if not end_time:
             return "手动开奖"
         
-        now = datetime.datetime.now()
-        if end_time <= now:
+        remaining = end_time - self.clock.now()
+        if remaining <= 0:
             return "已过期"
         
-        delta = end_time - now
-        days = delta.days
-        hours, remainder = divmod(delta.seconds, 3600)
+        days, remainder = divmod(remaining, 86400)
+        hours, remainder = divmod(remainder, 3600)
         minutes, seconds = divmod(remainder, 60)
         
         if days > 0:
@@ -173,7 +303,48 @@ class LotteryBot(commands.Bot):
         else:
             return f"{minutes}分钟 {seconds}秒"
     
-    async def auto_draw_lottery(self, lottery_id: int, guild_id: int, channel_id: int, title: str, prizes_json: str):
+    async def draw_winners(self, lottery_id: int, prizes: List[Dict], participant_count: int) -> tuple:
+        """抽取中奖者，返回 (中奖列表, 抽取顺序)；参与者很多时流式读取，超大抽奖放到进程池执行"""
+        if participant_count > config.DRAW_PROCESS_POOL_THRESHOLD:
+            if self.draw_pool is None:
+                self.draw_pool = ProcessPoolExecutor(max_workers=config.DRAW_PROCESS_POOL_WORKERS)
+            chunks = self.db.iter_participants(lottery_id, config.DRAW_STREAM_CHUNK_SIZE)
+            return await draw_engine.pooled_draw(self.draw_pool, chunks, prizes, config.DRAW_WAITLIST_SIZE)
+        
+        if participant_count > config.DRAW_STREAM_THRESHOLD:
+            chunks = self.db.iter_participants(lottery_id, config.DRAW_STREAM_CHUNK_SIZE)
+            return await draw_engine.stream_draw(chunks, prizes, config.DRAW_WAITLIST_SIZE)
+        
+        participants = await self.db.get_participants(lottery_id)
+        return draw_engine.draw(participants, prizes, config.DRAW_WAITLIST_SIZE)
+    
+    async def _draw_and_complete(self, lottery_id: int, prizes: List[Dict], participant_count: int) -> tuple:
+        """抽取并提交结果，返回 (中奖列表, 是否由本次提交)"""
+        winners, draw_order = await self.draw_winners(lottery_id, prizes, participant_count)
+        if await self.db.complete_lottery(lottery_id, winners, draw_order):
+            return winners, True
+        
+        # 抽奖已被其他进程结束，返回已记录的结果
+        recorded = await self.db.get_lottery_winners(lottery_id)
+        return [(winner['user_id'], winner['prize_name']) for winner in recorded], False
+    
+    async def run_draw(self, lottery_id: int, prizes: List[Dict], participant_count: int) -> tuple:
+        """开奖入口，返回 (中奖列表, 是否由本次调用开奖)
+        
+        同一抽奖同时只执行一次抽样；并发的调用等待同一个任务并拿到相同的结果。
+        """
+        task = self.pending_draws.get(lottery_id)
+        owner = task is None
+        if owner:
+            task = asyncio.create_task(self._draw_and_complete(lottery_id, prizes, participant_count))
+            self.pending_draws[lottery_id] = task
+            task.add_done_callback(lambda _: self.pending_draws.pop(lottery_id, None))
+        
+        # shield: 某个调用被取消时不影响正在进行的开奖
+        winners, committed = await asyncio.shield(task)
+        return winners, owner and committed
+    
+    async def auto_draw_lottery(self, lottery_id: int, guild_id: int, channel_id: int, title: str, prizes: List[Dict]):
         """自动开奖"""
         guild = self.get_guild(guild_id)
         if not guild:
@@ -183,48 +354,30 @@ class LotteryBot(commands.Bot):
         if not channel:
             return
         
-        prizes = json.loads(prizes_json)
+        # 获取参与人数
+        participant_count = await self.db.get_participant_count(lottery_id)
         
-        # 获取参与者
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT user_id, weight FROM participants WHERE lottery_id = ?', (lottery_id,))
-        participants = cursor.fetchall()
-        
-        if not participants:
-            embed = discord.Embed(
-                title="🎲 自动开奖结果",
-                description=f"**{title}**\n\n❌ 没有参与者，抽奖已取消",
-                color=0xff6b6b
-            )
-            await channel.send(embed=embed)
+        if not participant_count:
+            # 只在抽奖仍进行中且依然没有参与者时取消，不覆盖并发的开奖或参与
+            if await self.db.update_lottery_status(lottery_id, 'cancelled', require_empty=True):
+                embed = discord.Embed(
+                    title="🎲 自动开奖结果",
+                    description=f"**{title}**\n\n❌ 没有参与者，抽奖已取消",
+                    color=0xff6b6b
+                )
+                await channel.send(embed=embed)
+                return
             
-            # 更新状态为已取消
-            cursor.execute('UPDATE lotteries SET status = "cancelled" WHERE id = ?', (lottery_id,))
-            self.conn.commit()
-            return
-        
-        # 进行抽奖
-        winners = []
-        for prize in prizes:
-            if participants:
-                # 加权随机选择
-                weights = [p[1] for p in participants]
-                chosen_participant = random.choices(participants, weights=weights)[0]
-                winners.append((chosen_participant[0], prize['name']))
-                
-                # 如果不允许重复中奖，移除已中奖用户
-                participants = [p for p in participants if p[0] != chosen_participant[0]]
-        
-        # 保存中奖记录
-        for user_id, prize_name in winners:
-            cursor.execute('''
-                INSERT INTO winners (lottery_id, user_id, prize_name)
-                VALUES (?, ?, ?)
-            ''', (lottery_id, user_id, prize_name))
+            # 取消未生效：刚有人参与时继续开奖；已被其他操作结束时下面的开奖不会抢到结果
+            participant_count = await self.db.get_participant_count(lottery_id)
+            if not participant_count:
+                return
         
-        # 更新抽奖状态
-        cursor.execute('UPDATE lotteries SET status = "ended" WHERE id = ?', (lottery_id,))
-        self.conn.commit()
+        # 进行抽奖：按权重不放回抽样，每个奖品按数量占多个名额
+        winners, drawn = await self.run_draw(lottery_id, prizes, participant_count)
+        if not drawn:
+            # 已由手动开奖完成并公布结果
+            return
         
         # 发送中奖结果
         embed = discord.Embed(
@@ -242,12 +395,37 @@ class LotteryBot(commands.Bot):
                 inline=False
             )
         
-        embed.set_footer(text=f"开奖时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        embed.set_footer(text=f"开奖时间: {self.format_time(self.clock.now(), '%Y-%m-%d %H:%M:%S')}")
         await channel.send(embed=embed)
 
 # 创建机器人实例
 bot = LotteryBot()
 
+def idempotent(handler):
+    """按interaction.id去重：同一交互再次到达时重放已记录的响应，不再执行命令"""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        interaction = next(arg for arg in (*args, *kwargs.values()) if isinstance(arg, discord.Interaction))
+        while True:
+            record, first = bot.interaction_log.claim(interaction.id)
+            if first:
+                break
+            
+            # 首次处理已确认过该交互，不能再次回复，等它结束后通过followup重放
+            await record.done.wait()
+            if record.responses:
+                logger.info(f"交互 {interaction.id} 重复投递，重放已记录的响应")
+                for content, send_kwargs in record.responses:
+                    await interaction.followup.send(content, **send_kwargs)
+                return
+            # 首次处理没有发出任何响应（例如出错），记录已被丢弃，重新执行
+        
+        try:
+            await handler(*args, **kwargs)
+        finally:
+            bot.interaction_log.finish(interaction.id)
+    return wrapper
+
 @bot.event
 async def on_message(message):
     """监听消息事件，检测S1命令"""
@@ -341,7 +519,7 @@ async def lottery_main(interaction: discord.Interaction):
     
     embed.add_field(
         name="🏆 开奖",
-        value="`/开奖` - 手动开奖",
+        value="`/开奖` - 手动开奖\n`/重抽` - 候补递补中奖者",
         inline=True
     )
     
@@ -403,8 +581,8 @@ async def create_lottery(
         end_time = None
         if 结束时间:
             try:
-                end_time = datetime.datetime.strptime(结束时间, "%Y-%m-%d %H:%M")
-                if end_time <= datetime.datetime.now():
+                end_time = int(datetime.datetime.strptime(结束时间, "%Y-%m-%d %H:%M").timestamp())
+                if end_time <= bot.clock.time():
                     await interaction.followup.send("❌ 结束时间必须是未来的时间！", ephemeral=True)
                     return
             except ValueError:
@@ -424,27 +602,20 @@ async def create_lottery(
                     return
         
         # 保存到数据库
-        cursor = bot.conn.cursor()
-        cursor.execute('''
-            INSERT INTO lotteries (
-                guild_id, channel_id, creator_id, title, description, prizes,
-                max_participants, end_time, allow_multiple_entries, required_roles
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            interaction.guild.id,
-            interaction.channel.id,
-            interaction.user.id,
-            标题,
-            描述 or "无描述",
-            json.dumps(prizes_data, ensure_ascii=False),
-            最大参与人数,
-            end_time,
-            允许重复参与,
-            json.dumps(required_roles) if required_roles else None
-        ))
-        
-        lottery_id = cursor.lastrowid
-        bot.conn.commit()
+        lottery_id = await bot.db.create_lottery(
+            guild_id=interaction.guild.id,
+            channel_id=interaction.channel.id,
+            creator_id=interaction.user.id,
+            title=标题,
+            prizes=prizes_data,
+            description=描述,
+            max_participants=最大参与人数,
+            end_time=end_time,
+            allow_multiple=允许重复参与,
+            required_roles=required_roles
+        )
+        if end_time:
+            bot.scheduler.schedule(lottery_id, end_time)
         
         # 创建嵌入消息
         embed = discord.Embed(
@@ -465,7 +636,7 @@ async def create_lottery(
             info_text.append("👥 参与人数: 无限制")
         
         if end_time:
-            info_text.append(f"⏰ 结束时间: {end_time.strftime('%Y-%m-%d %H:%M')}")
+            info_text.append(f"⏰ 结束时间: {bot.format_time(end_time)}")
         else:
             info_text.append("⏰ 开奖方式: 手动开奖")
         
@@ -485,7 +656,7 @@ async def create_lottery(
         )
         
         embed.set_footer(text=f"抽奖ID: {lottery_id} | 创建者: {interaction.user.display_name}")
-        embed.timestamp = datetime.datetime.now()
+        embed.timestamp = datetime.datetime.fromtimestamp(bot.clock.time(), datetime.timezone.utc)
         
         # 创建并附加参与按钮视图
         view = LotteryParticipateView(lottery_id)
@@ -500,78 +671,44 @@ async def create_lottery(
 
 @bot.tree.command(name="参与抽奖", description="🎯 参与指定的抽奖活动")
 @app_commands.describe(抽奖id="要参与的抽奖活动ID")
+@idempotent
 async def join_lottery(interaction: discord.Interaction, 抽奖id: int):
     """参与抽奖"""
+    rejection = bot.check_join_request(interaction.user.id, 抽奖id, 
+                                       interaction.guild.id if interaction.guild else None)
+    if rejection:
+        await bot.respond(interaction, rejection, ephemeral=True)
+        return
+    
     await interaction.response.defer(ephemeral=True)
     
     try:
-        cursor = bot.conn.cursor()
-        
         # 检查抽奖是否存在且活跃
-        cursor.execute('''
-            SELECT title, description, max_participants, required_roles, status, allow_multiple_entries
-            FROM lotteries 
-            WHERE id = ? AND guild_id = ?
-        ''', (抽奖id, interaction.guild.id))
-        
-        lottery = cursor.fetchone()
+        lottery = await bot.db.get_lottery_for_join(抽奖id, interaction.guild.id)
         if not lottery:
-            await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
+            await bot.respond(interaction, "❌ 找不到指定的抽奖活动！", ephemeral=True)
             return
         
-        title, description, max_participants, required_roles_json, status, allow_multiple = lottery
-        
-        if status != 'active':
-            await interaction.followup.send("❌ 该抽奖活动已结束或被取消！", ephemeral=True)
-            return
-        
-        # 检查用户是否已参与
-        cursor.execute('SELECT id FROM participants WHERE lottery_id = ? AND user_id = ?', 
-                      (抽奖id, interaction.user.id))
-        existing = cursor.fetchone()
-        
-        if existing and not allow_multiple:
-            await interaction.followup.send("❌ 您已经参与了这个抽奖活动！", ephemeral=True)
-            return
+        title = lottery['title']
+        max_participants = lottery['max_participants']
+        required_roles = lottery['required_roles']
         
         # 检查角色要求
-        if required_roles_json:
-            required_roles = json.loads(required_roles_json)
+        if required_roles:
             user_roles = [role.id for role in interaction.user.roles]
             if not any(role_id in user_roles for role_id in required_roles):
                 role_mentions = [f"<@&{role_id}>" for role_id in required_roles]
-                await interaction.followup.send(
+                await bot.respond(interaction, 
                     f"❌ 您需要拥有以下角色之一才能参与: {', '.join(role_mentions)}", 
                     ephemeral=True
                 )
                 return
         
-        # 检查参与人数限制
-        if max_participants > 0:
-            cursor.execute('SELECT COUNT(*) FROM participants WHERE lottery_id = ?', (抽奖id,))
-            current_count = cursor.fetchone()[0]
-            if current_count >= max_participants:
-                await interaction.followup.send("❌ 该抽奖活动参与人数已满！", ephemeral=True)
-                return
-        
-        # 添加参与者
-        if existing and allow_multiple:
-            # 如果允许重复参与，增加权重
-            cursor.execute('''
-                UPDATE participants SET weight = weight + 1 
-                WHERE lottery_id = ? AND user_id = ?
-            ''', (抽奖id, interaction.user.id))
-        else:
-            cursor.execute('''
-                INSERT INTO participants (lottery_id, user_id, discord_id)
-                VALUES (?, ?, ?)
-            ''', (抽奖id, interaction.user.id, str(interaction.user.id)))
-        
-        bot.conn.commit()
-        
-        # 获取当前参与人数
-        cursor.execute('SELECT COUNT(*) FROM participants WHERE lottery_id = ?', (抽奖id,))
-        total_participants = cursor.fetchone()[0]
+        # 状态、人数上限和重复参与在数据库中原子判断
+        result, total_participants = await bot.db.join_lottery(抽奖id, interaction.user.id)
+        if result in JOIN_REJECTIONS:
+            await bot.respond(interaction, JOIN_REJECTIONS[result], ephemeral=True)
+            return
         
         embed = discord.Embed(
             title="✅ 参与成功！",
@@ -588,7 +725,7 @@ async def join_lottery(interaction: discord.Interaction, 抽奖id: int):
         
         embed.set_footer(text="祝您好运！🍀")
         
-        await interaction.followup.send(embed=embed, ephemeral=True)
+        await bot.respond(interaction, embed=embed, ephemeral=True)
         
         logger.info(f"用户 {interaction.user} 参与了抽奖 {抽奖id}")
         
@@ -603,30 +740,27 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
     await interaction.response.defer()
     
     try:
-        cursor = bot.conn.cursor()
-        
         if 抽奖id:
             # 查看特定抽奖
-            cursor.execute('''
-                SELECT id, title, description, prizes, max_participants, end_time, 
-                       status, created_at, creator_id, allow_multiple_entries
-                FROM lotteries 
-                WHERE id = ? AND guild_id = ?
-            ''', (抽奖id, interaction.guild.id))
-            
-            lottery = cursor.fetchone()
+            lottery = await bot.db.get_lottery(抽奖id, interaction.guild.id)
             if not lottery:
                 await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
                 return
             
-            (lid, title, description, prizes_json, max_participants, end_time, 
-             status, created_at, creator_id, allow_multiple) = lottery
-            
-            prizes = json.loads(prizes_json)
+            lid = lottery['id']
+            title = lottery['title']
+            description = lottery['description']
+            prizes = lottery['prizes']
+            max_participants = lottery['max_participants']
+            end_time = lottery['end_time']
+            status = lottery['status']
+            created_at = lottery['created_at']
+            creator_id = lottery['creator_id']
+            allow_multiple = lottery['allow_multiple_entries']
             
             # 获取参与者信息
-            cursor.execute('SELECT COUNT(*) FROM participants WHERE lottery_id = ?', (lid,))
-            participant_count = cursor.fetchone()[0]
+            participant_count = lottery['participant_count']
+            total_weight = lottery['total_weight']
             
             # 获取创建者信息
             creator = interaction.guild.get_member(creator_id)
@@ -658,7 +792,7 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
             if max_participants > 0:
                 participant_info += f" / {max_participants}人"
             if allow_multiple:
-                participant_info += "\n🔄 允许重复参与"
+                participant_info += f"\n🔄 允许重复参与 (总权重: {total_weight})"
             
             embed.add_field(
                 name="👥 参与情况",
@@ -667,10 +801,9 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
             )
             
             # 时间信息
-            time_info = f"创建时间: {created_at}"
+            time_info = f"创建时间: {bot.format_time(created_at)}"
             if end_time:
-                end_datetime = datetime.datetime.fromisoformat(end_time.replace('Z', '+00:00')) if isinstance(end_time, str) else end_time
-                countdown = self.format_countdown(end_datetime)
+                countdown = bot.format_countdown(end_time)
                 time_info += f"\n⏰ 倒计时: {countdown}"
             else:
                 time_info += "\n开奖方式: 手动开奖"
@@ -682,7 +815,8 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
             )
             
             # 奖品信息
-            prize_list = "\n".join([f"🏆 {prize['name']}" for prize in prizes])
+            prize_list = "\n".join([f"🏆 {prize['name']}" + (f" ×{prize['quantity']}" if prize['quantity'] > 1 else "")
+                                    for prize in prizes])
             embed.add_field(
                 name="🎁 奖品列表",
                 value=prize_list,
@@ -700,15 +834,7 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
             
         else:
             # 查看所有活跃抽奖
-            cursor.execute('''
-                SELECT id, title, max_participants, end_time, creator_id
-                FROM lotteries 
-                WHERE guild_id = ? AND status = 'active'
-                ORDER BY created_at DESC
-                LIMIT 10
-            ''', (interaction.guild.id,))
-            
-            lotteries = cursor.fetchall()
+            lotteries = await bot.db.get_active_lotteries(interaction.guild.id, limit=10)
             
             if not lotteries:
                 embed = discord.Embed(
@@ -725,10 +851,13 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
                 color=0x4ecdc4
             )
             
-            for lid, title, max_participants, end_time, creator_id in lotteries:
-                # 获取参与人数
-                cursor.execute('SELECT COUNT(*) FROM participants WHERE lottery_id = ?', (lid,))
-                participant_count = cursor.fetchone()[0]
+            for lottery in lotteries:
+                lid = lottery['id']
+                title = lottery['title']
+                max_participants = lottery['max_participants']
+                end_time = lottery['end_time']
+                creator_id = lottery['creator_id']
+                participant_count = lottery['participant_count']
                 
                 creator = interaction.guild.get_member(creator_id)
                 creator_name = creator.display_name if creator else "未知用户"
@@ -738,8 +867,7 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
                     participant_info += f" / {max_participants}人"
                 
                 if end_time:
-                    end_datetime = datetime.datetime.fromisoformat(end_time.replace('Z', '+00:00')) if isinstance(end_time, str) else end_time
-                    countdown = self.format_countdown(end_datetime)
+                    countdown = bot.format_countdown(end_time)
                     time_info = f"⏰ {countdown}"
                 else:
                     time_info = "手动开奖"
@@ -762,81 +890,54 @@ async def view_lottery(interaction: discord.Interaction, 抽奖id: Optional[int]
 
 @bot.tree.command(name="开奖", description="🏆 手动开奖 (仅创建者和管理员可用)")
 @app_commands.describe(抽奖id="要开奖的抽奖活动ID")
+@idempotent
 async def draw_lottery(interaction: discord.Interaction, 抽奖id: int):
     """手动开奖"""
     await interaction.response.defer()
     
     try:
-        cursor = bot.conn.cursor()
-        
         # 检查抽奖是否存在
-        cursor.execute('''
-            SELECT title, prizes, creator_id, status
-            FROM lotteries 
-            WHERE id = ? AND guild_id = ?
-        ''', (抽奖id, interaction.guild.id))
-        
-        lottery = cursor.fetchone()
+        lottery = await bot.db.get_lottery(抽奖id, interaction.guild.id)
         if not lottery:
-            await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
+            await bot.respond(interaction, "❌ 找不到指定的抽奖活动！", ephemeral=True)
             return
         
-        title, prizes_json, creator_id, status = lottery
+        title = lottery['title']
+        creator_id = lottery['creator_id']
+        status = lottery['status']
         
         # 检查权限
         if (interaction.user.id != creator_id and 
             not interaction.user.guild_permissions.manage_messages):
-            await interaction.followup.send("❌ 只有抽奖创建者或管理员才能开奖！", ephemeral=True)
+            await bot.respond(interaction, "❌ 只有抽奖创建者或管理员才能开奖！", ephemeral=True)
             return
         
         if status != 'active':
-            await interaction.followup.send("❌ 该抽奖活动已结束或被取消！", ephemeral=True)
+            await bot.respond(interaction, "❌ 该抽奖活动已结束或被取消！", ephemeral=True)
             return
         
-        # 获取参与者
-        cursor.execute('SELECT user_id, weight FROM participants WHERE lottery_id = ?', (抽奖id,))
-        participants = cursor.fetchall()
+        # 获取参与人数
+        participant_count = lottery['participant_count']
         
-        if not participants:
+        if not participant_count:
             embed = discord.Embed(
                 title="🎲 开奖结果",
                 description=f"**{title}**\n\n❌ 没有参与者，无法进行开奖！",
                 color=0xff6b6b
             )
-            await interaction.followup.send(embed=embed)
+            await bot.respond(interaction, embed=embed)
             return
         
-        prizes = json.loads(prizes_json)
-        
-        # 进行抽奖
-        winners = []
-        available_participants = participants.copy()
-        
-        for prize in prizes:
-            if available_participants:
-                # 加权随机选择
-                weights = [p[1] for p in available_participants]
-                chosen_participant = random.choices(available_participants, weights=weights)[0]
-                winners.append((chosen_participant[0], prize['name']))
-                
-                # 移除已中奖用户（避免重复中奖）
-                available_participants = [p for p in available_participants if p[0] != chosen_participant[0]]
-        
-        # 保存中奖记录
-        for user_id, prize_name in winners:
-            cursor.execute('''
-                INSERT INTO winners (lottery_id, user_id, prize_name)
-                VALUES (?, ?, ?)
-            ''', (抽奖id, user_id, prize_name))
+        prizes = lottery['prizes']
         
-        # 更新抽奖状态
-        cursor.execute('UPDATE lotteries SET status = "ended" WHERE id = ?', (抽奖id,))
-        bot.conn.commit()
+        # 进行抽奖：按权重不放回抽样，同一用户不会重复中奖
+        winners, drawn = await bot.run_draw(抽奖id, prizes, participant_count)
+        bot.scheduler.cancel(抽奖id)
         
-        # 创建中奖结果嵌入
+        # 创建中奖结果嵌入；与其他开奖操作撞车时展示已记录的结果
         embed = discord.Embed(
             title="🎉 开奖结果",
-            description=f"**{title}**\n\n恭喜以下用户中奖！",
+            description=f"**{title}**\n\n" + ("恭喜以下用户中奖！" if drawn else "该抽奖已被开奖，以下为开奖结果："),
             color=0x4ecdc4
         )
         
@@ -851,14 +952,14 @@ async def draw_lottery(interaction: discord.Interaction, 抽奖id: int):
         
         embed.add_field(
             name="📊 抽奖统计",
-            value=f"总参与人数: {len(participants)}人\n" +
+            value=f"总参与人数: {participant_count}人\n" +
                   f"中奖人数: {len(winners)}人",
             inline=False
         )
         
-        embed.set_footer(text=f"开奖时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | 执行者: {interaction.user.display_name}")
+        embed.set_footer(text=f"开奖时间: {bot.format_time(bot.clock.now(), '%Y-%m-%d %H:%M:%S')} | 执行者: {interaction.user.display_name}")
         
-        await interaction.followup.send(embed=embed)
+        await bot.respond(interaction, embed=embed)
         
         logger.info(f"用户 {interaction.user} 对抽奖 {抽奖id} 进行了开奖")
         
@@ -980,31 +1081,18 @@ class AdminControlView(discord.ui.View):
     
     async def show_server_stats(self, interaction: discord.Interaction):
         """显示服务器统计"""
-        cursor = bot.conn.cursor()
-        
         # 获取所有服务器统计
         guilds_info = []
         for guild in bot.guilds:
-            cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ?', (guild.id,))
-            total_lotteries = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ? AND status = "active"', (guild.id,))
-            active_lotteries = cursor.fetchone()[0]
-            
-            cursor.execute('''
-                SELECT COUNT(*) FROM participants p
-                JOIN lotteries l ON p.lottery_id = l.id
-                WHERE l.guild_id = ?
-            ''', (guild.id,))
-            total_participants = cursor.fetchone()[0]
+            summary = await bot.db.get_guild_summary(guild.id)
             
             guilds_info.append({
                 'name': guild.name,
                 'id': guild.id,
                 'member_count': guild.member_count,
-                'total_lotteries': total_lotteries,
-                'active_lotteries': active_lotteries,
-                'total_participants': total_participants
+                'total_lotteries': summary['total_lotteries'],
+                'active_lotteries': summary['active_lotteries'],
+                'total_participants': summary['total_participations']
             })
         
         # 创建统计嵌入
@@ -1029,7 +1117,7 @@ class AdminControlView(discord.ui.View):
             embed.set_footer(text=f"显示前10个服务器，总共{len(bot.guilds)}个服务器")
         
         await interaction.followup.send(embed=embed, ephemeral=True)
-
+    
     async def show_user_management(self, interaction: discord.Interaction):
         """显示用户管理面板"""
         embed = discord.Embed(
@@ -1140,6 +1228,18 @@ class AdminControlView(discord.ui.View):
             inline=True
         )
         
+        embed.add_field(
+            name="🎲 自动开奖",
+            value=bot.format_draw_worker_stats(),
+            inline=False
+        )
+        
+        embed.add_field(
+            name="🚦 参与限流",
+            value=bot.format_join_stats(),
+            inline=False
+        )
+        
         view = RealtimeMonitorView()
         await interaction.followup.send(embed=embed, view=view, ephemeral=True)
     
@@ -1164,20 +1264,7 @@ class AdminControlView(discord.ui.View):
     
     async def show_active_lotteries_management(self, interaction: discord.Interaction):
         """显示所有活跃抽奖"""
-        cursor = bot.conn.cursor()
-        
-        cursor.execute('''
-            SELECT l.id, l.title, l.guild_id, l.creator_id, l.created_at, l.end_time,
-                   COUNT(p.id) as participant_count
-            FROM lotteries l
-            LEFT JOIN participants p ON l.id = p.lottery_id
-            WHERE l.status = 'active'
-            GROUP BY l.id
-            ORDER BY l.created_at DESC
-            LIMIT 20
-        ''')
-        
-        active_lotteries = cursor.fetchall()
+        active_lotteries = await bot.db.get_all_active_lotteries(limit=20)
         
         if not active_lotteries:
             embed = discord.Embed(
@@ -1193,22 +1280,21 @@ class AdminControlView(discord.ui.View):
             )
             
             for lottery in active_lotteries[:10]:
-                guild = bot.get_guild(lottery[2])
+                guild = bot.get_guild(lottery['guild_id'])
                 guild_name = guild.name if guild else "未知服务器"
                 
-                creator = bot.get_user(lottery[3])
+                creator = bot.get_user(lottery['creator_id'])
                 creator_name = creator.display_name if creator else "未知用户"
                 
                 countdown = "手动开奖"
-                if lottery[5]:  # end_time
-                    end_time = datetime.datetime.fromisoformat(lottery[5])
-                    countdown = bot.format_countdown(end_time)
+                if lottery['end_time']:
+                    countdown = bot.format_countdown(lottery['end_time'])
                 
                 embed.add_field(
-                    name=f"🎯 {lottery[1]} (ID: {lottery[0]})",
+                    name=f"🎯 {lottery['title']} (ID: {lottery['id']})",
                     value=f"🏰 服务器: {guild_name}\n" +
                           f"👤 创建者: {creator_name}\n" +
-                          f"👥 参与: {lottery[6]}人\n" +
+                          f"👥 参与: {lottery['participant_count']}人\n" +
                           f"⏰ {countdown}",
                     inline=True
                 )
@@ -1233,30 +1319,15 @@ class AdminControlView(discord.ui.View):
     
     async def show_detailed_report(self, interaction: discord.Interaction):
         """显示详细报告"""
-        cursor = bot.conn.cursor()
-        
         # 收集详细统计数据
-        cursor.execute('SELECT COUNT(*) FROM lotteries')
-        total_lotteries = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM participants')
-        total_participants = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM winners')
-        total_winners = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE status = "active"')
-        active_lotteries = cursor.fetchone()[0]
+        stats = await bot.db.get_global_stats()
+        total_lotteries = stats['total_lotteries']
+        total_participants = stats['total_participants']
+        total_winners = stats['total_winners']
+        active_lotteries = stats['active_lotteries']
         
         # 最活跃的服务器
-        cursor.execute('''
-            SELECT l.guild_id, COUNT(*) as lottery_count
-            FROM lotteries l
-            GROUP BY l.guild_id
-            ORDER BY lottery_count DESC
-            LIMIT 5
-        ''')
-        top_guilds = cursor.fetchall()
+        top_guilds = await bot.db.get_top_guilds(limit=5)
         
         embed = discord.Embed(
             title="📈 机器人详细使用报告",
@@ -1277,8 +1348,8 @@ class AdminControlView(discord.ui.View):
         
         if top_guilds:
             guild_text = "\n".join([
-                f"{i+1}. {bot.get_guild(guild_id).name if bot.get_guild(guild_id) else 'Unknown'}: {count}个抽奖"
-                for i, (guild_id, count) in enumerate(top_guilds)
+                f"{i+1}. {bot.get_guild(row['guild_id']).name if bot.get_guild(row['guild_id']) else 'Unknown'}: {row['lottery_count']}个抽奖"
+                for i, row in enumerate(top_guilds)
             ])
             embed.add_field(
                 name="🏆 最活跃服务器",
@@ -1396,31 +1467,7 @@ class SystemManagementView(discord.ui.View):
         await interaction.response.defer()
         
         # 清理90天前的数据
-        cursor = bot.conn.cursor()
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=90)
-        
-        # 删除旧的已结束抽奖
-        cursor.execute('''
-            DELETE FROM winners WHERE lottery_id IN (
-                SELECT id FROM lotteries 
-                WHERE status IN ('ended', 'cancelled') AND created_at < ?
-            )
-        ''', (cutoff_date,))
-        
-        cursor.execute('''
-            DELETE FROM participants WHERE lottery_id IN (
-                SELECT id FROM lotteries 
-                WHERE status IN ('ended', 'cancelled') AND created_at < ?
-            )
-        ''', (cutoff_date,))
-        
-        cursor.execute('''
-            DELETE FROM lotteries 
-            WHERE status IN ('ended', 'cancelled') AND created_at < ?
-        ''', (cutoff_date,))
-        
-        deleted_count = cursor.rowcount
-        bot.conn.commit()
+        deleted_count = await bot.db.cleanup_old_data(days=90)
         
         embed = discord.Embed(
             title="🗑️ 数据清理完成",
@@ -1438,20 +1485,12 @@ class SystemManagementView(discord.ui.View):
         
         await interaction.response.defer()
         
-        cursor = bot.conn.cursor()
-        
         # 获取各表的记录数
-        cursor.execute('SELECT COUNT(*) FROM lotteries')
-        lotteries_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM participants')
-        participants_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM winners')
-        winners_count = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM statistics')
-        stats_count = cursor.fetchone()[0]
+        stats = await bot.db.get_global_stats()
+        lotteries_count = stats['total_lotteries']
+        participants_count = stats['total_participants']
+        winners_count = stats['total_winners']
+        stats_count = stats['total_statistics']
         
         embed = discord.Embed(
             title="📊 数据库状态",
@@ -1470,7 +1509,7 @@ class SystemManagementView(discord.ui.View):
         
         # 数据库文件大小
         try:
-            db_size = os.path.getsize('lottery_bot.db')
+            db_size = os.path.getsize(bot.db.db_name)
             size_mb = db_size / (1024 * 1024)
             embed.add_field(
                 name="💾 数据库文件",
@@ -1480,6 +1519,18 @@ class SystemManagementView(discord.ui.View):
         except:
             pass
         
+        # 运行参数
+        journal_mode = await bot.db.fetchval('PRAGMA journal_mode')
+        schema_version = await bot.db.fetchval('PRAGMA user_version')
+        embed.add_field(
+            name="⚙️ 运行参数",
+            value=f"表结构版本: v{schema_version}\n" +
+                  f"日志模式: {journal_mode}\n" +
+                  f"同步级别: {config.DB_SYNCHRONOUS}\n" +
+                  f"只读连接池: {config.DB_READ_POOL_SIZE}",
+            inline=False
+        )
+        
         await interaction.followup.send(embed=embed, ephemeral=True)
 
 @bot.tree.command(name="抽奖统计", description="📈 查看抽奖统计信息")
@@ -1489,40 +1540,14 @@ async def lottery_stats(interaction: discord.Interaction, 用户: Optional[disco
     await interaction.response.defer()
     
     try:
-        cursor = bot.conn.cursor()
-        
         if 用户:
             # 查看特定用户统计
             user_id = 用户.id
             
-            # 参与的抽奖数量
-            cursor.execute('''
-                SELECT COUNT(DISTINCT lottery_id) FROM participants 
-                WHERE user_id = ? AND lottery_id IN (
-                    SELECT id FROM lotteries WHERE guild_id = ?
-                )
-            ''', (user_id, interaction.guild.id))
-            participated_count = cursor.fetchone()[0]
-            
-            # 中奖次数
-            cursor.execute('''
-                SELECT COUNT(*) FROM winners 
-                WHERE user_id = ? AND lottery_id IN (
-                    SELECT id FROM lotteries WHERE guild_id = ?
-                )
-            ''', (user_id, interaction.guild.id))
-            won_count = cursor.fetchone()[0]
-            
-            # 最近中奖记录
-            cursor.execute('''
-                SELECT l.title, w.prize_name, w.won_at 
-                FROM winners w
-                JOIN lotteries l ON w.lottery_id = l.id
-                WHERE w.user_id = ? AND l.guild_id = ?
-                ORDER BY w.won_at DESC
-                LIMIT 5
-            ''', (user_id, interaction.guild.id))
-            recent_wins = cursor.fetchall()
+            stats = await bot.db.get_user_stats(user_id, interaction.guild.id)
+            participated_count = stats['participated_count']
+            won_count = stats['won_count']
+            recent_wins = stats['recent_wins']
             
             embed = discord.Embed(
                 title=f"📊 {用户.display_name} 的抽奖统计",
@@ -1532,20 +1557,21 @@ async def lottery_stats(interaction: discord.Interaction, 用户: Optional[disco
             embed.set_thumbnail(url=用户.display_avatar.url)
             
             # 基本统计
-            win_rate = (won_count / participated_count * 100) if participated_count > 0 else 0
+            win_rate = stats['win_rate']
             embed.add_field(
                 name="🎯 基本统计",
                 value=f"参与抽奖: {participated_count} 次\n" +
                       f"中奖次数: {won_count} 次\n" +
-                      f"中奖率: {win_rate:.1f}%",
+                      f"中奖率: {win_rate:.1f}%" +
+                      (f"\n最近中奖: {bot.format_time(stats['last_win_at'])}" if stats['last_win_at'] else ""),
                 inline=True
             )
             
             # 最近中奖记录
             if recent_wins:
                 recent_text = "\n".join([
-                    f"• **{title}** - {prize_name}\n  {won_at}"
-                    for title, prize_name, won_at in recent_wins[:3]
+                    f"• **{win['title']}** - {win['prize_name']}\n  {bot.format_time(win['won_at'])}"
+                    for win in recent_wins[:3]
                 ])
                 embed.add_field(
                     name="🏆 最近中奖记录",
@@ -1563,53 +1589,13 @@ async def lottery_stats(interaction: discord.Interaction, 用户: Optional[disco
             
         else:
             # 查看服务器统计
-            # 总抽奖数
-            cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ?', (interaction.guild.id,))
-            total_lotteries = cursor.fetchone()[0]
-            
-            # 活跃抽奖数
-            cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ? AND status = "active"', (interaction.guild.id,))
-            active_lotteries = cursor.fetchone()[0]
-            
-            # 总参与次数
-            cursor.execute('''
-                SELECT COUNT(*) FROM participants p
-                JOIN lotteries l ON p.lottery_id = l.id
-                WHERE l.guild_id = ?
-            ''', (interaction.guild.id,))
-            total_participations = cursor.fetchone()[0]
-            
-            # 总中奖次数
-            cursor.execute('''
-                SELECT COUNT(*) FROM winners w
-                JOIN lotteries l ON w.lottery_id = l.id
-                WHERE l.guild_id = ?
-            ''', (interaction.guild.id,))
-            total_wins = cursor.fetchone()[0]
-            
-            # 最活跃的用户
-            cursor.execute('''
-                SELECT p.user_id, COUNT(*) as participation_count
-                FROM participants p
-                JOIN lotteries l ON p.lottery_id = l.id
-                WHERE l.guild_id = ?
-                GROUP BY p.user_id
-                ORDER BY participation_count DESC
-                LIMIT 5
-            ''', (interaction.guild.id,))
-            top_participants = cursor.fetchall()
-            
-            # 最幸运的用户
-            cursor.execute('''
-                SELECT w.user_id, COUNT(*) as win_count
-                FROM winners w
-                JOIN lotteries l ON w.lottery_id = l.id
-                WHERE l.guild_id = ?
-                GROUP BY w.user_id
-                ORDER BY win_count DESC
-                LIMIT 5
-            ''', (interaction.guild.id,))
-            top_winners = cursor.fetchall()
+            stats = await bot.db.get_guild_stats(interaction.guild.id)
+            total_lotteries = stats['total_lotteries']
+            active_lotteries = stats['active_lotteries']
+            total_participations = stats['total_participations']
+            total_wins = stats['total_wins']
+            top_participants = stats['top_participants']
+            top_winners = stats['top_winners']
             
             embed = discord.Embed(
                 title=f"📊 {interaction.guild.name} 抽奖统计",
@@ -1639,8 +1625,8 @@ async def lottery_stats(interaction: discord.Interaction, 用户: Optional[disco
             # 最活跃用户
             if top_participants:
                 participant_text = "\n".join([
-                    f"{i+1}. <@{user_id}> - {count}次"
-                    for i, (user_id, count) in enumerate(top_participants[:3])
+                    f"{i+1}. <@{row['user_id']}> - {row['participation_count']}次"
+                    for i, row in enumerate(top_participants[:3])
                 ])
                 embed.add_field(
                     name="🔥 最活跃用户",
@@ -1651,8 +1637,8 @@ async def lottery_stats(interaction: discord.Interaction, 用户: Optional[disco
             # 最幸运用户
             if top_winners:
                 winner_text = "\n".join([
-                    f"{i+1}. <@{user_id}> - {count}次中奖"
-                    for i, (user_id, count) in enumerate(top_winners[:3])
+                    f"{i+1}. <@{row['user_id']}> - {row['win_count']}次中奖"
+                    for i, row in enumerate(top_winners[:3])
                 ])
                 embed.add_field(
                     name="🍀 最幸运用户",
@@ -1780,21 +1766,15 @@ async def cancel_lottery(interaction: discord.Interaction, 抽奖id: int):
     await interaction.response.defer()
     
     try:
-        cursor = bot.conn.cursor()
-        
         # 检查抽奖是否存在
-        cursor.execute('''
-            SELECT title, creator_id, status
-            FROM lotteries 
-            WHERE id = ? AND guild_id = ?
-        ''', (抽奖id, interaction.guild.id))
-        
-        lottery = cursor.fetchone()
+        lottery = await bot.db.get_lottery(抽奖id, interaction.guild.id)
         if not lottery:
             await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
             return
         
-        title, creator_id, status = lottery
+        title = lottery['title']
+        creator_id = lottery['creator_id']
+        status = lottery['status']
         
         # 检查权限
         if (interaction.user.id != creator_id and 
@@ -1806,9 +1786,11 @@ async def cancel_lottery(interaction: discord.Interaction, 抽奖id: int):
             await interaction.followup.send("❌ 该抽奖活动已结束或已被取消！", ephemeral=True)
             return
         
-        # 更新抽奖状态
-        cursor.execute('UPDATE lotteries SET status = "cancelled" WHERE id = ?', (抽奖id,))
-        bot.conn.commit()
+        # 更新抽奖状态；期间已被开奖或取消时不覆盖
+        if not await bot.db.update_lottery_status(抽奖id, 'cancelled'):
+            await interaction.followup.send("❌ 该抽奖活动已结束或已被取消！", ephemeral=True)
+            return
+        bot.scheduler.cancel(抽奖id)
         
         embed = discord.Embed(
             title="❌ 抽奖已取消",
@@ -1822,7 +1804,7 @@ async def cancel_lottery(interaction: discord.Interaction, 抽奖id: int):
             inline=False
         )
         
-        embed.set_footer(text=f"取消时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        embed.set_footer(text=f"取消时间: {bot.format_time(bot.clock.now(), '%Y-%m-%d %H:%M:%S')}")
         
         await interaction.followup.send(embed=embed)
         
@@ -1832,46 +1814,108 @@ async def cancel_lottery(interaction: discord.Interaction, 抽奖id: int):
         logger.error(f"取消抽奖时出错: {e}")
         await interaction.followup.send("❌ 取消抽奖时出现错误，请稍后重试。", ephemeral=True)
 
+@bot.tree.command(name="重抽", description="🔄 用候补名单替换中奖者 (仅创建者和管理员可用)")
+@app_commands.describe(抽奖id="已开奖的抽奖活动ID", 用户="要替换的中奖者")
+async def reroll_lottery(interaction: discord.Interaction, 抽奖id: int, 用户: discord.Member):
+    """重抽：中奖者不符合条件或未领奖时由下一位候补递补"""
+    await interaction.response.defer()
+    
+    try:
+        lottery = await bot.db.get_lottery(抽奖id, interaction.guild.id)
+        if not lottery:
+            await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
+            return
+        
+        # 检查权限
+        if (interaction.user.id != lottery['creator_id'] and 
+            not interaction.user.guild_permissions.manage_messages):
+            await interaction.followup.send("❌ 只有抽奖创建者或管理员才能重抽！", ephemeral=True)
+            return
+        
+        if lottery['status'] != 'ended':
+            await interaction.followup.send("❌ 该抽奖活动还没有开奖！", ephemeral=True)
+            return
+        
+        if not any(winner['user_id'] == 用户.id for winner in await bot.db.get_lottery_winners(抽奖id)):
+            await interaction.followup.send(f"❌ {用户.display_name} 不是该抽奖的中奖者！", ephemeral=True)
+            return
+        
+        result = await bot.db.reroll_winner(抽奖id, 用户.id)
+        if not result:
+            await interaction.followup.send("❌ 候补名单已用完，无法重抽！", ephemeral=True)
+            return
+        
+        new_user_id, prize_name = result
+        new_user = interaction.guild.get_member(new_user_id)
+        new_mention = new_user.mention if new_user else f"<@{new_user_id}>"
+        
+        embed = discord.Embed(
+            title="🔄 重抽结果",
+            description=f"**{lottery['title']}**",
+            color=0x4ecdc4
+        )
+        embed.add_field(
+            name=f"🏆 {prize_name}",
+            value=f"{用户.mention} 的名额由候补 {new_mention} 递补，恭喜！",
+            inline=False
+        )
+        embed.set_footer(text=f"重抽时间: {bot.format_time(bot.clock.now(), '%Y-%m-%d %H:%M:%S')} | 执行者: {interaction.user.display_name}")
+        
+        await interaction.followup.send(embed=embed)
+        
+        logger.info(f"用户 {interaction.user} 对抽奖 {抽奖id} 进行了重抽: {用户.id} -> {new_user_id}")
+    
+    except Exception as e:
+        logger.error(f"重抽时出错: {e}")
+        await interaction.followup.send("❌ 重抽时出现错误，请稍后重试。", ephemeral=True)
+
+@bot.tree.command(name="候补名单", description="📋 查看已开奖抽奖的候补名单")
+@app_commands.describe(抽奖id="已开奖的抽奖活动ID")
+async def lottery_waitlist(interaction: discord.Interaction, 抽奖id: int):
+    """查看候补名单"""
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        lottery = await bot.db.get_lottery(抽奖id, interaction.guild.id)
+        if not lottery:
+            await interaction.followup.send("❌ 找不到指定的抽奖活动！", ephemeral=True)
+            return
+        
+        waitlist = await bot.db.get_waitlist(抽奖id)
+        
+        embed = discord.Embed(
+            title=f"📋 候补名单 - {lottery['title']}",
+            color=0x3498db
+        )
+        
+        if waitlist:
+            lines = []
+            for i, user_id in enumerate(waitlist, 1):
+                user = interaction.guild.get_member(user_id)
+                lines.append(f"{i}. {user.display_name if user else f'<@{user_id}>'}")
+            embed.description = "\n".join(lines)
+        else:
+            embed.description = "暂无候补（尚未开奖或候补已用完）"
+        
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    
+    except Exception as e:
+        logger.error(f"查看候补名单时出错: {e}")
+        await interaction.followup.send("❌ 查看候补名单时出现错误，请稍后重试。", ephemeral=True)
+
 @bot.tree.command(name="我的抽奖", description="👤 查看您参与和创建的抽奖")
 async def my_lotteries(interaction: discord.Interaction):
     """查看用户的抽奖"""
     await interaction.response.defer(ephemeral=True)
     
     try:
-        cursor = bot.conn.cursor()
         user_id = interaction.user.id
         
-        # 我创建的抽奖
-        cursor.execute('''
-            SELECT id, title, status, created_at
-            FROM lotteries 
-            WHERE creator_id = ? AND guild_id = ?
-            ORDER BY created_at DESC
-            LIMIT 5
-        ''', (user_id, interaction.guild.id))
-        created_lotteries = cursor.fetchall()
-        
-        # 我参与的抽奖
-        cursor.execute('''
-            SELECT l.id, l.title, l.status, p.joined_at
-            FROM participants p
-            JOIN lotteries l ON p.lottery_id = l.id
-            WHERE p.user_id = ? AND l.guild_id = ?
-            ORDER BY p.joined_at DESC
-            LIMIT 5
-        ''', (user_id, interaction.guild.id))
-        participated_lotteries = cursor.fetchall()
-        
-        # 我的中奖记录
-        cursor.execute('''
-            SELECT l.title, w.prize_name, w.won_at
-            FROM winners w
-            JOIN lotteries l ON w.lottery_id = l.id
-            WHERE w.user_id = ? AND l.guild_id = ?
-            ORDER BY w.won_at DESC
-            LIMIT 5
-        ''', (user_id, interaction.guild.id))
-        my_wins = cursor.fetchall()
+        # 我创建的、参与的抽奖和中奖记录
+        records = await bot.db.get_user_lotteries(user_id, interaction.guild.id, limit=5)
+        created_lotteries = records['created']
+        participated_lotteries = records['participated']
+        my_wins = records['wins']
         
         embed = discord.Embed(
             title=f"👤 {interaction.user.display_name} 的抽奖记录",
@@ -1880,11 +1924,18 @@ async def my_lotteries(interaction: discord.Interaction):
         
         embed.set_thumbnail(url=interaction.user.display_avatar.url)
         
+        counts = records['counts']
+        embed.add_field(
+            name="📊 统计",
+            value=f"创建: {counts['creations']} 次 | 参与: {counts['participations']} 次 | 中奖: {counts['wins']} 次",
+            inline=False
+        )
+        
         # 我创建的抽奖
         if created_lotteries:
             created_text = "\n".join([
-                f"• **{title}** ({status}) - ID: {lid}"
-                for lid, title, status, created_at in created_lotteries
+                f"• **{lottery['title']}** ({lottery['status']}) - ID: {lottery['id']}"
+                for lottery in created_lotteries
             ])
             embed.add_field(
                 name="📝 我创建的抽奖",
@@ -1895,8 +1946,8 @@ async def my_lotteries(interaction: discord.Interaction):
         # 我参与的抽奖
         if participated_lotteries:
             participated_text = "\n".join([
-                f"• **{title}** ({status}) - ID: {lid}"
-                for lid, title, status, joined_at in participated_lotteries
+                f"• **{lottery['title']}** ({lottery['status']}) - ID: {lottery['id']}"
+                for lottery in participated_lotteries
             ])
             embed.add_field(
                 name="🎯 我参与的抽奖",
@@ -1907,8 +1958,8 @@ async def my_lotteries(interaction: discord.Interaction):
         # 我的中奖记录
         if my_wins:
             wins_text = "\n".join([
-                f"🏆 **{title}** - {prize_name}\n  {won_at}"
-                for title, prize_name, won_at in my_wins[:3]
+                f"🏆 **{win['title']}** - {win['prize_name']}\n  {bot.format_time(win['won_at'])}"
+                for win in my_wins[:3]
             ])
             embed.add_field(
                 name="🎉 我的中奖记录",
@@ -1934,81 +1985,36 @@ class LotteryParticipateView(discord.ui.View):
         self.lottery_id = lottery_id
     
     @discord.ui.button(label="🎲 参加抽奖", style=discord.ButtonStyle.primary, emoji="🎲")
+    @idempotent
     async def participate_lottery(self, interaction: discord.Interaction, button: discord.ui.Button):
         """参加抽奖按钮"""
+        # 连续点击、重复参与和已满在defer之前直接拒绝
+        rejection = bot.check_join_request(interaction.user.id, self.lottery_id)
+        if rejection:
+            await bot.respond(interaction, rejection, ephemeral=True)
+            return
+        
         # 使用 defer 确保有足够时间处理
         await interaction.response.defer(ephemeral=True)
-
+        
         try:
-            # 获取数据库连接
-            cursor = bot.conn.cursor()
-
-            # 检查抽奖是否存在和有效
-            cursor.execute("""
-                SELECT title, end_time, max_participants, allow_multiple_entries, required_roles, 
-                       creator_id, guild_id, channel_id, status
-                FROM lotteries WHERE id = ?
-            """, (self.lottery_id,))
-            
-            lottery = cursor.fetchone()
-            if not lottery:
-                await interaction.followup.send("❌ 抽奖不存在！", ephemeral=True)
-                return
-            
-            # 正确的列索引
-            l_title, l_end_time, l_max_participants, l_allow_multiple, l_required_roles_json, _, _, _, l_status = lottery
-
-            if l_status != 'active':
-                await interaction.followup.send("❌ 抽奖已结束或被取消！", ephemeral=True)
+            # 同一抽奖短时间内的点击合并为一次批量写入，角色、状态和人数上限在批次中统一判断
+            role_ids = [role.id for role in interaction.user.roles] if interaction.guild else None
+            result, total_participants, lottery = await bot.join_coalescer.join(
+                self.lottery_id, interaction.user.id, role_ids
+            )
+            if result == JOIN_MISSING_ROLE:
+                role_mentions = [f"<@&{role_id}>" for role_id in lottery['required_roles']]
+                await bot.respond(interaction, f"❌ 您需要拥有以下角色之一才能参与: {', '.join(role_mentions)}", ephemeral=True)
                 return
-            
-            # 检查是否已过期
-            if l_end_time:
-                end_time = datetime.datetime.fromisoformat(l_end_time)
-                if datetime.datetime.now() > end_time:
-                    await interaction.followup.send("❌ 抽奖已过期！", ephemeral=True)
-                    return
-            
-            # 检查角色要求
-            if l_required_roles_json and interaction.guild:
-                required_roles_ids = json.loads(l_required_roles_json)
-                user_role_ids = {role.id for role in interaction.user.roles}
-                if not any(role_id in user_role_ids for role_id in required_roles_ids):
-                    role_mentions = [f"<@&{role_id}>" for role_id in required_roles_ids]
-                    await interaction.followup.send(f"❌ 您需要拥有以下角色之一才能参与: {', '.join(role_mentions)}", ephemeral=True)
-                    return
-            
-            # 检查是否已参与
-            cursor.execute("SELECT COUNT(*) FROM participants WHERE lottery_id = ? AND user_id = ?", 
-                          (self.lottery_id, interaction.user.id))
-            participation_count = cursor.fetchone()[0]
-            
-            if participation_count > 0 and not l_allow_multiple:
-                await interaction.followup.send("❌ 您已经参与过此抽奖了！", ephemeral=True)
+            if result in JOIN_REJECTIONS:
+                await bot.respond(interaction, JOIN_REJECTIONS[result], ephemeral=True)
                 return
             
-            # 检查人数限制
-            if l_max_participants > 0:
-                cursor.execute("SELECT COUNT(*) FROM participants WHERE lottery_id = ?", 
-                              (self.lottery_id,))
-                current_participants = cursor.fetchone()[0]
-                if current_participants >= l_max_participants:
-                    await interaction.followup.send("❌ 抽奖人数已满！", ephemeral=True)
-                    return
-            
-            # 添加参与记录
-            cursor.execute("""
-                INSERT INTO participants (lottery_id, user_id, discord_id)
-                VALUES (?, ?, ?)
-            """, (self.lottery_id, interaction.user.id, str(interaction.user.id)))
-            
-            bot.conn.commit()
-            
-            # 更新参与统计
-            cursor.execute("SELECT COUNT(*) FROM participants WHERE lottery_id = ?", (self.lottery_id,))
-            total_participants = cursor.fetchone()[0]
+            l_title = lottery['title']
+            l_max_participants = lottery['max_participants']
             
-            await interaction.followup.send(
+            await bot.respond(interaction, 
                 f"✅ 成功参与抽奖 **{l_title}**！\n"
                 f"🎯 当前参与人数: {total_participants}" + 
                 (f"/{l_max_participants}" if l_max_participants > 0 else ""),
@@ -2016,10 +2022,7 @@ class LotteryParticipateView(discord.ui.View):
             )
             
             logger.info(f"用户 {interaction.user} 通过按钮参与了抽奖 {self.lottery_id}")
-            
-        except sqlite3.IntegrityError:
-             # 处理用户已经参与但 allow_multiple 为 False 的情况
-            await interaction.followup.send("❌ 您已经参与过此抽奖了！", ephemeral=True)
+        
         except Exception as e:
             logger.error(f"按钮参与抽奖时出错: {e}")
             await interaction.followup.send("❌ 参与抽奖时出现错误，请稍后重试。", ephemeral=True)
@@ -2209,29 +2212,25 @@ class CreateLotteryModal(discord.ui.Modal):
             if self.duration_input.value:
                 try:
                     duration_minutes = int(self.duration_input.value)
-                    end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration_minutes)
+                    end_time = bot.clock.now() + duration_minutes * 60
                 except ValueError:
                     await interaction.response.send_message("❌ 持续时间格式错误！", ephemeral=True)
                     return
             
-            # 获取数据库连接
-            cursor = bot.conn.cursor()
-            
             # 创建抽奖记录
-            cursor.execute("""
-                INSERT INTO lotteries (guild_id, channel_id, creator_id, title, description, 
-                                     prizes, max_participants, end_time, status, 
-                                     allow_multiple_entries)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'active', 1)
-            """, (
-                self.guild_id, self.channel_id, interaction.user.id, title, description,
-                f'["{winners}个奖品"]',  # JSON格式的奖品列表
-                max_participants if max_participants else -1,
-                end_time.isoformat() if end_time else None
-            ))
-            
-            lottery_id = cursor.lastrowid
-            bot.conn.commit()
+            lottery_id = await bot.db.create_lottery(
+                guild_id=self.guild_id,
+                channel_id=self.channel_id,
+                creator_id=interaction.user.id,
+                title=title,
+                prizes=[{"name": "奖品", "quantity": winners}],
+                description=description,
+                max_participants=max_participants if max_participants else -1,
+                end_time=end_time,
+                allow_multiple=True
+            )
+            if end_time:
+                bot.scheduler.schedule(lottery_id, end_time)
             
             # 获取目标频道并发送抽奖消息
             guild = bot.get_guild(self.guild_id)
@@ -2256,7 +2255,7 @@ class CreateLotteryModal(discord.ui.Modal):
                 
                 embed.add_field(name="🎯 抽奖ID", value=str(lottery_id), inline=True)
                 embed.add_field(name="👤 创建者", value=str(interaction.user), inline=True)
-                embed.add_field(name="📅 创建时间", value=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), inline=True)
+                embed.add_field(name="📅 创建时间", value=bot.format_time(bot.clock.now()), inline=True)
                 
                 embed.set_footer(text="点击下方按钮参与抽奖！")
                 
@@ -2307,27 +2306,10 @@ class UserManagementView(discord.ui.View):
         
         await interaction.response.defer()
         
-        cursor = bot.conn.cursor()
-        
-        # 最活跃用户
-        cursor.execute('''
-            SELECT p.user_id, COUNT(*) as participation_count
-            FROM participants p
-            GROUP BY p.user_id
-            ORDER BY participation_count DESC
-            LIMIT 10
-        ''')
-        top_participants = cursor.fetchall()
-        
-        # 最幸运用户
-        cursor.execute('''
-            SELECT w.user_id, COUNT(*) as win_count
-            FROM winners w
-            GROUP BY w.user_id
-            ORDER BY win_count DESC
-            LIMIT 10
-        ''')
-        top_winners = cursor.fetchall()
+        # 最活跃用户和最幸运用户
+        top_users = await bot.db.get_global_top_users(limit=10)
+        top_participants = top_users['top_participants']
+        top_winners = top_users['top_winners']
         
         embed = discord.Embed(
             title="🏆 全球最活跃用户排行榜",
@@ -2336,8 +2318,8 @@ class UserManagementView(discord.ui.View):
         
         if top_participants:
             participant_text = "\n".join([
-                f"{i+1}. <@{user_id}> - {count}次参与"
-                for i, (user_id, count) in enumerate(top_participants[:5])
+                f"{i+1}. <@{row['user_id']}> - {row['participation_count']}次参与"
+                for i, row in enumerate(top_participants[:5])
             ])
             embed.add_field(
                 name="🔥 最活跃参与者",
@@ -2347,8 +2329,8 @@ class UserManagementView(discord.ui.View):
         
         if top_winners:
             winner_text = "\n".join([
-                f"{i+1}. <@{user_id}> - {count}次中奖"
-                for i, (user_id, count) in enumerate(top_winners[:5])
+                f"{i+1}. <@{row['user_id']}> - {row['win_count']}次中奖"
+                for i, row in enumerate(top_winners[:5])
             ])
             embed.add_field(
                 name="🍀 最幸运用户",
@@ -2383,9 +2365,7 @@ class GuildManagementView(discord.ui.View):
         
         guilds_info = []
         for guild in bot.guilds:
-            cursor = bot.conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ?', (guild.id,))
-            lottery_count = cursor.fetchone()[0]
+            lottery_count = (await bot.db.get_guild_summary(guild.id))['total_lotteries']
             
             guilds_info.append({
                 'name': guild.name,
@@ -2536,7 +2516,6 @@ class RealtimeMonitorView(discord.ui.View):
         
         import psutil
         import sys
-        import time
         
         # 获取系统信息
         memory = psutil.virtual_memory()
@@ -2573,6 +2552,18 @@ class RealtimeMonitorView(discord.ui.View):
             inline=True
         )
         
+        embed.add_field(
+            name="🎲 自动开奖",
+            value=bot.format_draw_worker_stats(),
+            inline=False
+        )
+        
+        embed.add_field(
+            name="🚦 参与限流",
+            value=bot.format_join_stats(),
+            inline=False
+        )
+        
         await interaction.followup.send(embed=embed, ephemeral=True)
 
 # 新增的模态框类
@@ -2609,19 +2600,10 @@ class UserSearchModal(discord.ui.Modal):
             return
         
         # 获取用户统计
-        cursor = bot.conn.cursor()
-        
-        # 参与次数
-        cursor.execute('SELECT COUNT(*) FROM participants WHERE user_id = ?', (user.id,))
-        participation_count = cursor.fetchone()[0]
-        
-        # 中奖次数
-        cursor.execute('SELECT COUNT(*) FROM winners WHERE user_id = ?', (user.id,))
-        win_count = cursor.fetchone()[0]
-        
-        # 创建的抽奖
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE creator_id = ?', (user.id,))
-        created_count = cursor.fetchone()[0]
+        user_stats = await bot.db.get_user_global_stats(user.id)
+        participation_count = user_stats['participation_count']
+        win_count = user_stats['win_count']
+        created_count = user_stats['created_count']
         
         embed = discord.Embed(
             title=f"🔍 用户信息: {user.display_name}",
@@ -2683,20 +2665,10 @@ class GuildSearchModal(discord.ui.Modal):
             return
         
         # 获取服务器统计
-        cursor = bot.conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ?', (guild.id,))
-        total_lotteries = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ? AND status = "active"', (guild.id,))
-        active_lotteries = cursor.fetchone()[0]
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM participants p 
-            JOIN lotteries l ON p.lottery_id = l.id 
-            WHERE l.guild_id = ?
-        ''', (guild.id,))
-        total_participants = cursor.fetchone()[0]
+        summary = await bot.db.get_guild_summary(guild.id)
+        total_lotteries = summary['total_lotteries']
+        active_lotteries = summary['active_lotteries']
+        total_participants = summary['total_participations']
         
         embed = discord.Embed(
             title=f"📊 服务器信息: {guild.name}",
@@ -2773,24 +2745,21 @@ async def test_lottery(interaction: discord.Interaction,
                       duration: int = 10):
     """创建测试抽奖命令"""
     try:
-        # 获取数据库连接
-        cursor = bot.conn.cursor()
-        
         # 计算结束时间
-        end_time = datetime.datetime.now() + datetime.timedelta(minutes=duration)
+        end_time = bot.clock.now() + duration * 60
         
         # 创建抽奖记录
-        cursor.execute("""
-            INSERT INTO lotteries (guild_id, channel_id, creator_id, title, description, 
-                                 prizes, end_time, status, allow_multiple_entries)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 'active', 1)
-        """, (
-            interaction.guild.id, interaction.channel.id, interaction.user.id, 
-            title, description, '["1个奖品"]', end_time.isoformat()
-        ))
-        
-        lottery_id = cursor.lastrowid
-        bot.conn.commit()
+        lottery_id = await bot.db.create_lottery(
+            guild_id=interaction.guild.id,
+            channel_id=interaction.channel.id,
+            creator_id=interaction.user.id,
+            title=title,
+            prizes=[{"name": "测试奖品", "quantity": 1}],
+            description=description,
+            end_time=end_time,
+            allow_multiple=True
+        )
+        bot.scheduler.schedule(lottery_id, end_time)
         
         # 创建抽奖嵌入消息
         embed = discord.Embed(
@@ -2807,7 +2776,7 @@ async def test_lottery(interaction: discord.Interaction,
         
         embed.add_field(name="🎯 抽奖ID", value=str(lottery_id), inline=True)
         embed.add_field(name="👤 创建者", value=str(interaction.user), inline=True)
-        embed.add_field(name="📅 创建时间", value=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), inline=True)
+        embed.add_field(name="📅 创建时间", value=bot.format_time(bot.clock.now()), inline=True)
         
         embed.set_footer(text="点击下方按钮参与抽奖！")
         
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人时钟
+
+调度器、工作池、选主、参与过期检查和数据库时间戳都通过Clock读取时间，
+不直接调用time.time()。正常运行使用SystemClock；压测和回放使用
+SimulatedClock：虚拟时间只在所有协程都在等待时跳到下一个唤醒点，
+几天的调度可以在几秒内跑完，且结果与真实时间下的行为一致。
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Tuple
+
+class Clock:
+    """时钟接口，时间均为UTC epoch秒"""
+    
+    def time(self) -> float:
+        raise NotImplementedError
+    
+    def now(self) -> int:
+        """当前时间（整数秒），与数据库时间列格式一致"""
+        return int(self.time())
+    
+    async def sleep(self, seconds: float):
+        raise NotImplementedError
+    
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """等待事件或超时，事件被触发时返回True"""
+        raise NotImplementedError
+
+class SystemClock(Clock):
+    """真实时间"""
+    
+    def time(self) -> float:
+        return time.time()
+    
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+    
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+class SimulatedClock(Clock):
+    """离散事件模拟时钟，由run_until推进虚拟时间"""
+    
+    def __init__(self, start: Optional[float] = None):
+        self._now = time.time() if start is None else start
+        self._sleepers: List[Tuple[float, int, asyncio.Future]] = []  # (唤醒时间, 序号, future)
+        self._seq = itertools.count()
+    
+    def time(self) -> float:
+        return self._now
+    
+    async def sleep(self, seconds: float):
+        if seconds <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._sleepers, (self._now + seconds, next(self._seq), future))
+        await future
+    
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        if event.is_set():
+            return True
+        waiter = asyncio.ensure_future(event.wait())
+        sleeper = asyncio.ensure_future(self.sleep(timeout))
+        await asyncio.wait((waiter, sleeper), return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        sleeper.cancel()
+        return event.is_set()
+    
+    @staticmethod
+    async def _settle():
+        """让出事件循环，直到没有可立即运行的回调"""
+        loop = asyncio.get_running_loop()
+        ready = getattr(loop, '_ready', None)
+        for _ in range(1000):
+            await asyncio.sleep(0)
+            if ready is not None and not ready:
+                break
+    
+    async def run_until(self, end: float) -> int:
+        """推进虚拟时间到end，依次唤醒到期的sleep，返回唤醒次数"""
+        woken = 0
+        while True:
+            await self._settle()
+            # 丢弃已被取消的sleep
+            while self._sleepers and self._sleepers[0][2].done():
+                heapq.heappop(self._sleepers)
+            if not self._sleepers or self._sleepers[0][0] > end:
+                self._now = max(self._now, end)
+                await self._settle()
+                return woken
+            
+            deadline, _, future = heapq.heappop(self._sleepers)
+            self._now = max(self._now, deadline)
+            future.set_result(None)
+            woken += 1
+
+_clock: Clock = SystemClock()
+
+def get_clock() -> Clock:
+    """进程默认时钟"""
+    return _clock
+
+def set_clock(clock: Clock):
+    """替换进程默认时钟（用于测试和回放）"""
+    global _clock
+    _clock = clock
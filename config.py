@@ -20,6 +20,24 @@ class Config:
     
     # 数据库配置
     DATABASE_NAME = os.getenv('DATABASE_NAME', 'lottery_bot.db')
+    # 组提交：一批最多包含的写操作数，以及凑批最多等待的毫秒数
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', '64'))
+    DB_WRITE_BATCH_DELAY_MS = int(os.getenv('DB_WRITE_BATCH_DELAY_MS', '5'))
+    # SQLite PRAGMA配置（WAL模式下读写互不阻塞）
+    DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL').upper()
+    DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL').upper()
+    DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-20000'))  # 负数表示KiB
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+    DB_TEMP_STORE = os.getenv('DB_TEMP_STORE', 'MEMORY').upper()
+    DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+    # 只读连接池大小
+    DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+    # 每个连接缓存的已编译语句数量
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+    # 服务器统计校正间隔（分钟）
+    STATS_RECONCILE_INTERVAL_MINUTES = int(os.getenv('STATS_RECONCILE_INTERVAL_MINUTES', '60'))
+    # 用户统计校正每次写入修正的行数
+    STATS_RECONCILE_BATCH_SIZE = int(os.getenv('STATS_RECONCILE_BATCH_SIZE', '500'))
     
     # 日志配置
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -33,6 +51,36 @@ class Config:
     MAX_RANDOM_CHOICES = 20
     MAX_RANDOM_NUMBERS = 10
     MAX_RANDOM_RANGE = 1000000
+    # 参与人数超过该值时开奖改为流式读取，内存只保留候选中奖者
+    DRAW_STREAM_THRESHOLD = int(os.getenv('DRAW_STREAM_THRESHOLD', '50000'))
+    # 流式开奖每次从游标读取的行数
+    DRAW_STREAM_CHUNK_SIZE = int(os.getenv('DRAW_STREAM_CHUNK_SIZE', '5000'))
+    # 开奖在中奖者之外保留的候补人数（重抽依次使用，所有开奖模式通用）
+    DRAW_WAITLIST_SIZE = int(os.getenv('DRAW_WAITLIST_SIZE', '100'))
+    # 参与人数超过该值时开奖放到进程池执行，避免阻塞事件循环
+    DRAW_PROCESS_POOL_THRESHOLD = int(os.getenv('DRAW_PROCESS_POOL_THRESHOLD', '200000'))
+    DRAW_PROCESS_POOL_WORKERS = int(os.getenv('DRAW_PROCESS_POOL_WORKERS', '2'))
+    # 同时执行的自动开奖数量上限
+    AUTO_DRAW_CONCURRENCY = int(os.getenv('AUTO_DRAW_CONCURRENCY', '4'))
+    # 重启后补开积压抽奖：每批数量和批次间隔（秒）
+    BACKLOG_DRAIN_BATCH_SIZE = int(os.getenv('BACKLOG_DRAIN_BATCH_SIZE', '10'))
+    BACKLOG_DRAIN_INTERVAL_SECONDS = float(os.getenv('BACKLOG_DRAIN_INTERVAL_SECONDS', '5'))
+    # 多实例选主：租约有效期和续约间隔（秒），只有leader运行开奖调度
+    LEADER_LEASE_TTL_SECONDS = int(os.getenv('LEADER_LEASE_TTL_SECONDS', '15'))
+    LEADER_HEARTBEAT_SECONDS = float(os.getenv('LEADER_HEARTBEAT_SECONDS', '5'))
+    # 参与按钮合并：同一抽奖在窗口（毫秒）内的点击合并为一次批量写入，单批最多人数
+    JOIN_COALESCE_WINDOW_MS = int(os.getenv('JOIN_COALESCE_WINDOW_MS', '50'))
+    JOIN_COALESCE_MAX_BATCH = int(os.getenv('JOIN_COALESCE_MAX_BATCH', '500'))
+    # 参与限流（令牌桶）：每个用户的桶容量和每秒补充的令牌数
+    JOIN_USER_BUCKET_CAPACITY = float(os.getenv('JOIN_USER_BUCKET_CAPACITY', '3'))
+    JOIN_USER_REFILL_PER_SECOND = float(os.getenv('JOIN_USER_REFILL_PER_SECOND', '0.5'))
+    # 每个抽奖的令牌桶只是保护数据库的泄压阀，不是公平性限制，会拒绝不同的正常用户；
+    # 每秒补充数为0时关闭（默认），开启时应远高于合并写入的处理能力
+    JOIN_LOTTERY_BUCKET_CAPACITY = float(os.getenv('JOIN_LOTTERY_BUCKET_CAPACITY', '20000'))
+    JOIN_LOTTERY_REFILL_PER_SECOND = float(os.getenv('JOIN_LOTTERY_REFILL_PER_SECOND', '0'))
+    # 交互去重：按interaction.id保存响应的时间（秒，交互令牌15分钟有效）和最多条目数
+    INTERACTION_LOG_TTL_SECONDS = int(os.getenv('INTERACTION_LOG_TTL_SECONDS', '900'))
+    INTERACTION_LOG_MAX_ENTRIES = int(os.getenv('INTERACTION_LOG_MAX_ENTRIES', '10000'))
     
     # 权限配置
     ADMIN_PERMISSIONS = ['manage_messages', 'administrator']
@@ -80,6 +128,52 @@ class Config:
         if cls.LOG_LEVEL not in valid_log_levels:
             errors.append(f"无效的LOG_LEVEL: {cls.LOG_LEVEL}")
         
+        # 验证数据库PRAGMA配置
+        if cls.DB_JOURNAL_MODE not in ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']:
+            errors.append(f"无效的DB_JOURNAL_MODE: {cls.DB_JOURNAL_MODE}")
+        if cls.DB_SYNCHRONOUS not in ['OFF', 'NORMAL', 'FULL', 'EXTRA']:
+            errors.append(f"无效的DB_SYNCHRONOUS: {cls.DB_SYNCHRONOUS}")
+        if cls.DB_TEMP_STORE not in ['DEFAULT', 'FILE', 'MEMORY']:
+            errors.append(f"无效的DB_TEMP_STORE: {cls.DB_TEMP_STORE}")
+        if cls.DB_READ_POOL_SIZE < 1:
+            errors.append("DB_READ_POOL_SIZE必须大于0")
+        
+        if cls.STATS_RECONCILE_BATCH_SIZE < 1:
+            errors.append("STATS_RECONCILE_BATCH_SIZE必须大于0")
+        
+        if cls.DRAW_STREAM_CHUNK_SIZE < 1:
+            errors.append("DRAW_STREAM_CHUNK_SIZE必须大于0")
+        
+        if cls.DRAW_PROCESS_POOL_WORKERS < 1:
+            errors.append("DRAW_PROCESS_POOL_WORKERS必须大于0")
+        
+        if cls.AUTO_DRAW_CONCURRENCY < 1:
+            errors.append("AUTO_DRAW_CONCURRENCY必须大于0")
+        
+        if cls.BACKLOG_DRAIN_BATCH_SIZE < 1:
+            errors.append("BACKLOG_DRAIN_BATCH_SIZE必须大于0")
+        
+        if not 0 < cls.LEADER_HEARTBEAT_SECONDS < cls.LEADER_LEASE_TTL_SECONDS:
+            errors.append("LEADER_HEARTBEAT_SECONDS必须大于0且小于LEADER_LEASE_TTL_SECONDS")
+        
+        if cls.JOIN_COALESCE_WINDOW_MS < 0:
+            errors.append("JOIN_COALESCE_WINDOW_MS不能为负数")
+        
+        if cls.JOIN_COALESCE_MAX_BATCH < 1:
+            errors.append("JOIN_COALESCE_MAX_BATCH必须大于0")
+        
+        if cls.JOIN_USER_BUCKET_CAPACITY < 1 or cls.JOIN_LOTTERY_BUCKET_CAPACITY < 1:
+            errors.append("JOIN_USER_BUCKET_CAPACITY和JOIN_LOTTERY_BUCKET_CAPACITY不能小于1")
+        
+        if cls.JOIN_USER_REFILL_PER_SECOND <= 0:
+            errors.append("JOIN_USER_REFILL_PER_SECOND必须大于0")
+        
+        if cls.JOIN_LOTTERY_REFILL_PER_SECOND < 0:
+            errors.append("JOIN_LOTTERY_REFILL_PER_SECOND不能为负数")
+        
+        if cls.INTERACTION_LOG_TTL_SECONDS < 1 or cls.INTERACTION_LOG_MAX_ENTRIES < 1:
+            errors.append("INTERACTION_LOG_TTL_SECONDS和INTERACTION_LOG_MAX_ENTRIES必须大于0")
+        
         return errors
     
     @classmethod
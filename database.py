@@ -4,327 +4,1091 @@
 Discord中文抽奖机器人数据库工具
 """
 
-import sqlite3
 import json
-import datetime
 import logging
-from typing import List, Dict, Optional, Tuple
+import asyncio
+from array import array
+import pathlib
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Dict, Optional, Set, Tuple
+import aiosqlite
 from config import config
+from clock import get_clock
+import migrations
 
 logger = logging.getLogger(__name__)
 
-class DatabaseManager:
-    """数据库管理器"""
+# 按明细表汇总每个服务器的统计（参与次数取自抽奖表上的participant_count）
+GUILD_TOTALS_CTE = '''
+    WITH totals AS (
+        SELECT l.guild_id,
+               COUNT(*) AS total_lotteries,
+               SUM(l.status = 'active') AS active_lotteries,
+               SUM(l.participant_count) AS total_participants,
+               COALESCE(SUM(w.winner_count), 0) AS total_winners
+        FROM lotteries l
+        LEFT JOIN (SELECT lottery_id, COUNT(*) AS winner_count FROM winners GROUP BY lottery_id) w ON w.lottery_id = l.id
+        GROUP BY l.guild_id
+    )
+'''
+
+# 按明细表汇总每个用户在每个服务器的参与、中奖和创建次数
+USER_TOTALS_CTE = '''
+    WITH totals AS (
+        SELECT guild_id, user_id, SUM(participations) AS participations, SUM(wins) AS wins,
+               SUM(creations) AS creations, MAX(won_at) AS last_win_at
+        FROM (
+            SELECT l.guild_id, p.user_id, 1 AS participations, 0 AS wins, 0 AS creations, NULL AS won_at
+            FROM participants p JOIN lotteries l ON l.id = p.lottery_id
+            UNION ALL
+            SELECT l.guild_id, w.user_id, 0, 1, 0, w.won_at
+            FROM winners w JOIN lotteries l ON l.id = w.lottery_id
+            UNION ALL
+            SELECT guild_id, creator_id, 0, 0, 1, NULL
+            FROM lotteries
+        )
+        GROUP BY guild_id, user_id
+    )
+'''
+
+# 按明细表重算指定 (guild_id, user_id) 的用户统计，键列表作为JSON参数传入
+USER_STATS_RECOMPUTE = '''
+    WITH keys(guild_id, user_id) AS (
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+    )
+    INSERT INTO user_guild_stats (guild_id, user_id, participations, wins, creations, last_win_at)
+    SELECT k.guild_id, k.user_id,
+           (SELECT COUNT(*) FROM participants p JOIN lotteries l ON l.id = p.lottery_id
+            WHERE p.user_id = k.user_id AND l.guild_id = k.guild_id),
+           (SELECT COUNT(*) FROM winners w JOIN lotteries l ON l.id = w.lottery_id
+            WHERE w.user_id = k.user_id AND l.guild_id = k.guild_id),
+           (SELECT COUNT(*) FROM lotteries l WHERE l.creator_id = k.user_id AND l.guild_id = k.guild_id),
+           (SELECT MAX(w.won_at) FROM winners w JOIN lotteries l ON l.id = w.lottery_id
+            WHERE w.user_id = k.user_id AND l.guild_id = k.guild_id)
+    FROM keys k WHERE true
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        participations = excluded.participations,
+        wins = excluded.wins,
+        creations = excluded.creations,
+        last_win_at = excluded.last_win_at
+'''
+
+# 用户统计增量更新；last_win_at为NULL时保留原值
+USER_STATS_UPSERT = '''
+    INSERT INTO user_guild_stats (guild_id, user_id, participations, wins, creations, last_win_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        participations = participations + excluded.participations,
+        wins = wins + excluded.wins,
+        creations = creations + excluded.creations,
+        last_win_at = COALESCE(excluded.last_win_at, last_win_at)
+'''
+
+# 参与抽奖的结果
+JOIN_JOINED = 'joined'            # 新参与
+JOIN_WEIGHT_ADDED = 'weighted'    # 重复参与，权重加一
+JOIN_ALREADY = 'already_joined'   # 已参与且不允许重复参与
+JOIN_FULL = 'full'                # 人数已满
+JOIN_CLOSED = 'closed'            # 已结束或被取消
+JOIN_EXPIRED = 'expired'          # 已过结束时间，等待开奖
+JOIN_NOT_FOUND = 'not_found'
+
+# 抽奖可参与的条件，参数为 (now,)
+JOINABLE_CONDITION = '''
+    status = 'active' AND (end_time IS NULL OR end_time > ?)
+    AND (max_participants <= 0 OR participant_count < max_participants)
+'''
+
+class ActiveLottery:
+    """进行中抽奖的内存热状态：参与判断所需的元数据、人数和参与者ID集合"""
+    
+    __slots__ = ('id', 'guild_id', 'title', 'end_time', 'max_participants', 'allow_multiple',
+                 'required_roles', 'participant_count', 'participants')
+    
+    def __init__(self, lottery: Dict, participants: Optional[Set[int]] = None):
+        self.id = lottery['id']
+        self.guild_id = lottery['guild_id']
+        self.title = lottery['title']
+        self.end_time = lottery['end_time']
+        self.max_participants = lottery['max_participants']
+        self.allow_multiple = bool(lottery['allow_multiple_entries'])
+        self.required_roles = frozenset(lottery['required_roles'] or ())
+        self.participant_count = lottery['participant_count']
+        self.participants = participants if participants is not None else set()
+    
+    def rejection(self, user_id: int, now: int) -> Optional[str]:
+        """不查询数据库即可确定的拒绝原因，返回None时仍需由数据库最终判断"""
+        if self.end_time is not None and self.end_time <= now:
+            return JOIN_EXPIRED
+        if user_id in self.participants and not self.allow_multiple:
+            return JOIN_ALREADY
+        if 0 < self.max_participants <= self.participant_count:
+            return JOIN_FULL
+        return None
+    
+    def to_dict(self) -> Dict:
+        """参与流程使用的抽奖字段，与get_lottery返回的同名字段一致"""
+        return {
+            'id': self.id,
+            'guild_id': self.guild_id,
+            'title': self.title,
+            'status': 'active',
+            'end_time': self.end_time,
+            'max_participants': self.max_participants,
+            'allow_multiple_entries': self.allow_multiple,
+            'required_roles': sorted(self.required_roles),
+            'participant_count': self.participant_count
+        }
+
+def epoch_now() -> int:
+    """当前UTC epoch秒（数据库中所有时间列的格式），取自进程默认时钟"""
+    return get_clock().now()
+
+def pragma_statements(read_only: bool = False) -> List[str]:
+    """根据配置生成每个连接需要执行的PRAGMA语句"""
+    statements = [
+        f"PRAGMA busy_timeout = {config.DB_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size = {config.DB_CACHE_SIZE}",
+        f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}",
+        f"PRAGMA temp_store = {config.DB_TEMP_STORE}",
+    ]
+    if not read_only:
+        # journal_mode会持久化到数据库文件，只需由写连接设置
+        statements.insert(0, f"PRAGMA journal_mode = {config.DB_JOURNAL_MODE}")
+        statements.append(f"PRAGMA synchronous = {config.DB_SYNCHRONOUS}")
+    return statements
+
+class _Rollback(Exception):
+    """事务体抛出异常时，用于通知写入任务回滚该操作"""
+
+class AsyncDatabase:
+    """异步数据库访问层
+    
+    所有SQLite I/O都在aiosqlite的后台线程中执行，
+    命令处理器通过它访问数据库，不会阻塞事件循环。
+    
+    写操作统一交给单一写入任务排队执行：一批写操作共用一个事务并只提交一次（组提交），
+    每个操作使用独立的SAVEPOINT，单个操作失败只回滚它自己。
+    读操作使用独立的只读连接池，在WAL模式下不会等待写入。
+    """
     
     def __init__(self, db_name: str = None):
         self.db_name = db_name or config.DATABASE_NAME
-        self.conn = None
-        self.init_database()
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.write_batch_size = config.DB_WRITE_BATCH_SIZE
+        self.write_batch_delay = config.DB_WRITE_BATCH_DELAY_MS / 1000
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
     
-    def init_database(self):
-        """初始化数据库连接和表结构"""
+    async def connect(self):
+        """打开写连接和只读连接池，并启动写入任务"""
         try:
-            self.conn = sqlite3.connect(self.db_name, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
-            self.create_tables()
-            logger.info(f"数据库初始化成功: {self.db_name}")
+            # 自动提交模式，事务边界由写入任务显式控制
+            self.conn = await aiosqlite.connect(self.db_name, isolation_level=None,
+                                                cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+            self.conn.row_factory = aiosqlite.Row
+            for statement in pragma_statements():
+                await self.conn.execute(statement)
+            
+            reader_uri = f"{pathlib.Path(self.db_name).resolve().as_uri()}?mode=ro"
+            self._readers = asyncio.Queue()
+            for _ in range(config.DB_READ_POOL_SIZE):
+                reader = await aiosqlite.connect(reader_uri, uri=True, isolation_level=None,
+                                                 cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+                reader.row_factory = aiosqlite.Row
+                for statement in pragma_statements(read_only=True):
+                    await reader.execute(statement)
+                self._reader_conns.append(reader)
+                self._readers.put_nowait(reader)
+            
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._writer_loop())
+            logger.info(f"异步数据库连接成功: {self.db_name} (只读连接: {len(self._reader_conns)})")
         except Exception as e:
-            logger.error(f"数据库初始化失败: {e}")
+            logger.error(f"异步数据库连接失败: {e}")
             raise
     
-    def create_tables(self):
-        """创建数据库表"""
-        cursor = self.conn.cursor()
-        
-        # 抽奖表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lotteries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                channel_id INTEGER NOT NULL,
-                creator_id INTEGER NOT NULL,
-                title TEXT NOT NULL,
-                description TEXT,
-                prizes TEXT NOT NULL,  -- JSON格式存储奖品
-                max_participants INTEGER DEFAULT -1,
-                end_time TIMESTAMP,
-                status TEXT DEFAULT 'active',  -- active, ended, cancelled
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                winner_selection_method TEXT DEFAULT 'random',  -- random, weighted
-                allow_multiple_entries BOOLEAN DEFAULT FALSE,
-                required_roles TEXT,  -- JSON格式存储需要的角色ID
-                blacklisted_users TEXT,  -- JSON格式存储黑名单用户ID
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 参与者表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lottery_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                discord_id TEXT,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                weight INTEGER DEFAULT 1,
-                FOREIGN KEY (lottery_id) REFERENCES lotteries (id),
-                UNIQUE(lottery_id, user_id)
-            )
-        ''')
+    @asynccontextmanager
+    async def reader(self):
+        """从只读连接池借出一个连接"""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+    
+    async def fetchone(self, sql: str, params: Tuple = ()) -> Optional[Tuple]:
+        """执行查询并返回第一行"""
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+    
+    async def fetchall(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        """执行查询并返回所有行"""
+        async with self.reader() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+    
+    async def fetchval(self, sql: str, params: Tuple = (), default: Any = None) -> Any:
+        """执行查询并返回第一行第一列"""
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+    
+    def submit(self, op: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> asyncio.Future:
+        """把写操作交给写入任务，返回在事务提交后完成的Future"""
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((op, future))
+        return future
+    
+    async def write(self, op: Callable[[aiosqlite.Connection], Awaitable[Any]]) -> Any:
+        """执行写操作并等待其所在批次提交"""
+        return await self.submit(op)
+    
+    async def execute(self, sql: str, params: Tuple = ()) -> aiosqlite.Cursor:
+        """执行单条写语句，提交后返回游标"""
+        return await self.write(lambda conn: conn.execute(sql, params))
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """写事务：正常退出时随所在批次提交，出现异常时回滚"""
+        loop = asyncio.get_running_loop()
+        acquired = loop.create_future()
+        released = loop.create_future()
         
-        # 中奖记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS winners (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lottery_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                prize_name TEXT NOT NULL,
-                won_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
-            )
-        ''')
+        async def op(conn):
+            # 调用方已取消或退出时released已为False，直接回滚，不会一直占用写入任务
+            if not acquired.done():
+                acquired.set_result(conn)
+            if not await released:
+                raise _Rollback()
         
-        # 统计表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS statistics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id INTEGER NOT NULL,
-                total_lotteries INTEGER DEFAULT 0,
-                total_participants INTEGER DEFAULT 0,
-                total_winners INTEGER DEFAULT 0,
-                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(guild_id)
-            )
-        ''')
+        done = self.submit(op)
+        try:
+            await asyncio.wait({acquired, done}, return_when=asyncio.FIRST_COMPLETED)
+            if not acquired.done():
+                # 批次在进入本操作前就失败了
+                done.result()
+            
+            try:
+                yield acquired.result()
+            except BaseException:
+                released.set_result(False)
+                # 等写入任务回滚完成后再抛出，避免随后的读取看到未提交的数据
+                try:
+                    await asyncio.shield(done)
+                except Exception:
+                    pass
+                raise
+            released.set_result(True)
+            await done
+        finally:
+            if not released.done():
+                released.set_result(False)
+                # 调用方不再等待结果，回滚产生的异常在这里取走
+                done.add_done_callback(lambda future: future.cancelled() or future.exception())
+    
+    async def _next_batch(self) -> List[Tuple]:
+        """取出一批写操作：数量达到上限或等待时间用完即返回"""
+        batch = [await self._write_queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.write_batch_delay
+        while len(batch) < self.write_batch_size and batch[-1] is not None:
+            try:
+                batch.append(self._write_queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._write_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _writer_loop(self):
+        """写入任务：逐批执行写操作，每批只提交一次"""
+        while True:
+            batch = await self._next_batch()
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    await self._run_batch(batch)
+                except Exception as e:
+                    # 写入任务不能退出，否则后续写操作会一直等待
+                    logger.error(f"执行写入批次失败: {e}")
+                    await self._rollback_quietly()
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stopping:
+                return
+    
+    async def _run_batch(self, batch: List[Tuple]):
+        """在一个事务中执行一批写操作"""
+        results = []
+        try:
+            await self.conn.execute('BEGIN IMMEDIATE')
+        except Exception as e:
+            logger.error(f"开始写事务失败: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
         
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_guild_id ON lotteries(guild_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_status ON lotteries(status)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_participants_lottery_id ON participants(lottery_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_participants_user_id ON participants(user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_winners_lottery_id ON winners(lottery_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_winners_user_id ON winners(user_id)')
-        
-        self.conn.commit()
-        logger.info("数据库表创建完成")
-    
-    def create_lottery(self, guild_id: int, channel_id: int, creator_id: int, 
-                      title: str, prizes: List[Dict], description: str = None,
-                      max_participants: int = -1, end_time: datetime.datetime = None,
-                      allow_multiple: bool = False, required_roles: List[int] = None) -> int:
-        """创建抽奖"""
-        cursor = self.conn.cursor()
-        
-        prizes_json = json.dumps(prizes, ensure_ascii=False)
-        required_roles_json = json.dumps(required_roles) if required_roles else None
+        for op, future in batch:
+            if future.done():
+                # 调用方已取消等待（例如续约超时后已降级），不再执行
+                continue
+            await self.conn.execute('SAVEPOINT write_op')
+            try:
+                result = await op(self.conn)
+                await self.conn.execute('RELEASE write_op')
+                results.append((future, result, None))
+            except Exception as e:
+                await self.conn.execute('ROLLBACK TO write_op')
+                await self.conn.execute('RELEASE write_op')
+                results.append((future, None, e))
         
-        cursor.execute('''
-            INSERT INTO lotteries (
-                guild_id, channel_id, creator_id, title, description, prizes,
-                max_participants, end_time, allow_multiple_entries, required_roles
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            guild_id, channel_id, creator_id, title, description or "无描述",
-            prizes_json, max_participants, end_time, allow_multiple, required_roles_json
-        ))
+        try:
+            await self.conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"提交写事务失败: {e}")
+            await self._rollback_quietly()
+            results = [(future, None, error or e) for future, _, error in results]
         
-        lottery_id = cursor.lastrowid
-        self.conn.commit()
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        logger.debug(f"写入批次已提交: {len(batch)} 个操作")
+    
+    async def _rollback_quietly(self):
+        """回滚当前写事务，回滚失败（例如事务已结束）只记录日志"""
+        try:
+            await self.conn.execute('ROLLBACK')
+        except Exception as e:
+            logger.error(f"回滚写事务失败: {e}")
+    
+    async def close(self):
+        """停止写入任务并关闭数据库连接"""
+        if self._writer_task:
+            # 排在已有写操作之后，写完再退出
+            self._write_queue.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+        for reader in self._reader_conns:
+            await reader.close()
+        self._reader_conns = []
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+            logger.info("异步数据库连接已关闭")
+
+class DatabaseManager(AsyncDatabase):
+    """数据库管理器
+    
+    机器人唯一的存储引擎：所有查询都集中在这里，命令处理器只调用下面的方法。
+    表结构由migrations.py中的版本化迁移维护。每条SQL都是固定文本，
+    连接的语句缓存会直接复用已编译好的语句。
+    
+    active_lotteries保存本进程可见的进行中抽奖的热状态，启动时从数据库加载，
+    每次写入成功后同步更新。它只用于提前拒绝（重复参与、人数已满、已过期），
+    接受参与始终以数据库中的条件写入为准。
+    """
+    
+    def __init__(self, db_name: str = None):
+        super().__init__(db_name)
+        self.active_lotteries: Dict[int, ActiveLottery] = {}
+    
+    async def connect(self):
+        """打开连接并把表结构升级到最新版本"""
+        await super().connect()
+        # 启动阶段还没有其他写操作，直接在写连接上执行迁移
+        version = await migrations.migrate(self.conn)
+        logger.info(f"数据库表结构版本: v{version}")
+        await self.load_active_lotteries()
+    
+    @staticmethod
+    def _lottery_from_row(row) -> Dict:
+        """把抽奖行转换为字典并解析JSON字段"""
+        lottery = dict(row)
+        if lottery.get('required_roles'):
+            lottery['required_roles'] = json.loads(lottery['required_roles'])
+        return lottery
+    
+    @staticmethod
+    def _normalize_prizes(prizes: List) -> List[Tuple[str, int]]:
+        """把奖品参数整理为(名称, 数量)列表，兼容字符串和字典两种写法"""
+        normalized = []
+        for prize in prizes:
+            if isinstance(prize, dict):
+                normalized.append((str(prize['name']), max(1, int(prize.get('quantity', 1)))))
+            else:
+                normalized.append((str(prize), 1))
+        return normalized
+    
+    async def _lotteries_with_prizes(self, rows) -> List[Dict]:
+        """转换抽奖行，并用一次主键查询取出这些抽奖的全部奖品"""
+        lotteries = [self._lottery_from_row(row) for row in rows]
+        if not lotteries:
+            return lotteries
         
-        # 更新统计
-        self.update_guild_stats(guild_id)
+        by_id = {}
+        for lottery in lotteries:
+            lottery['prizes'] = []
+            by_id[lottery['id']] = lottery
         
-        logger.info(f"创建抽奖成功: ID={lottery_id}, 标题={title}")
-        return lottery_id
+        # id列表作为单个JSON参数传入，SQL文本固定，可以命中语句缓存
+        prize_rows = await self.fetchall('''
+            SELECT lottery_id, name, quantity FROM prizes
+            WHERE lottery_id IN (SELECT value FROM json_each(?))
+            ORDER BY lottery_id, position
+        ''', (json.dumps(list(by_id)),))
+        for row in prize_rows:
+            by_id[row['lottery_id']]['prizes'].append({'name': row['name'], 'quantity': row['quantity']})
+        return lotteries
     
-    def join_lottery(self, lottery_id: int, user_id: int, discord_id: str = None) -> bool:
-        """参与抽奖"""
-        cursor = self.conn.cursor()
+    async def load_active_lotteries(self) -> int:
+        """从数据库加载全部进行中抽奖的热状态，返回抽奖数量"""
+        participant_count = 0
+        async with self.reader() as conn:
+            # 两次查询放在同一个读事务中，看到的是同一个快照，其他进程的写入不会造成不一致
+            await conn.execute('BEGIN')
+            try:
+                async with conn.execute('''
+                    SELECT id, guild_id, title, end_time, max_participants, allow_multiple_entries,
+                           required_roles, participant_count
+                    FROM lotteries WHERE status = 'active'
+                ''') as cursor:
+                    active = {row['id']: ActiveLottery(self._lottery_from_row(row))
+                              for row in await cursor.fetchall()}
+                
+                async with conn.execute('''
+                    SELECT p.lottery_id, p.user_id FROM participants p
+                    JOIN lotteries l ON l.id = p.lottery_id
+                    WHERE l.status = 'active'
+                ''') as cursor:
+                    while True:
+                        rows = await cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        for lottery_id, user_id in rows:
+                            entry = active.get(lottery_id)
+                            if entry is not None:
+                                entry.participants.add(user_id)
+                        participant_count += len(rows)
+            finally:
+                await conn.execute('COMMIT')
         
-        try:
-            cursor.execute('''
-                INSERT INTO participants (lottery_id, user_id, discord_id)
-                VALUES (?, ?, ?)
-            ''', (lottery_id, user_id, discord_id or str(user_id)))
-            
-            self.conn.commit()
-            logger.info(f"用户 {user_id} 参与抽奖 {lottery_id}")
-            return True
-            
-        except sqlite3.IntegrityError:
-            # 用户已参与
-            return False
+        self.active_lotteries.clear()
+        self.active_lotteries.update(active)
+        logger.info(f"已加载 {len(active)} 个进行中抽奖的热状态（{participant_count} 名参与者）")
+        return len(active)
     
-    def increase_participation_weight(self, lottery_id: int, user_id: int) -> bool:
-        """增加参与权重（重复参与）"""
-        cursor = self.conn.cursor()
+    async def get_lottery_for_join(self, lottery_id: int, guild_id: int = None) -> Optional[Dict]:
+        """获取参与流程需要的抽奖字段，进行中的抽奖直接从热状态返回"""
+        entry = self.active_lotteries.get(lottery_id)
+        if entry is None:
+            return await self.get_lottery(lottery_id, guild_id)
+        if guild_id and entry.guild_id != guild_id:
+            return None
+        return entry.to_dict()
+    
+    def _record_join(self, lottery_id: int, user_id: int, result: str, participant_count: int):
+        """参与写入后同步热状态"""
+        entry = self.active_lotteries.get(lottery_id)
+        if entry is None:
+            return
+        if result in (JOIN_CLOSED, JOIN_NOT_FOUND):
+            self.active_lotteries.pop(lottery_id, None)
+            return
+        if result == JOIN_JOINED:
+            entry.participants.add(user_id)
+        entry.participant_count = max(entry.participant_count, participant_count)
+    
+    # ---- 抽奖 ----
+    
+    async def create_lottery(self, guild_id: int, channel_id: int, creator_id: int, 
+                             title: str, prizes: List, description: str = None,
+                             max_participants: int = -1, end_time: int = None,
+                             allow_multiple: bool = False, required_roles: List[int] = None) -> int:
+        """创建抽奖，prizes为{"name", "quantity"}列表，end_time为UTC epoch秒"""
+        prize_rows = self._normalize_prizes(prizes)
+        required_roles_json = json.dumps(required_roles) if required_roles else None
         
-        cursor.execute('''
-            UPDATE participants SET weight = weight + 1 
-            WHERE lottery_id = ? AND user_id = ?
-        ''', (lottery_id, user_id))
+        async def op(conn):
+            cursor = await conn.execute('''
+                INSERT INTO lotteries (
+                    guild_id, channel_id, creator_id, title, description,
+                    max_participants, end_time, allow_multiple_entries, required_roles
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                guild_id, channel_id, creator_id, title, description or "无描述",
+                max_participants, end_time, allow_multiple, required_roles_json
+            ))
+            await conn.executemany('''
+                INSERT INTO prizes (lottery_id, position, name, quantity) VALUES (?, ?, ?, ?)
+            ''', [(cursor.lastrowid, position, name, quantity) 
+                  for position, (name, quantity) in enumerate(prize_rows)])
+            await self._bump_guild_stats(conn, guild_id, lotteries=1, active=1)
+            await self._bump_user_stats(conn, guild_id, creator_id, creations=1)
+            return cursor.lastrowid
         
-        if cursor.rowcount > 0:
-            self.conn.commit()
-            logger.info(f"用户 {user_id} 在抽奖 {lottery_id} 中增加权重")
-            return True
-        return False
+        lottery_id = await self.write(op)
+        self.active_lotteries[lottery_id] = ActiveLottery({
+            'id': lottery_id, 'guild_id': guild_id, 'title': title, 'end_time': end_time,
+            'max_participants': max_participants, 'allow_multiple_entries': allow_multiple,
+            'required_roles': required_roles, 'participant_count': 0
+        })
+        logger.info(f"创建抽奖成功: ID={lottery_id}, 标题={title}")
+        return lottery_id
     
-    def get_lottery(self, lottery_id: int, guild_id: int = None) -> Optional[Dict]:
+    async def get_lottery(self, lottery_id: int, guild_id: int = None) -> Optional[Dict]:
         """获取抽奖信息"""
-        cursor = self.conn.cursor()
+        if guild_id:
+            row = await self.fetchone('SELECT * FROM lotteries WHERE id = ? AND guild_id = ?', 
+                                      (lottery_id, guild_id))
+        else:
+            row = await self.fetchone('SELECT * FROM lotteries WHERE id = ?', (lottery_id,))
         
-        query = 'SELECT * FROM lotteries WHERE id = ?'
-        params = [lottery_id]
+        if not row:
+            return None
         
-        if guild_id:
-            query += ' AND guild_id = ?'
-            params.append(guild_id)
-        
-        cursor.execute(query, params)
-        row = cursor.fetchone()
-        
-        if row:
-            lottery = dict(row)
-            lottery['prizes'] = json.loads(lottery['prizes'])
-            if lottery['required_roles']:
-                lottery['required_roles'] = json.loads(lottery['required_roles'])
-            return lottery
-        return None
+        lottery = self._lottery_from_row(row)
+        prize_rows = await self.fetchall(
+            'SELECT name, quantity FROM prizes WHERE lottery_id = ? ORDER BY position', (lottery_id,))
+        lottery['prizes'] = [dict(prize) for prize in prize_rows]
+        return lottery
     
-    def get_active_lotteries(self, guild_id: int, limit: int = 10) -> List[Dict]:
-        """获取活跃抽奖列表"""
-        cursor = self.conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM lotteries 
+    async def get_active_lotteries(self, guild_id: int, limit: int = 10) -> List[Dict]:
+        """获取服务器的活跃抽奖列表"""
+        rows = await self.fetchall('''
+            SELECT * FROM lotteries
             WHERE guild_id = ? AND status = 'active'
             ORDER BY created_at DESC
             LIMIT ?
         ''', (guild_id, limit))
         
-        lotteries = []
-        for row in cursor.fetchall():
-            lottery = dict(row)
-            lottery['prizes'] = json.loads(lottery['prizes'])
-            if lottery['required_roles']:
-                lottery['required_roles'] = json.loads(lottery['required_roles'])
-            lotteries.append(lottery)
+        return await self._lotteries_with_prizes(rows)
+    
+    async def get_all_active_lotteries(self, limit: int = 20) -> List[Dict]:
+        """获取所有服务器的活跃抽奖列表"""
+        rows = await self.fetchall('''
+            SELECT * FROM lotteries
+            WHERE status = 'active'
+            ORDER BY created_at DESC
+            LIMIT ?
+        ''', (limit,))
         
-        return lotteries
+        return await self._lotteries_with_prizes(rows)
     
-    def get_participants(self, lottery_id: int) -> List[Tuple[int, int]]:
-        """获取抽奖参与者 (user_id, weight)"""
-        cursor = self.conn.cursor()
+    async def get_scheduled_lotteries(self, after: int, after_id: int = 0) -> List[Tuple[int, int]]:
+        """获取结束时间晚于after、ID大于after_id的活跃抽奖 (id, end_time)，用于填充调度器"""
+        rows = await self.fetchall('''
+            SELECT id, end_time FROM lotteries 
+            WHERE status = 'active' AND end_time > ? AND id > ?
+        ''', (after, after_id))
+        return [tuple(row) for row in rows]
+    
+    async def get_max_lottery_id(self) -> int:
+        """当前最大的抽奖ID"""
+        return await self.fetchval('SELECT MAX(id) FROM lotteries', (), None) or 0
+    
+    async def count_expired_lotteries(self, cutoff: int = None) -> int:
+        """统计已过期但尚未开奖的抽奖数量"""
+        return await self.fetchval('''
+            SELECT COUNT(*) FROM lotteries 
+            WHERE status = 'active' AND end_time <= ?
+        ''', (cutoff or epoch_now(),), 0)
+    
+    async def get_expired_lotteries(self, cutoff: int = None, after: Tuple[int, int] = (0, 0), 
+                                    limit: int = 100) -> List[Dict]:
+        """按 (end_time, id) 顺序分页获取已过期的抽奖
         
-        cursor.execute('''
-            SELECT user_id, weight FROM participants 
-            WHERE lottery_id = ?
-        ''', (lottery_id,))
+        after为上一页最后一行的 (end_time, id)，分页沿(status, end_time)索引向后扫描。
+        """
+        rows = await self.fetchall('''
+            SELECT * FROM lotteries 
+            WHERE status = 'active' AND end_time <= ? AND (end_time, id) > (?, ?)
+            ORDER BY end_time, id
+            LIMIT ?
+        ''', (cutoff or epoch_now(), after[0], after[1], limit))
         
-        return cursor.fetchall()
+        return await self._lotteries_with_prizes(rows)
     
-    def get_participant_count(self, lottery_id: int) -> int:
-        """获取参与者数量"""
-        cursor = self.conn.cursor()
+    async def update_lottery_status(self, lottery_id: int, status: str, require_empty: bool = False) -> bool:
+        """结束进行中的抽奖（例如取消），返回是否由本次调用更新
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM participants WHERE lottery_id = ?
+        以 status='active' 为条件更新（CAS），不会覆盖已被开奖或取消的抽奖；
+        require_empty为True时还要求没有参与者，避免取消刚有人参与的抽奖。
+        """
+        async def op(conn):
+            async with conn.execute('''
+                UPDATE lotteries SET status = ?, updated_at = ? 
+                WHERE id = ? AND status = 'active' AND (? = 0 OR participant_count = 0)
+                RETURNING guild_id
+            ''', (status, epoch_now(), lottery_id, require_empty)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return False
+            await self._bump_guild_stats(conn, row[0], active=-1)
+            return True
+        
+        updated = await self.write(op)
+        if updated:
+            self.active_lotteries.pop(lottery_id, None)
+            logger.info(f"抽奖 {lottery_id} 状态更新为: {status}")
+        return updated
+    
+    async def complete_lottery(self, lottery_id: int, winners: List[Tuple[int, str]], 
+                               draw_order: Optional[array] = None) -> bool:
+        """结束抽奖并写入中奖记录和抽取顺序
+        
+        以 status='active' 为条件更新状态（CAS），只有抢到的调用会写入结果；
+        抽奖已被其他调用结束时什么都不写，返回False。
+        """
+        async def op(conn):
+            async with conn.execute('''
+                UPDATE lotteries SET status = 'ended', updated_at = ? 
+                WHERE id = ? AND status = 'active'
+                RETURNING guild_id
+            ''', (epoch_now(), lottery_id)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return False
+            guild_id = row[0]
+            
+            if draw_order is not None:
+                # 中奖者之后的用户依次作为候补
+                await conn.execute('''
+                    INSERT OR REPLACE INTO draw_orders (lottery_id, user_ids, next_position)
+                    VALUES (?, ?, ?)
+                ''', (lottery_id, draw_order.tobytes(), len(winners)))
+            
+            won_at = epoch_now()
+            await conn.executemany('''
+                INSERT INTO winners (lottery_id, user_id, prize_name, won_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(lottery_id, user_id, prize_name, won_at) for user_id, prize_name in winners])
+            
+            await self._bump_guild_stats(conn, guild_id, active=-1, winners=len(winners))
+            await conn.executemany(USER_STATS_UPSERT, [
+                (guild_id, user_id, 0, 1, 0, won_at) for user_id, _ in winners
+            ])
+            return True
+        
+        completed = await self.write(op)
+        # 无论是否由本次调用结束，抽奖都已不再进行中
+        self.active_lotteries.pop(lottery_id, None)
+        if completed:
+            logger.info(f"添加中奖记录: 抽奖ID={lottery_id}, 中奖人数={len(winners)}")
+        else:
+            logger.info(f"抽奖 {lottery_id} 已被其他操作开奖，本次结果已丢弃")
+        return completed
+    
+    async def get_lottery_winners(self, lottery_id: int) -> List[Dict]:
+        """获取抽奖的中奖记录"""
+        rows = await self.fetchall('''
+            SELECT user_id, prize_name, won_at FROM winners 
+            WHERE lottery_id = ? ORDER BY id
         ''', (lottery_id,))
+        return [dict(row) for row in rows]
+    
+    async def get_waitlist(self, lottery_id: int, limit: int = 10) -> List[int]:
+        """按顺序获取尚未递补的候补用户（只读取需要的片段）"""
+        blob = await self.fetchval('''
+            SELECT substr(user_ids, next_position * 8 + 1, ? * 8) FROM draw_orders 
+            WHERE lottery_id = ?
+        ''', (limit, lottery_id))
+        waitlist = array('q')
+        if blob:
+            waitlist.frombytes(blob)
+        return waitlist.tolist()
+    
+    async def reroll_winner(self, lottery_id: int, user_id: int) -> Optional[Tuple[int, str]]:
+        """用候补名单中的下一位替换指定中奖者，返回 (新中奖者, 奖品)
         
-        return cursor.fetchone()[0]
+        该用户不是中奖者或候补已用完时返回None。
+        """
+        async def op(conn):
+            async with conn.execute('''
+                SELECT w.id, w.prize_name, l.guild_id FROM winners w 
+                JOIN lotteries l ON l.id = w.lottery_id
+                WHERE w.lottery_id = ? AND w.user_id = ? 
+                ORDER BY w.id LIMIT 1
+            ''', (lottery_id, user_id)) as cursor:
+                winner = await cursor.fetchone()
+            if not winner:
+                return None
+            
+            # 取出下一位候补并前移游标，只读取8字节
+            async with conn.execute('''
+                UPDATE draw_orders SET next_position = next_position + 1
+                WHERE lottery_id = ? AND next_position * 8 < length(user_ids)
+                RETURNING substr(user_ids, (next_position - 1) * 8 + 1, 8)
+            ''', (lottery_id,)) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return None
+            
+            new_user_id = array('q', row[0])[0]
+            guild_id = winner['guild_id']
+            won_at = epoch_now()
+            await conn.execute('''
+                UPDATE winners SET user_id = ?, won_at = ? WHERE id = ?
+            ''', (new_user_id, won_at, winner['id']))
+            await conn.execute(USER_STATS_UPSERT, (guild_id, new_user_id, 0, 1, 0, won_at))
+            
+            # 被替换的用户最近中奖时间回退到剩余的中奖记录
+            await conn.execute('''
+                UPDATE user_guild_stats SET wins = wins - 1, last_win_at = (
+                    SELECT MAX(w.won_at) FROM winners w JOIN lotteries l ON l.id = w.lottery_id
+                    WHERE w.user_id = ? AND l.guild_id = ?
+                )
+                WHERE guild_id = ? AND user_id = ?
+            ''', (user_id, guild_id, guild_id, user_id))
+            return new_user_id, winner['prize_name']
+        
+        result = await self.write(op)
+        if result:
+            logger.info(f"抽奖 {lottery_id} 重抽: {user_id} -> {result[0]}")
+        return result
     
-    def add_winners(self, lottery_id: int, winners: List[Tuple[int, str]]):
-        """添加中奖记录"""
-        cursor = self.conn.cursor()
+    # ---- 参与者 ----
+    
+    async def join_lottery(self, lottery_id: int, user_id: int) -> Tuple[str, int]:
+        """参与抽奖，返回 (结果, 参与后的人数)，结果为JOIN_*常量之一
+        
+        状态、结束时间、人数上限和是否已参与都在写事务内的条件语句中判断，
+        并发参与时人数不会超过上限。已参与且允许重复参与时增加权重。
+        """
+        now = epoch_now()
+        entry = self.active_lotteries.get(lottery_id)
+        rejection = entry.rejection(user_id, now) if entry else None
+        if rejection:
+            return rejection, entry.participant_count
         
-        cursor.executemany('''
-            INSERT INTO winners (lottery_id, user_id, prize_name)
-            VALUES (?, ?, ?)
-        ''', [(lottery_id, user_id, prize_name) for user_id, prize_name in winners])
+        async def op(conn):
+            # 新参与者：条件满足时占用一个名额并返回新人数
+            async with conn.execute(f'''
+                UPDATE lotteries SET participant_count = participant_count + 1, total_weight = total_weight + 1
+                WHERE id = ? AND {JOINABLE_CONDITION}
+                    AND NOT EXISTS (SELECT 1 FROM participants WHERE lottery_id = ? AND user_id = ?)
+                RETURNING participant_count, guild_id
+            ''', (lottery_id, now, lottery_id, user_id)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                await conn.execute('''
+                    INSERT INTO participants (lottery_id, user_id, discord_id)
+                    VALUES (?, ?, ?)
+                ''', (lottery_id, user_id, str(user_id)))
+                await self._bump_guild_stats(conn, row['guild_id'], participants=1)
+                await self._bump_user_stats(conn, row['guild_id'], user_id, participations=1)
+                return JOIN_JOINED, row['participant_count']
+            
+            # 已参与：允许重复参与时增加权重
+            cursor = await conn.execute(f'''
+                UPDATE participants SET weight = weight + 1
+                WHERE lottery_id = ? AND user_id = ? AND EXISTS (
+                    SELECT 1 FROM lotteries WHERE id = ? AND allow_multiple_entries AND {JOINABLE_CONDITION}
+                )
+            ''', (lottery_id, user_id, lottery_id, now))
+            if cursor.rowcount:
+                async with conn.execute('''
+                    UPDATE lotteries SET total_weight = total_weight + 1
+                    WHERE id = ?
+                    RETURNING participant_count
+                ''', (lottery_id,)) as cursor:
+                    row = await cursor.fetchone()
+                return JOIN_WEIGHT_ADDED, row[0]
+            
+            # 两条语句都没有命中，查明拒绝原因
+            async with conn.execute('''
+                SELECT status, end_time, max_participants, participant_count, allow_multiple_entries,
+                       EXISTS (SELECT 1 FROM participants WHERE lottery_id = l.id AND user_id = ?) AS joined
+                FROM lotteries l WHERE id = ?
+            ''', (user_id, lottery_id)) as cursor:
+                lottery = await cursor.fetchone()
+            if not lottery:
+                return JOIN_NOT_FOUND, 0
+            if lottery['status'] != 'active':
+                return JOIN_CLOSED, lottery['participant_count']
+            if lottery['end_time'] is not None and lottery['end_time'] <= now:
+                return JOIN_EXPIRED, lottery['participant_count']
+            if lottery['joined'] and not lottery['allow_multiple_entries']:
+                return JOIN_ALREADY, lottery['participant_count']
+            return JOIN_FULL, lottery['participant_count']
         
-        self.conn.commit()
-        logger.info(f"添加中奖记录: 抽奖ID={lottery_id}, 中奖人数={len(winners)}")
+        result, participant_count = await self.write(op)
+        self._record_join(lottery_id, user_id, result, participant_count)
+        if result == JOIN_WEIGHT_ADDED:
+            logger.info(f"用户 {user_id} 在抽奖 {lottery_id} 中增加权重")
+        return result, participant_count
     
-    def update_lottery_status(self, lottery_id: int, status: str):
-        """更新抽奖状态"""
-        cursor = self.conn.cursor()
+    async def join_lottery_many(self, lottery_id: int, user_ids: List[int]) -> List[Tuple[str, int]]:
+        """批量参与同一个抽奖，按user_ids顺序返回每个用户的 (结果, 参与后的人数)
         
-        cursor.execute('''
-            UPDATE lotteries SET status = ?, updated_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (status, lottery_id))
+        与join_lottery规则相同，但整批只读取一次抽奖记录，新参与者用一次executemany插入，
+        计数和服务器统计各更新一次。同一批中重复出现的用户按重复参与处理。
+        """
+        now = epoch_now()
+        entry = self.active_lotteries.get(lottery_id)
+        results: List[Optional[Tuple[str, int]]] = [None] * len(user_ids)
+        if entry:
+            # 热状态能确定的拒绝不进入写事务
+            for i, user_id in enumerate(user_ids):
+                rejection = entry.rejection(user_id, now)
+                if rejection:
+                    results[i] = (rejection, entry.participant_count)
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        user_ids = [user_ids[i] for i in pending]
+        
+        async def op(conn):
+            async with conn.execute('''
+                SELECT guild_id, status, end_time, max_participants, participant_count, allow_multiple_entries
+                FROM lotteries WHERE id = ?
+            ''', (lottery_id,)) as cursor:
+                lottery = await cursor.fetchone()
+            if not lottery:
+                return [(JOIN_NOT_FOUND, 0)] * len(user_ids)
+            
+            count = lottery['participant_count']
+            if lottery['status'] != 'active':
+                return [(JOIN_CLOSED, count)] * len(user_ids)
+            if lottery['end_time'] is not None and lottery['end_time'] <= now:
+                return [(JOIN_EXPIRED, count)] * len(user_ids)
+            
+            async with conn.execute('''
+                SELECT user_id FROM participants
+                WHERE lottery_id = ? AND user_id IN (SELECT value FROM json_each(?))
+            ''', (lottery_id, json.dumps(user_ids))) as cursor:
+                joined = {row[0] for row in await cursor.fetchall()}
+            
+            capacity = lottery['max_participants']
+            allow_multiple = lottery['allow_multiple_entries']
+            batch_results = []
+            new_users: List[int] = []
+            extra_weight: Dict[int, int] = {}
+            for user_id in user_ids:
+                if user_id in joined and not allow_multiple:
+                    batch_results.append((JOIN_ALREADY, count))
+                elif capacity > 0 and count >= capacity:
+                    batch_results.append((JOIN_FULL, count))
+                elif user_id not in joined:
+                    joined.add(user_id)
+                    new_users.append(user_id)
+                    count += 1
+                    batch_results.append((JOIN_JOINED, count))
+                else:
+                    extra_weight[user_id] = extra_weight.get(user_id, 0) + 1
+                    batch_results.append((JOIN_WEIGHT_ADDED, count))
+            
+            if new_users:
+                await conn.executemany('''
+                    INSERT INTO participants (lottery_id, user_id, discord_id)
+                    VALUES (?, ?, ?)
+                ''', [(lottery_id, user_id, str(user_id)) for user_id in new_users])
+            if extra_weight:
+                await conn.executemany('''
+                    UPDATE participants SET weight = weight + ?
+                    WHERE lottery_id = ? AND user_id = ?
+                ''', [(weight, lottery_id, user_id) for user_id, weight in extra_weight.items()])
+            if new_users or extra_weight:
+                await conn.execute('''
+                    UPDATE lotteries SET participant_count = participant_count + ?, total_weight = total_weight + ?
+                    WHERE id = ?
+                ''', (len(new_users), len(new_users) + sum(extra_weight.values()), lottery_id))
+            if new_users:
+                guild_id = lottery['guild_id']
+                await self._bump_guild_stats(conn, guild_id, participants=len(new_users))
+                await conn.executemany(USER_STATS_UPSERT, [
+                    (guild_id, user_id, 1, 0, 0, None) for user_id in new_users
+                ])
+            return batch_results
         
-        self.conn.commit()
-        logger.info(f"抽奖 {lottery_id} 状态更新为: {status}")
+        for i, user_id, result in zip(pending, user_ids, await self.write(op)):
+            results[i] = result
+            self._record_join(lottery_id, user_id, *result)
+        return results
     
-    def get_user_stats(self, user_id: int, guild_id: int) -> Dict:
-        """获取用户统计信息"""
-        cursor = self.conn.cursor()
+    async def has_participated(self, lottery_id: int, user_id: int) -> bool:
+        """用户是否已参与抽奖"""
+        row = await self.fetchone('SELECT 1 FROM participants WHERE lottery_id = ? AND user_id = ?', 
+                                  (lottery_id, user_id))
+        return row is not None
+    
+    async def get_participants(self, lottery_id: int) -> List[Tuple[int, int]]:
+        """获取抽奖参与者 (user_id, weight)"""
+        rows = await self.fetchall('''
+            SELECT user_id, weight FROM participants 
+            WHERE lottery_id = ?
+        ''', (lottery_id,))
         
-        # 参与次数
-        cursor.execute('''
-            SELECT COUNT(DISTINCT lottery_id) FROM participants 
-            WHERE user_id = ? AND lottery_id IN (
-                SELECT id FROM lotteries WHERE guild_id = ?
-            )
-        ''', (user_id, guild_id))
-        participated_count = cursor.fetchone()[0]
-        
-        # 中奖次数
-        cursor.execute('''
-            SELECT COUNT(*) FROM winners 
-            WHERE user_id = ? AND lottery_id IN (
-                SELECT id FROM lotteries WHERE guild_id = ?
-            )
-        ''', (user_id, guild_id))
-        won_count = cursor.fetchone()[0]
+        return [tuple(row) for row in rows]
+    
+    async def iter_participants(self, lottery_id: int, chunk_size: int):
+        """按块流式读取抽奖参与者 (user_id, weight)，不把全部行载入内存"""
+        async with self.reader() as conn:
+            async with conn.execute('''
+                SELECT user_id, weight FROM participants 
+                WHERE lottery_id = ?
+            ''', (lottery_id,)) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+    
+    async def get_participant_count(self, lottery_id: int) -> int:
+        """获取参与者数量"""
+        return await self.fetchval('SELECT participant_count FROM lotteries WHERE id = ?', 
+                                   (lottery_id,), 0)
+    
+    # ---- 统计 ----
+    
+    @staticmethod
+    async def _bump_user_stats(conn: aiosqlite.Connection, guild_id: int, user_id: int, 
+                               participations: int = 0, wins: int = 0, creations: int = 0):
+        """在当前写事务中按增量更新用户统计"""
+        await conn.execute(USER_STATS_UPSERT, (guild_id, user_id, participations, wins, creations, 
+                                               epoch_now() if wins > 0 else None))
+    
+    async def get_user_guild_stats(self, user_id: int, guild_id: int) -> Dict:
+        """获取用户在服务器内的计数（用户统计表主键查询）"""
+        row = await self.fetchone('''
+            SELECT participations, wins, creations, last_win_at
+            FROM user_guild_stats WHERE guild_id = ? AND user_id = ?
+        ''', (guild_id, user_id))
         
-        # 最近中奖记录
-        cursor.execute('''
-            SELECT l.title, w.prize_name, w.won_at 
-            FROM winners w
-            JOIN lotteries l ON w.lottery_id = l.id
-            WHERE w.user_id = ? AND l.guild_id = ?
-            ORDER BY w.won_at DESC
-            LIMIT 5
-        ''', (user_id, guild_id))
-        recent_wins = cursor.fetchall()
+        if not row:
+            return {'participations': 0, 'wins': 0, 'creations': 0, 'last_win_at': None}
+        return dict(row)
+    
+    async def get_user_stats(self, user_id: int, guild_id: int) -> Dict:
+        """获取用户在服务器内的统计信息"""
+        counts = await self.get_user_guild_stats(user_id, guild_id)
+        participated_count = counts['participations']
+        won_count = counts['wins']
+        
+        # 最近中奖记录（没中过奖时不用查）
+        recent_wins = await self.get_user_wins(user_id, guild_id) if won_count else []
         
         return {
             'participated_count': participated_count,
             'won_count': won_count,
             'win_rate': (won_count / participated_count * 100) if participated_count > 0 else 0,
-            'recent_wins': [dict(row) for row in recent_wins]
+            'last_win_at': counts['last_win_at'],
+            'recent_wins': recent_wins
         }
     
-    def get_guild_stats(self, guild_id: int) -> Dict:
-        """获取服务器统计信息"""
-        cursor = self.conn.cursor()
+    async def get_user_wins(self, user_id: int, guild_id: int, limit: int = 5) -> List[Dict]:
+        """获取用户最近的中奖记录"""
+        rows = await self.fetchall('''
+            SELECT l.title, w.prize_name, w.won_at 
+            FROM winners w
+            JOIN lotteries l ON w.lottery_id = l.id
+            WHERE w.user_id = ? AND l.guild_id = ?
+            ORDER BY w.won_at DESC
+            LIMIT ?
+        ''', (user_id, guild_id, limit))
         
-        # 基本统计
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ?', (guild_id,))
-        total_lotteries = cursor.fetchone()[0]
+        return [dict(row) for row in rows]
+    
+    async def get_user_lotteries(self, user_id: int, guild_id: int, limit: int = 5) -> Dict:
+        """获取用户创建、参与和中奖的抽奖，计数为零的列表不再查询"""
+        counts = await self.get_user_guild_stats(user_id, guild_id)
+        created = participated = wins = []
         
-        cursor.execute('SELECT COUNT(*) FROM lotteries WHERE guild_id = ? AND status = "active"', (guild_id,))
-        active_lotteries = cursor.fetchone()[0]
+        if counts['creations']:
+            created = await self.fetchall('''
+                SELECT id, title, status, created_at
+                FROM lotteries 
+                WHERE creator_id = ? AND guild_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+            ''', (user_id, guild_id, limit))
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM participants p
-            JOIN lotteries l ON p.lottery_id = l.id
-            WHERE l.guild_id = ?
-        ''', (guild_id,))
-        total_participations = cursor.fetchone()[0]
+        if counts['participations']:
+            participated = await self.fetchall('''
+                SELECT l.id, l.title, l.status, p.joined_at
+                FROM participants p
+                JOIN lotteries l ON p.lottery_id = l.id
+                WHERE p.user_id = ? AND l.guild_id = ?
+                ORDER BY p.joined_at DESC
+                LIMIT ?
+            ''', (user_id, guild_id, limit))
         
-        cursor.execute('''
-            SELECT COUNT(*) FROM winners w
-            JOIN lotteries l ON w.lottery_id = l.id
-            WHERE l.guild_id = ?
+        if counts['wins']:
+            wins = await self.get_user_wins(user_id, guild_id, limit)
+        
+        return {
+            'counts': counts,
+            'created': [dict(row) for row in created],
+            'participated': [dict(row) for row in participated],
+            'wins': wins
+        }
+    
+    async def get_user_global_stats(self, user_id: int) -> Dict:
+        """获取用户在所有服务器的统计信息"""
+        row = await self.fetchone('''
+            SELECT COALESCE(SUM(participations), 0), COALESCE(SUM(wins), 0), COALESCE(SUM(creations), 0)
+            FROM user_guild_stats WHERE user_id = ?
+        ''', (user_id,))
+        
+        return {
+            'participation_count': row[0],
+            'win_count': row[1],
+            'created_count': row[2]
+        }
+    
+    @staticmethod
+    async def _bump_guild_stats(conn: aiosqlite.Connection, guild_id: int, lotteries: int = 0, 
+                                active: int = 0, participants: int = 0, winners: int = 0):
+        """在当前写事务中按增量更新服务器统计"""
+        await conn.execute('''
+            INSERT INTO statistics (guild_id, total_lotteries, active_lotteries, total_participants, total_winners, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET
+                total_lotteries = total_lotteries + excluded.total_lotteries,
+                active_lotteries = active_lotteries + excluded.active_lotteries,
+                total_participants = total_participants + excluded.total_participants,
+                total_winners = total_winners + excluded.total_winners,
+                last_updated = excluded.last_updated
+        ''', (guild_id, lotteries, active, participants, winners, epoch_now()))
+    
+    async def get_guild_summary(self, guild_id: int) -> Dict:
+        """获取服务器的抽奖、参与和中奖次数（统计表主键查询）"""
+        row = await self.fetchone('''
+            SELECT total_lotteries, active_lotteries, total_participants, total_winners
+            FROM statistics WHERE guild_id = ?
         ''', (guild_id,))
-        total_wins = cursor.fetchone()[0]
+        total_lotteries, active_lotteries, total_participations, total_wins = row if row else (0, 0, 0, 0)
+        
+        return {
+            'total_lotteries': total_lotteries,
+            'active_lotteries': active_lotteries,
+            'completed_lotteries': total_lotteries - active_lotteries,
+            'total_participations': total_participations,
+            'total_wins': total_wins
+        }
+    
+    async def get_guild_stats(self, guild_id: int) -> Dict:
+        """获取服务器统计信息"""
+        stats = await self.get_guild_summary(guild_id)
         
         # 最活跃用户
-        cursor.execute('''
+        top_participants = await self.fetchall('''
             SELECT p.user_id, COUNT(*) as participation_count
             FROM participants p
             JOIN lotteries l ON p.lottery_id = l.id
@@ -333,10 +1097,9 @@ class DatabaseManager:
             ORDER BY participation_count DESC
             LIMIT 5
         ''', (guild_id,))
-        top_participants = cursor.fetchall()
         
         # 最幸运用户
-        cursor.execute('''
+        top_winners = await self.fetchall('''
             SELECT w.user_id, COUNT(*) as win_count
             FROM winners w
             JOIN lotteries l ON w.lottery_id = l.id
@@ -345,87 +1108,180 @@ class DatabaseManager:
             ORDER BY win_count DESC
             LIMIT 5
         ''', (guild_id,))
-        top_winners = cursor.fetchall()
         
-        return {
-            'total_lotteries': total_lotteries,
-            'active_lotteries': active_lotteries,
-            'completed_lotteries': total_lotteries - active_lotteries,
-            'total_participations': total_participations,
-            'total_wins': total_wins,
-            'average_win_rate': (total_wins / total_participations * 100) if total_participations > 0 else 0,
+        total_participations = stats['total_participations']
+        stats.update({
+            'average_win_rate': (stats['total_wins'] / total_participations * 100) if total_participations > 0 else 0,
             'top_participants': [dict(row) for row in top_participants],
             'top_winners': [dict(row) for row in top_winners]
-        }
+        })
+        return stats
     
-    def update_guild_stats(self, guild_id: int):
-        """更新服务器统计"""
-        cursor = self.conn.cursor()
+    async def reconcile_guild_stats(self) -> int:
+        """按明细表重算服务器统计，修正增量维护的偏差，返回被修正的服务器数"""
+        async def op(conn):
+            async with conn.execute(GUILD_TOTALS_CTE + '''
+                SELECT COUNT(*) FROM totals t
+                LEFT JOIN statistics s ON s.guild_id = t.guild_id
+                WHERE s.guild_id IS NULL
+                   OR s.total_lotteries != t.total_lotteries
+                   OR s.active_lotteries != t.active_lotteries
+                   OR s.total_participants != t.total_participants
+                   OR s.total_winners != t.total_winners
+            ''') as cursor:
+                drifted = (await cursor.fetchone())[0]
+            
+            # WHERE true 用于消除 INSERT ... SELECT 与 ON CONFLICT 的语法歧义
+            await conn.execute(GUILD_TOTALS_CTE + '''
+                INSERT INTO statistics (guild_id, total_lotteries, active_lotteries, total_participants, total_winners, last_updated)
+                SELECT guild_id, total_lotteries, active_lotteries, total_participants, total_winners, ?
+                FROM totals WHERE true
+                ON CONFLICT(guild_id) DO UPDATE SET
+                    total_lotteries = excluded.total_lotteries,
+                    active_lotteries = excluded.active_lotteries,
+                    total_participants = excluded.total_participants,
+                    total_winners = excluded.total_winners,
+                    last_updated = excluded.last_updated
+            ''', (epoch_now(),))
+            
+            # 抽奖已全部被清理的服务器归零
+            cursor = await conn.execute('''
+                UPDATE statistics SET total_lotteries = 0, active_lotteries = 0, total_participants = 0,
+                                      total_winners = 0, last_updated = ?
+                WHERE guild_id NOT IN (SELECT DISTINCT guild_id FROM lotteries)
+                  AND (total_lotteries != 0 OR active_lotteries != 0 OR total_participants != 0 OR total_winners != 0)
+            ''', (epoch_now(),))
+            return drifted + cursor.rowcount
         
-        stats = self.get_guild_stats(guild_id)
+        return await self.write(op)
+    
+    async def reconcile_user_stats(self) -> int:
+        """按明细表校正用户统计，返回被修正的用户统计行数
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO statistics 
-            (guild_id, total_lotteries, total_participants, total_winners, last_updated)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (guild_id, stats['total_lotteries'], stats['total_participations'], stats['total_wins']))
+        全表汇总和比对在只读连接上完成，不占用写入任务；写入只针对有偏差的行，
+        每批在写入任务中按明细重新计算后覆盖，没有任何记录的用户统计被删除。
+        """
+        # 统计行与明细汇总不一致，或明细中已没有对应记录的 (guild_id, user_id)
+        drifted = await self.fetchall(USER_TOTALS_CTE + '''
+            SELECT guild_id, user_id FROM (
+                SELECT guild_id, user_id, participations, wins, creations, last_win_at FROM totals
+                EXCEPT
+                SELECT guild_id, user_id, participations, wins, creations, last_win_at FROM user_guild_stats
+            )
+            UNION
+            SELECT guild_id, user_id FROM user_guild_stats s
+            WHERE NOT EXISTS (SELECT 1 FROM totals t WHERE t.guild_id = s.guild_id AND t.user_id = s.user_id)
+        ''')
+        keys = [[row[0], row[1]] for row in drifted]
+        
+        async def op(conn, batch):
+            # 在写入任务中重新计算，覆盖比对之后发生的增量更新也不会丢失
+            await conn.execute(USER_STATS_RECOMPUTE, (batch,))
+            await conn.execute('''
+                DELETE FROM user_guild_stats
+                WHERE participations = 0 AND wins = 0 AND creations = 0
+                  AND (guild_id, user_id) IN (
+                      SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+                  )
+            ''', (batch,))
         
-        self.conn.commit()
+        batch_size = config.STATS_RECONCILE_BATCH_SIZE
+        for start in range(0, len(keys), batch_size):
+            batch = json.dumps(keys[start:start + batch_size])
+            await self.write(lambda conn: op(conn, batch))
+        return len(keys)
+    
+    async def get_global_stats(self) -> Dict:
+        """获取全局统计信息"""
+        return {
+            'total_lotteries': await self.fetchval('SELECT COUNT(*) FROM lotteries', default=0),
+            'active_lotteries': await self.fetchval("SELECT COUNT(*) FROM lotteries WHERE status = 'active'", default=0),
+            'total_participants': await self.fetchval('SELECT COUNT(*) FROM participants', default=0),
+            'total_winners': await self.fetchval('SELECT COUNT(*) FROM winners', default=0),
+            'total_statistics': await self.fetchval('SELECT COUNT(*) FROM statistics', default=0)
+        }
     
-    def get_expired_lotteries(self) -> List[Dict]:
-        """获取已过期的抽奖"""
-        cursor = self.conn.cursor()
-        current_time = datetime.datetime.now()
+    async def get_top_guilds(self, limit: int = 5) -> List[Dict]:
+        """获取创建抽奖最多的服务器"""
+        rows = await self.fetchall('''
+            SELECT guild_id, COUNT(*) as lottery_count
+            FROM lotteries
+            GROUP BY guild_id
+            ORDER BY lottery_count DESC
+            LIMIT ?
+        ''', (limit,))
         
-        cursor.execute('''
-            SELECT * FROM lotteries 
-            WHERE status = 'active' AND end_time <= ? AND end_time IS NOT NULL
-        ''', (current_time,))
+        return [dict(row) for row in rows]
+    
+    async def get_global_top_users(self, limit: int = 10) -> Dict:
+        """获取全局最活跃和最幸运的用户"""
+        top_participants = await self.fetchall('''
+            SELECT user_id, COUNT(*) as participation_count
+            FROM participants
+            GROUP BY user_id
+            ORDER BY participation_count DESC
+            LIMIT ?
+        ''', (limit,))
         
-        lotteries = []
-        for row in cursor.fetchall():
-            lottery = dict(row)
-            lottery['prizes'] = json.loads(lottery['prizes'])
-            lotteries.append(lottery)
+        top_winners = await self.fetchall('''
+            SELECT user_id, COUNT(*) as win_count
+            FROM winners
+            GROUP BY user_id
+            ORDER BY win_count DESC
+            LIMIT ?
+        ''', (limit,))
         
-        return lotteries
+        return {
+            'top_participants': [dict(row) for row in top_participants],
+            'top_winners': [dict(row) for row in top_winners]
+        }
     
-    def cleanup_old_data(self, days: int = 90):
+    # ---- 维护 ----
+    
+    async def cleanup_old_data(self, days: int = 90) -> int:
         """清理旧数据"""
-        cursor = self.conn.cursor()
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
+        cutoff = epoch_now() - days * 86400
         
-        # 删除旧的已结束抽奖及相关数据
-        cursor.execute('''
-            DELETE FROM winners WHERE lottery_id IN (
-                SELECT id FROM lotteries 
-                WHERE status IN ('ended', 'cancelled') AND updated_at < ?
-            )
-        ''', (cutoff_date,))
-        
-        cursor.execute('''
-            DELETE FROM participants WHERE lottery_id IN (
-                SELECT id FROM lotteries 
+        async with self.transaction() as conn:
+            # 删除旧的已结束抽奖及相关数据
+            await conn.execute('''
+                DELETE FROM draw_orders WHERE lottery_id IN (
+                    SELECT id FROM lotteries 
+                    WHERE status IN ('ended', 'cancelled') AND updated_at < ?
+                )
+            ''', (cutoff,))
+            
+            await conn.execute('''
+                DELETE FROM prizes WHERE lottery_id IN (
+                    SELECT id FROM lotteries 
+                    WHERE status IN ('ended', 'cancelled') AND updated_at < ?
+                )
+            ''', (cutoff,))
+            
+            await conn.execute('''
+                DELETE FROM winners WHERE lottery_id IN (
+                    SELECT id FROM lotteries 
+                    WHERE status IN ('ended', 'cancelled') AND updated_at < ?
+                )
+            ''', (cutoff,))
+            
+            await conn.execute('''
+                DELETE FROM participants WHERE lottery_id IN (
+                    SELECT id FROM lotteries 
+                    WHERE status IN ('ended', 'cancelled') AND updated_at < ?
+                )
+            ''', (cutoff,))
+            
+            cursor = await conn.execute('''
+                DELETE FROM lotteries 
                 WHERE status IN ('ended', 'cancelled') AND updated_at < ?
-            )
-        ''', (cutoff_date,))
-        
-        cursor.execute('''
-            DELETE FROM lotteries 
-            WHERE status IN ('ended', 'cancelled') AND updated_at < ?
-        ''', (cutoff_date,))
-        
-        deleted_count = cursor.rowcount
-        self.conn.commit()
+            ''', (cutoff,))
+            
+            deleted_count = cursor.rowcount
         
         logger.info(f"清理了 {deleted_count} 条旧数据记录")
+        
+        # 清理会减少明细，统计按明细重算
+        await self.reconcile_guild_stats()
+        await self.reconcile_user_stats()
         return deleted_count
-    
-    def close(self):
-        """关闭数据库连接"""
-        if self.conn:
-            self.conn.close()
-            logger.info("数据库连接已关闭")
-
-# 创建全局数据库管理器实例
-db_manager = DatabaseManager()
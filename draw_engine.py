@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人开奖引擎
+
+按权重不放回抽样（Efraimidis–Spirakis）：给每个参与者生成随机键
+E/w（E服从参数为1的指数分布，w为权重），键最小的k个即为中奖者，
+与逐个按权重抽取并移除已中奖者的结果分布相同。
+建堆O(n)，取出k个O(k log n)，不需要每抽一个奖品就重建权重列表。
+
+参与者很多时改用流式模式：WeightedReservoir按A-ExpJ（带指数跳跃的
+加权蓄水池抽样）逐块消费数据库游标，只在内存中保留k个候选者。
+超大抽奖把参与者读成array('q')快照，交给进程池抽样，事件循环不被阻塞。
+
+开奖结果除中奖者外还返回抽取顺序（array('q')）：中奖名额之后再保留
+waitlist个候补，重抽时直接取下一位，不需要重新扫描参与者表。
+三种模式都只取前 名额+waitlist 位，内存模式仍是O(n + k log n)，
+不为候补对全部参与者排序；候补用完后无法再重抽。
+"""
+
+import asyncio
+import heapq
+import math
+import random
+from array import array
+from concurrent.futures import Executor
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+def sample_keys(participants: Iterable[Tuple[int, int]],
+                rng: Optional[random.Random] = None) -> List[Tuple[float, int]]:
+    """为每个参与者生成抽样键 (键, user_id)，权重不大于0的参与者不参与抽奖"""
+    expovariate = (rng or random).expovariate
+    return [(expovariate(1.0) / weight, user_id)
+            for user_id, weight in participants if weight > 0]
+
+def weighted_sample(participants: Iterable[Tuple[int, int]], k: int,
+                    rng: Optional[random.Random] = None) -> List[int]:
+    """从 (user_id, weight) 中按权重不放回抽取k个用户，按抽中顺序返回"""
+    if k <= 0:
+        return []
+    
+    keys = sample_keys(participants, rng)
+    if k >= len(keys):
+        keys.sort()
+        return [user_id for _, user_id in keys]
+    
+    heapq.heapify(keys)
+    return [heapq.heappop(keys)[1] for _ in range(k)]
+
+def prize_slots(prizes: Sequence[Dict]) -> List[str]:
+    """按奖品顺序和数量展开为名额列表"""
+    return [prize['name'] for prize in prizes for _ in range(prize.get('quantity', 1))]
+
+def draw(participants: Iterable[Tuple[int, int]], prizes: Sequence[Dict], waitlist: int = 0,
+         rng: Optional[random.Random] = None) -> Tuple[List[Tuple[int, str]], array]:
+    """为所有奖品名额抽取中奖者，返回 ([(user_id, prize_name)], 抽取顺序)
+    
+    抽取顺序包含中奖者和其后最多waitlist个候补；参与者不足时后面的名额空缺。
+    """
+    slots = prize_slots(prizes)
+    order = array('q', weighted_sample(participants, len(slots) + waitlist, rng))
+    return list(zip(order, slots)), order
+
+class WeightedReservoir:
+    """A-ExpJ加权蓄水池：流式地从 (user_id, weight) 中按权重不放回抽取k个
+    
+    候选者的键为 u^(1/w)，保留键最大的k个。堆满后按指数跳跃直接越过
+    不会进入蓄水池的参与者，只有被选中替换时才消耗随机数。
+    """
+    
+    def __init__(self, k: int, rng: Optional[random.Random] = None):
+        self.k = k
+        self.rng = rng or random
+        self.heap: List[Tuple[float, int]] = []  # (键, user_id) 小顶堆
+        self.skip = 0.0  # 还需跳过的权重
+    
+    def _next_skip(self):
+        """根据当前最小键计算下一次跳跃的权重"""
+        # 1 - random()落在(0, 1]，避免log(0)
+        self.skip = math.log(1.0 - self.rng.random()) / math.log(self.heap[0][0])
+    
+    def offer_many(self, rows: Iterable[Tuple[int, int]]):
+        """消费一批 (user_id, weight)"""
+        if self.k <= 0:
+            return
+        
+        heap = self.heap
+        for user_id, weight in rows:
+            if weight <= 0:
+                continue
+            
+            if len(heap) < self.k:
+                key = (1.0 - self.rng.random()) ** (1.0 / weight)
+                heapq.heappush(heap, (key, user_id))
+                if len(heap) == self.k:
+                    self._next_skip()
+                continue
+            
+            self.skip -= weight
+            if self.skip > 0:
+                continue
+            
+            # 跳跃落在该参与者上：新键在 (T^w, 1) 上均匀取值后开w次方
+            low = heap[0][0] ** weight
+            key = self.rng.uniform(low, 1.0) ** (1.0 / weight)
+            heapq.heapreplace(heap, (key, user_id))
+            self._next_skip()
+    
+    def result(self) -> array:
+        """按抽中顺序（键从大到小）返回蓄水池中的用户"""
+        return array('q', (user_id for _, user_id in sorted(self.heap, reverse=True)))
+
+async def stream_draw(chunks: AsyncIterable[Sequence[Tuple[int, int]]], prizes: Sequence[Dict],
+                      waitlist: int = 0, rng: Optional[random.Random] = None) -> Tuple[List[Tuple[int, str]], array]:
+    """流式版本的draw，chunks为逐块产出 (user_id, weight) 的异步迭代器；额外保留waitlist个候补"""
+    slots = prize_slots(prizes)
+    reservoir = WeightedReservoir(len(slots) + waitlist, rng)
+    async for rows in chunks:
+        reservoir.offer_many(rows)
+    order = reservoir.result()
+    return list(zip(order, slots)), order
+
+async def snapshot_participants(chunks: AsyncIterable[Sequence[Tuple[int, int]]]) -> Tuple[array, array]:
+    """把参与者读成紧凑的 (user_id数组, weight数组) 快照，每人只占16字节"""
+    user_ids, weights = array('q'), array('q')
+    async for rows in chunks:
+        user_ids.extend(row[0] for row in rows)
+        weights.extend(row[1] for row in rows)
+    return user_ids, weights
+
+def order_snapshot(user_ids: array, weights: array, k: int) -> array:
+    """在进程池中对快照抽取前k位（模块级函数，可被pickle）"""
+    # 每次使用独立的随机源，不依赖子进程继承的全局状态
+    return array('q', weighted_sample(zip(user_ids, weights), k, random.Random()))
+
+async def pooled_draw(executor: Executor, chunks: AsyncIterable[Sequence[Tuple[int, int]]],
+                      prizes: Sequence[Dict], waitlist: int = 0) -> Tuple[List[Tuple[int, str]], array]:
+    """进程池版本的draw：事件循环只负责读取快照，抽样在executor中执行"""
+    slots = prize_slots(prizes)
+    user_ids, weights = await snapshot_participants(chunks)
+    loop = asyncio.get_running_loop()
+    order = await loop.run_in_executor(executor, order_snapshot, user_ids, weights, len(slots) + waitlist)
+    return list(zip(order, slots)), order
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人调度压测
+
+在模拟时钟上回放一段时间内的定时抽奖：抽奖按创建时间陆续加入调度器，
+到期后经工作池执行（每次开奖消耗固定的虚拟耗时），最后报告开奖延迟
+（实际开始时间减结束时间）和吞吐量。调度器和工作池与机器人使用的是同一套代码。
+
+用法：
+    python harness.py --days 30 --lotteries 100000
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List
+
+from clock import SimulatedClock
+from scheduler import DrawWorkerPool, LotteryScheduler
+
+def percentile(ordered: List[float], p: float) -> float:
+    """已排序样本的百分位数"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+async def replay(days: float, lotteries: int, guilds: int, concurrency: int,
+                 draw_seconds: float, max_duration_hours: float, seed: int) -> Dict:
+    """回放一次调度，返回统计结果"""
+    rng = random.Random(seed)
+    start = 1_700_000_000
+    span = days * 86400
+    clock = SimulatedClock(start)
+    
+    # (创建时间, 结束时间, 抽奖ID, 服务器ID)；创建时间均匀分布在回放区间内
+    plan = []
+    for lottery_id in range(1, lotteries + 1):
+        created = start + rng.uniform(0, span)
+        end_time = int(created + rng.uniform(60, max_duration_hours * 3600))
+        plan.append((created, end_time, lottery_id, rng.randrange(guilds)))
+    plan.sort()
+    end_times = {lottery_id: end_time for _, end_time, lottery_id, _ in plan}
+    guild_of = {lottery_id: guild_id for _, _, lottery_id, guild_id in plan}
+    
+    lateness: List[float] = []
+    
+    async def draw(lottery_id: int):
+        lateness.append(clock.time() - end_times[lottery_id])
+        await clock.sleep(draw_seconds)
+    
+    workers = DrawWorkerPool(draw, concurrency, clock=clock)
+    
+    async def due(lottery_id: int):
+        await workers.submit(guild_of[lottery_id], lottery_id, end_times[lottery_id])
+    
+    scheduler = LotteryScheduler(due, clock=clock)
+    
+    async def creator():
+        for created, end_time, lottery_id, _ in plan:
+            await clock.sleep(created - clock.time())
+            scheduler.schedule(lottery_id, end_time)
+    
+    workers.start()
+    scheduler.start()
+    feeder = asyncio.create_task(creator())
+    
+    real_start = time.perf_counter()
+    # 跑到最后一个抽奖到期之后，留出排空工作池的时间
+    wakeups = await clock.run_until(max(end_times.values()) + 3600)
+    real_elapsed = time.perf_counter() - real_start
+    
+    feeder.cancel()
+    scheduler.stop()
+    workers.stop()
+    
+    ordered = sorted(lateness)
+    return {
+        'lotteries': lotteries,
+        'drawn': len(lateness),
+        'pending': len(scheduler) + workers.queue_depth(),
+        'virtual_days': days,
+        'real_seconds': real_elapsed,
+        'wakeups': wakeups,
+        'throughput': len(lateness) / real_elapsed if real_elapsed else 0.0,
+        'lateness_avg': sum(ordered) / len(ordered) if ordered else 0.0,
+        'lateness_p50': percentile(ordered, 0.50),
+        'lateness_p95': percentile(ordered, 0.95),
+        'lateness_p99': percentile(ordered, 0.99),
+        'lateness_max': ordered[-1] if ordered else 0.0,
+        'failed': workers.failed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="在模拟时钟上回放定时抽奖调度")
+    parser.add_argument('--days', type=float, default=30, help="回放的天数")
+    parser.add_argument('--lotteries', type=int, default=100000, help="定时抽奖数量")
+    parser.add_argument('--guilds', type=int, default=500, help="服务器数量")
+    parser.add_argument('--concurrency', type=int, default=4, help="开奖工作池并发数")
+    parser.add_argument('--draw-seconds', type=float, default=0.5, help="每次开奖的虚拟耗时（秒）")
+    parser.add_argument('--max-duration-hours', type=float, default=72, help="抽奖最长持续时间（小时）")
+    parser.add_argument('--seed', type=int, default=1, help="随机种子")
+    args = parser.parse_args()
+    
+    result = asyncio.run(replay(args.days, args.lotteries, args.guilds, args.concurrency,
+                                args.draw_seconds, args.max_duration_hours, args.seed))
+    
+    print(f"回放 {result['virtual_days']:g} 天 / {result['lotteries']} 个抽奖，"
+          f"实际用时 {result['real_seconds']:.2f} 秒（{result['wakeups']} 次时钟唤醒）")
+    print(f"已开奖: {result['drawn']}  未完成: {result['pending']}  失败: {result['failed']}")
+    print(f"吞吐量: {result['throughput']:.0f} 次开奖/秒（真实时间）")
+    print(f"开奖延迟(虚拟秒): 平均 {result['lateness_avg']:.3f}  P50 {result['lateness_p50']:.3f}  "
+          f"P95 {result['lateness_p95']:.3f}  P99 {result['lateness_p99']:.3f}  最大 {result['lateness_max']:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人交互去重
+
+Discord可能重复投递同一个交互，进程也可能在临时错误后重试处理。
+InteractionLog按interaction.id记录每个交互已发送的响应：同一ID再次到达时
+直接重放记录的响应，不再执行命令，避免重复写入（例如允许重复参与时权重被加两次）。
+记录在ttl秒后过期（交互令牌本身只有15分钟有效），条目数超过max_entries时淘汰最早的记录。
+没有发出任何响应就结束的处理（例如出错）不保留记录，重试时会重新执行。
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from clock import Clock, get_clock
+
+class InteractionRecord:
+    """一个交互的处理状态和已发送的响应"""
+    
+    __slots__ = ('responses', 'done', 'expires_at')
+    
+    def __init__(self, expires_at: float):
+        self.responses: List[Tuple[Optional[str], Dict[str, Any]]] = []  # (content, send参数)
+        self.done = asyncio.Event()
+        self.expires_at = expires_at
+
+class InteractionLog:
+    """按interaction.id保存响应的LRU，带TTL过期"""
+    
+    def __init__(self, ttl: float, max_entries: int, clock: Optional[Clock] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock or get_clock()
+        self._records: 'OrderedDict[int, InteractionRecord]' = OrderedDict()
+        
+        # 指标
+        self.replays = 0
+    
+    def __len__(self) -> int:
+        return len(self._records)
+    
+    def _evict(self, now: float):
+        # TTL固定，插入顺序即过期顺序
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.expires_at > now:
+                break
+            del self._records[key]
+    
+    def claim(self, interaction_id: int) -> Tuple[InteractionRecord, bool]:
+        """登记一个交互，返回 (记录, 是否首次到达)"""
+        now = self.clock.time()
+        self._evict(now)
+        record = self._records.get(interaction_id)
+        if record is not None:
+            self.replays += 1
+            return record, False
+        
+        record = self._records[interaction_id] = InteractionRecord(now + self.ttl)
+        if len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+        return record, True
+    
+    def record(self, interaction_id: int, content: Optional[str], kwargs: Dict[str, Any]):
+        """记录一条已发送的响应"""
+        record = self._records.get(interaction_id)
+        if record is not None:
+            record.responses.append((content, kwargs))
+    
+    def finish(self, interaction_id: int):
+        """处理结束；没有响应的记录被丢弃，重试时重新执行"""
+        record = self._records.get(interaction_id)
+        if record is None:
+            return
+        record.done.set()
+        if not record.responses:
+            del self._records[interaction_id]
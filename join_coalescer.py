@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人参与请求合并
+
+热门抽奖发布后，大量用户会在几秒内点击参与按钮。JoinCoalescer按抽奖收集
+window秒内的点击：整批只读取一次抽奖记录做角色检查，再通过一次批量写入
+（状态、人数上限、重复参与判断和executemany插入）处理全部符合条件的用户，
+最后把各自的结果交还给每个等待中的交互。单批达到max_batch人时立即写入。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from clock import Clock, get_clock
+
+logger = logging.getLogger(__name__)
+
+# 用户没有抽奖要求的角色
+JOIN_MISSING_ROLE = 'missing_role'
+
+class JoinCoalescer:
+    """按抽奖合并短时间内的参与请求"""
+    
+    def __init__(self, load_lottery: Callable[[int], Awaitable[Optional[Dict]]],
+                 join_many: Callable[[int, List[int]], Awaitable[List[Tuple[str, int]]]],
+                 window: float, max_batch: int, clock: Optional[Clock] = None):
+        self.load_lottery = load_lottery  # lottery_id -> 抽奖记录
+        self.join_many = join_many  # (lottery_id, user_ids) -> [(结果, 人数)]
+        self.window = window
+        self.max_batch = max_batch
+        self.clock = clock or get_clock()
+        self._pending: Dict[int, List[Tuple[int, Optional[Set[int]], asyncio.Future]]] = {}
+        self._flushing: Set[asyncio.Task] = set()  # 持有写入任务的引用，防止被回收
+        
+        # 指标
+        self.batches = 0
+        self.joins = 0
+        self.largest_batch = 0
+    
+    async def join(self, lottery_id: int, user_id: int,
+                   role_ids: Optional[Iterable[int]] = None) -> Tuple[str, int, Optional[Dict]]:
+        """提交一次参与，返回 (结果, 参与后的人数, 抽奖记录)；role_ids为None时不检查角色"""
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.get(lottery_id)
+        if batch is None:
+            batch = self._pending[lottery_id] = []
+            self._spawn(self._flush_later(lottery_id, batch))
+        batch.append((user_id, None if role_ids is None else set(role_ids), future))
+        
+        if len(batch) >= self.max_batch:
+            # 批次已满，不再等待窗口结束
+            self._pending.pop(lottery_id)
+            self._spawn(self._flush(lottery_id, batch))
+        return await future
+    
+    def _spawn(self, coro: Awaitable[Any]):
+        task = asyncio.ensure_future(coro)
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+    
+    async def _flush_later(self, lottery_id: int, batch: List):
+        await self.clock.sleep(self.window)
+        # 批次可能已因满员提前写入
+        if self._pending.get(lottery_id) is batch:
+            del self._pending[lottery_id]
+            await self._flush(lottery_id, batch)
+    
+    async def _flush(self, lottery_id: int, batch: List):
+        self.batches += 1
+        self.joins += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            lottery = await self.load_lottery(lottery_id)
+            required_roles = set(lottery['required_roles'] or []) if lottery else set()
+            
+            eligible = []
+            for user_id, role_ids, future in batch:
+                if required_roles and role_ids is not None and not required_roles & role_ids:
+                    if not future.done():
+                        future.set_result((JOIN_MISSING_ROLE, lottery['participant_count'], lottery))
+                else:
+                    eligible.append((user_id, future))
+            if not eligible:
+                return
+            
+            results = await self.join_many(lottery_id, [user_id for user_id, _ in eligible])
+            for (_, future), (result, participant_count) in zip(eligible, results):
+                if not future.done():
+                    future.set_result((result, participant_count, lottery))
+        
+        except Exception as e:
+            logger.error(f'批量参与抽奖失败 (抽奖ID: {lottery_id}, {len(batch)}人): {e}')
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    def stats(self) -> Dict:
+        """返回合并批次统计"""
+        return {
+            'batches': self.batches,
+            'joins': self.joins,
+            'pending': sum(len(batch) for batch in self._pending.values()),
+            'largest_batch': self.largest_batch,
+            'avg_batch': self.joins / self.batches if self.batches else 0.0
+        }
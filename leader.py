@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人多实例选主
+
+多个机器人进程共用同一个数据库时，只有持有租约的进程运行开奖调度。
+租约存放在leases表中：持有者每隔heartbeat秒续约一次，租约在ttl秒后过期；
+持有者退出或卡死后，其他进程在租约过期后的下一次心跳接管。
+抢占和续约是同一条带条件的UPSERT，由SQLite的写锁保证同一时刻只有一个持有者；
+续约还要求租约的过期时间仍是本进程上次写入的值，降级后不会再凭旧租约继续持有。
+
+本地多进程测试：在多个终端运行
+    python leader.py lottery_bot.db
+观察谁成为leader，结束leader进程后其余进程会在ttl秒内接管。
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+import aiosqlite
+
+from clock import Clock, get_clock
+
+logger = logging.getLogger(__name__)
+
+async def try_acquire(conn: aiosqlite.Connection, name: str, holder: str, ttl: int, now: int,
+                      expires_at: Optional[int] = None) -> bool:
+    """抢占或续约租约：租约空闲或已过期时成功；续约时expires_at为自己上次写入的过期时间，
+    只有租约仍归自己、未过期且过期时间未被改动时才成功"""
+    async with conn.execute('''
+        INSERT INTO leases (name, holder, expires_at, acquired_at) VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            holder = excluded.holder,
+            expires_at = excluded.expires_at,
+            acquired_at = CASE WHEN leases.holder = excluded.holder THEN leases.acquired_at
+                               ELSE excluded.acquired_at END
+        WHERE leases.expires_at <= ?
+           OR (leases.holder = excluded.holder AND leases.expires_at = ?)
+        RETURNING holder
+    ''', (name, holder, now + ttl, now, now, expires_at)) as cursor:
+        return await cursor.fetchone() is not None
+
+async def release(conn: aiosqlite.Connection, name: str, holder: str):
+    """主动释放租约，其他进程无需等待过期即可接管"""
+    await conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+def default_holder_id() -> str:
+    """生成进程的持有者标识：主机名:进程号:随机后缀"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class LeaderElector:
+    """基于SQLite租约的选主，write为在写事务中执行op(conn)的协程函数"""
+    
+    def __init__(self, write: Callable[[Callable[[aiosqlite.Connection], Awaitable[Any]]], Awaitable[Any]],
+                 name: str, ttl: int, heartbeat: float,
+                 on_elected: Callable[[], Awaitable[None]],
+                 on_demoted: Callable[[], Awaitable[None]],
+                 on_heartbeat: Optional[Callable[[], Awaitable[None]]] = None,
+                 holder: Optional[str] = None, clock: Optional[Clock] = None):
+        self.write = write
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_heartbeat = on_heartbeat
+        self.holder = holder or default_holder_id()
+        self.clock = clock or get_clock()
+        self.is_leader = False
+        self._expires_at = 0  # 本进程最近一次写入的租约过期时间，续约时作为fencing值
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """启动心跳协程"""
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run())
+    
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    async def stop(self):
+        """停止心跳；当前是leader时先降级再释放租约"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            try:
+                await self.write(lambda conn: release(conn, self.name, self.holder))
+            except Exception as e:
+                logger.error(f'释放租约失败: {e}')
+    
+    async def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        logger.info(f"{self.holder} {'成为' if leader else '不再是'} {self.name} 的leader")
+        try:
+            await (self.on_elected() if leader else self.on_demoted())
+        except Exception as e:
+            logger.error(f'切换leader状态时出错: {e}')
+    
+    async def _acquire(self, now: int) -> bool:
+        """抢占或续约；已是leader时最多等到当前租约到期，写入排队过久按失败处理"""
+        expires_at = self._expires_at if self.is_leader else None
+        task = asyncio.ensure_future(self.write(
+            lambda conn: try_acquire(conn, self.name, self.holder, self.ttl, now, expires_at)))
+        if not self.is_leader:
+            return await task
+        
+        finished = asyncio.Event()
+        task.add_done_callback(lambda _: finished.set())
+        timeout = self._expires_at - self.clock.time()
+        if timeout <= 0 or not await self.clock.wait(finished, timeout):
+            # 取消后写入任务会跳过这次还没执行的续约，降级后租约按时过期，其他进程可以接管
+            task.cancel()
+            raise asyncio.TimeoutError('续约超过租约有效期')
+        return task.result()
+    
+    async def _run(self):
+        while True:
+            now = self.clock.now()
+            try:
+                acquired = await self._acquire(now)
+            except Exception as e:
+                # 续约失败时只要租约还没到期就继续持有，否则提前降级，保证不会出现两个leader
+                logger.warning(f'续约租约失败: {e!r}')
+                acquired = self.is_leader and self.clock.time() + self.heartbeat < self._expires_at
+            else:
+                if acquired:
+                    self._expires_at = now + self.ttl
+            
+            # 租约已经到期（例如续约写入排队太久）时不再以leader身份执行任务
+            if acquired and self.clock.time() >= self._expires_at:
+                acquired = False
+            await self._set_leader(acquired)
+            if self.is_leader and self.on_heartbeat:
+                try:
+                    await self.on_heartbeat()
+                except Exception as e:
+                    logger.error(f'leader心跳任务出错: {e}')
+            
+            await self.clock.sleep(self.heartbeat)
+
+async def _demo(db_name: str, ttl: int = 6, heartbeat: float = 2):
+    """本地演示：打开数据库并参与选主，打印角色变化"""
+    import migrations
+    
+    conn = await aiosqlite.connect(db_name, isolation_level=None)
+    await conn.execute('PRAGMA journal_mode = WAL')
+    await conn.execute('PRAGMA busy_timeout = 5000')
+    await migrations.migrate(conn)
+    
+    async def write(op):
+        await conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = await op(conn)
+        except BaseException:
+            await conn.execute('ROLLBACK')
+            raise
+        await conn.execute('COMMIT')
+        return result
+    
+    async def elected():
+        print(f'[{time.strftime("%H:%M:%S")}] 成为leader')
+    
+    async def demoted():
+        print(f'[{time.strftime("%H:%M:%S")}] 降级为follower')
+    
+    elector = LeaderElector(write, 'scheduler', ttl, heartbeat, elected, demoted)
+    print(f'持有者: {elector.holder}，按Ctrl+C退出')
+    elector.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await elector.stop()
+        await conn.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_demo(sys.argv[1] if len(sys.argv) > 1 else 'lottery_bot.db'))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人数据库迁移
+
+数据库的表结构版本记录在 PRAGMA user_version 中。
+启动时按版本号顺序执行尚未应用的迁移，每个迁移在独立事务中完成，
+失败时回滚并保持原版本，不会留下半升级的数据库。
+"""
+
+import logging
+from typing import Awaitable, Callable, List, Tuple
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+async def _column_exists(conn: aiosqlite.Connection, table: str, column: str) -> bool:
+    """检查表中是否存在指定列"""
+    async with conn.execute(f'PRAGMA table_info({table})') as cursor:
+        return any(row[1] == column for row in await cursor.fetchall())
+
+async def _has_unique_index(conn: aiosqlite.Connection, table: str, column: str) -> bool:
+    """检查是否已有只包含指定列的唯一索引（包括UNIQUE约束生成的自动索引）"""
+    async with conn.execute(f'PRAGMA index_list({table})') as cursor:
+        indexes = await cursor.fetchall()
+    for index in indexes:
+        name, unique = index[1], index[2]
+        if not unique:
+            continue
+        async with conn.execute(f'PRAGMA index_info("{name}")') as cursor:
+            columns = [row[2] for row in await cursor.fetchall()]
+        if columns == [column]:
+            return True
+    return False
+
+async def _create_tables(conn: aiosqlite.Connection):
+    """v1: 基础表结构"""
+    # 抽奖表
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS lotteries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            prizes TEXT NOT NULL,  -- JSON格式存储奖品
+            max_participants INTEGER DEFAULT -1,
+            end_time TIMESTAMP,
+            status TEXT DEFAULT 'active',  -- active, ended, cancelled
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            winner_selection_method TEXT DEFAULT 'random',  -- random, weighted
+            allow_multiple_entries BOOLEAN DEFAULT FALSE,
+            required_roles TEXT,  -- JSON格式存储需要的角色ID
+            blacklisted_users TEXT,  -- JSON格式存储黑名单用户ID
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 参与者表
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lottery_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            discord_id TEXT,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            weight INTEGER DEFAULT 1,
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id),
+            UNIQUE(lottery_id, user_id)
+        )
+    ''')
+    
+    # 中奖记录表
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS winners (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lottery_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            prize_name TEXT NOT NULL,
+            won_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
+        )
+    ''')
+    
+    # 统计表
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS statistics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            total_lotteries INTEGER DEFAULT 0,
+            total_participants INTEGER DEFAULT 0,
+            total_winners INTEGER DEFAULT 0,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(guild_id)
+        )
+    ''')
+
+async def _backfill_legacy_schema(conn: aiosqlite.Connection):
+    """v2: 补齐旧版bot.py建出的数据库缺少的列和唯一约束"""
+    if not await _column_exists(conn, 'lotteries', 'updated_at'):
+        # ADD COLUMN不支持CURRENT_TIMESTAMP默认值，旧数据用创建时间填充
+        await conn.execute('ALTER TABLE lotteries ADD COLUMN updated_at TIMESTAMP')
+        await conn.execute('UPDATE lotteries SET updated_at = created_at')
+    
+    if not await _has_unique_index(conn, 'statistics', 'guild_id'):
+        # 每个服务器只保留最新的一条统计
+        await conn.execute('''
+            DELETE FROM statistics WHERE id NOT IN (
+                SELECT MAX(id) FROM statistics GROUP BY guild_id
+            )
+        ''')
+        await conn.execute('CREATE UNIQUE INDEX idx_statistics_guild_id ON statistics(guild_id)')
+
+async def _create_indexes(conn: aiosqlite.Connection):
+    """v3: 查询索引"""
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_guild_id ON lotteries(guild_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_status ON lotteries(status)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_participants_lottery_id ON participants(lottery_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_participants_user_id ON participants(user_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_winners_lottery_id ON winners(lottery_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_winners_user_id ON winners(user_id)')
+
+async def _add_participant_counters(conn: aiosqlite.Connection):
+    """v4: 抽奖表上的参与人数和总权重计数"""
+    if not await _column_exists(conn, 'lotteries', 'participant_count'):
+        await conn.execute('ALTER TABLE lotteries ADD COLUMN participant_count INTEGER NOT NULL DEFAULT 0')
+    if not await _column_exists(conn, 'lotteries', 'total_weight'):
+        await conn.execute('ALTER TABLE lotteries ADD COLUMN total_weight INTEGER NOT NULL DEFAULT 0')
+    
+    # 用现有参与记录回填计数
+    await conn.execute('''
+        UPDATE lotteries SET
+            participant_count = (SELECT COUNT(*) FROM participants p WHERE p.lottery_id = lotteries.id),
+            total_weight = (SELECT COALESCE(SUM(weight), 0) FROM participants p WHERE p.lottery_id = lotteries.id)
+    ''')
+
+async def _add_active_lotteries_stat(conn: aiosqlite.Connection):
+    """v5: 统计表增加进行中抽奖数，并按明细表重建所有服务器统计"""
+    if not await _column_exists(conn, 'statistics', 'active_lotteries'):
+        await conn.execute('ALTER TABLE statistics ADD COLUMN active_lotteries INTEGER NOT NULL DEFAULT 0')
+    
+    await conn.execute('''
+        INSERT INTO statistics (guild_id, total_lotteries, active_lotteries, total_participants, total_winners, last_updated)
+        SELECT l.guild_id, COUNT(*), SUM(l.status = 'active'), SUM(l.participant_count), COALESCE(SUM(w.winner_count), 0),
+               CURRENT_TIMESTAMP
+        FROM lotteries l
+        LEFT JOIN (SELECT lottery_id, COUNT(*) AS winner_count FROM winners GROUP BY lottery_id) w ON w.lottery_id = l.id
+        GROUP BY l.guild_id
+        ON CONFLICT(guild_id) DO UPDATE SET
+            total_lotteries = excluded.total_lotteries,
+            active_lotteries = excluded.active_lotteries,
+            total_participants = excluded.total_participants,
+            total_winners = excluded.total_winners,
+            last_updated = excluded.last_updated
+    ''')
+
+async def _create_user_guild_stats(conn: aiosqlite.Connection):
+    """v6: 按服务器汇总的用户统计表"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_guild_stats (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            participations INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            creations INTEGER NOT NULL DEFAULT 0,
+            last_win_at TIMESTAMP,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_user_guild_stats_user_id ON user_guild_stats(user_id)')
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_lotteries_creator_id ON lotteries(creator_id)')
+    
+    # 用现有明细回填
+    await conn.execute('''
+        INSERT OR REPLACE INTO user_guild_stats (guild_id, user_id, participations, wins, creations, last_win_at)
+        SELECT guild_id, user_id, SUM(participations), SUM(wins), SUM(creations), MAX(won_at)
+        FROM (
+            SELECT l.guild_id, p.user_id, 1 AS participations, 0 AS wins, 0 AS creations, NULL AS won_at
+            FROM participants p JOIN lotteries l ON l.id = p.lottery_id
+            UNION ALL
+            SELECT l.guild_id, w.user_id, 0, 1, 0, w.won_at
+            FROM winners w JOIN lotteries l ON l.id = w.lottery_id
+            UNION ALL
+            SELECT guild_id, creator_id, 0, 0, 1, NULL
+            FROM lotteries
+        )
+        GROUP BY guild_id, user_id
+    ''')
+
+def _epoch(column: str, local: bool = False) -> str:
+    """把文本时间列转换为UTC epoch秒的SQL表达式（已是整数的值保持不变）"""
+    # 'utc'修饰符把本地时间换算为UTC，用于由datetime.now()写入的列
+    modifier = ", 'utc'" if local else ""
+    return (f"CASE WHEN {column} IS NULL OR typeof({column}) = 'integer' THEN {column} "
+            f"ELSE CAST(strftime('%s', {column}{modifier}) AS INTEGER) END")
+
+# 整数时间列的默认值：当前UTC epoch秒
+EPOCH_NOW = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+async def _copy_sequence(conn: aiosqlite.Connection, table: str, new_table: str):
+    """把旧表的AUTOINCREMENT计数带到重建的新表，已删除行的id不会被重新分配"""
+    # 新表为空时sqlite_sequence里还没有它的记录
+    await conn.execute('''
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+    ''', (new_table, new_table))
+    await conn.execute('''
+        UPDATE sqlite_sequence
+        SET seq = MAX(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0))
+        WHERE name = ?
+    ''', (table, new_table))
+
+async def _integer_timestamps(conn: aiosqlite.Connection):
+    """v7: 所有时间列改为整数UTC epoch秒，并为到期扫描和清理建立复合索引"""
+    # 抽奖表：end_time由datetime.now()写入，是本地时间；其余时间列来自CURRENT_TIMESTAMP，是UTC
+    await conn.execute(f'''
+        CREATE TABLE lotteries_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            creator_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            prizes TEXT NOT NULL,  -- JSON格式存储奖品
+            max_participants INTEGER DEFAULT -1,
+            end_time INTEGER,  -- UTC epoch秒
+            status TEXT DEFAULT 'active',  -- active, ended, cancelled
+            created_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            winner_selection_method TEXT DEFAULT 'random',  -- random, weighted
+            allow_multiple_entries BOOLEAN DEFAULT FALSE,
+            required_roles TEXT,  -- JSON格式存储需要的角色ID
+            blacklisted_users TEXT,  -- JSON格式存储黑名单用户ID
+            updated_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            participant_count INTEGER NOT NULL DEFAULT 0,
+            total_weight INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO lotteries_new
+        SELECT id, guild_id, channel_id, creator_id, title, description, prizes, max_participants,
+               {_epoch('end_time', local=True)}, status,
+               COALESCE({_epoch('created_at')}, {EPOCH_NOW}),
+               winner_selection_method, allow_multiple_entries, required_roles, blacklisted_users,
+               COALESCE({_epoch('updated_at')}, {_epoch('created_at')}, {EPOCH_NOW}),
+               participant_count, total_weight
+        FROM lotteries
+    ''')
+    await _copy_sequence(conn, 'lotteries', 'lotteries_new')
+    await conn.execute('DROP TABLE lotteries')
+    await conn.execute('ALTER TABLE lotteries_new RENAME TO lotteries')
+    
+    # 参与者表
+    await conn.execute(f'''
+        CREATE TABLE participants_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lottery_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            discord_id TEXT,
+            joined_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            weight INTEGER DEFAULT 1,
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id),
+            UNIQUE(lottery_id, user_id)
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO participants_new
+        SELECT id, lottery_id, user_id, discord_id, COALESCE({_epoch('joined_at')}, {EPOCH_NOW}), weight
+        FROM participants
+    ''')
+    await _copy_sequence(conn, 'participants', 'participants_new')
+    await conn.execute('DROP TABLE participants')
+    await conn.execute('ALTER TABLE participants_new RENAME TO participants')
+    
+    # 中奖记录表
+    await conn.execute(f'''
+        CREATE TABLE winners_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lottery_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            prize_name TEXT NOT NULL,
+            won_at INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO winners_new
+        SELECT id, lottery_id, user_id, prize_name, COALESCE({_epoch('won_at')}, {EPOCH_NOW})
+        FROM winners
+    ''')
+    await _copy_sequence(conn, 'winners', 'winners_new')
+    await conn.execute('DROP TABLE winners')
+    await conn.execute('ALTER TABLE winners_new RENAME TO winners')
+    
+    # 统计表
+    await conn.execute(f'''
+        CREATE TABLE statistics_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            total_lotteries INTEGER DEFAULT 0,
+            total_participants INTEGER DEFAULT 0,
+            total_winners INTEGER DEFAULT 0,
+            last_updated INTEGER NOT NULL DEFAULT {EPOCH_NOW},
+            active_lotteries INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(guild_id)
+        )
+    ''')
+    await conn.execute(f'''
+        INSERT INTO statistics_new
+        SELECT id, guild_id, total_lotteries, total_participants, total_winners,
+               COALESCE({_epoch('last_updated')}, {EPOCH_NOW}), active_lotteries
+        FROM statistics
+    ''')
+    await _copy_sequence(conn, 'statistics', 'statistics_new')
+    await conn.execute('DROP TABLE statistics')
+    await conn.execute('ALTER TABLE statistics_new RENAME TO statistics')
+    
+    await conn.execute(f"UPDATE user_guild_stats SET last_win_at = {_epoch('last_win_at')}")
+    
+    # 重建索引；(status, end_time)覆盖原来的单列status索引
+    await conn.execute('CREATE INDEX idx_lotteries_guild_id ON lotteries(guild_id)')
+    await conn.execute('CREATE INDEX idx_lotteries_creator_id ON lotteries(creator_id)')
+    await conn.execute('CREATE INDEX idx_lotteries_status_end_time ON lotteries(status, end_time)')
+    await conn.execute('CREATE INDEX idx_lotteries_status_updated_at ON lotteries(status, updated_at)')
+    await conn.execute('CREATE INDEX idx_participants_lottery_id ON participants(lottery_id)')
+    await conn.execute('CREATE INDEX idx_participants_user_id ON participants(user_id)')
+    await conn.execute('CREATE INDEX idx_winners_lottery_id ON winners(lottery_id)')
+    await conn.execute('CREATE INDEX idx_winners_user_id ON winners(user_id)')
+
+async def _create_prizes_table(conn: aiosqlite.Connection):
+    """v8: 奖品从lotteries.prizes的JSON拆分到prizes表，并删除JSON列"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS prizes (
+            lottery_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,  -- 奖品在抽奖中的顺序
+            name TEXT NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,  -- 该奖品的中奖名额
+            PRIMARY KEY (lottery_id, position),
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
+        ) WITHOUT ROWID
+    ''')
+    # 旧数据里有{"name", "quantity"}对象，也有面板写入的"N个奖品"裸字符串（表示N个名额）
+    await conn.execute('''
+        INSERT INTO prizes (lottery_id, position, name, quantity)
+        SELECT l.id, j.key,
+               CASE WHEN j.type = 'object' THEN COALESCE(json_extract(j.value, '$.name'), '奖品')
+                    WHEN j.value GLOB '[0-9]*个奖品' THEN '奖品'
+                    ELSE CAST(j.value AS TEXT) END,
+               MAX(1, CASE WHEN j.type = 'object' THEN COALESCE(CAST(json_extract(j.value, '$.quantity') AS INTEGER), 1)
+                           WHEN j.value GLOB '[0-9]*个奖品' THEN CAST(j.value AS INTEGER)
+                           ELSE 1 END)
+        FROM lotteries l, json_each(l.prizes) j
+        WHERE json_valid(l.prizes) AND json_type(l.prizes) = 'array'
+    ''')
+    await conn.execute('ALTER TABLE lotteries DROP COLUMN prizes')
+
+async def _create_draw_orders(conn: aiosqlite.Connection):
+    """v9: 保存开奖时的完整抽取顺序，供重抽和候补名单使用"""
+    await conn.execute('''
+        CREATE TABLE draw_orders (
+            lottery_id INTEGER PRIMARY KEY,
+            user_ids BLOB NOT NULL,  -- 按抽取顺序排列的user_id，每个8字节
+            next_position INTEGER NOT NULL,  -- 下一位候补在user_ids中的序号
+            FOREIGN KEY (lottery_id) REFERENCES lotteries (id)
+        )
+    ''')
+
+async def _create_leases(conn: aiosqlite.Connection):
+    """v10: 多实例选主使用的租约表"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,  -- 租约名称，例如scheduler
+            holder TEXT NOT NULL,  -- 持有进程标识
+            expires_at INTEGER NOT NULL,  -- 过期时间（UTC epoch秒）
+            acquired_at INTEGER NOT NULL  -- 当前持有者取得租约的时间
+        )
+    ''')
+
+# 按版本号排列的迁移列表，只能在末尾追加
+MIGRATIONS: List[Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, "基础表结构", _create_tables),
+    (2, "补齐updated_at列和统计表唯一约束", _backfill_legacy_schema),
+    (3, "创建查询索引", _create_indexes),
+    (4, "抽奖表增加participant_count和total_weight", _add_participant_counters),
+    (5, "统计表增加active_lotteries并重建统计", _add_active_lotteries_stat),
+    (6, "创建user_guild_stats用户统计表", _create_user_guild_stats),
+    (7, "时间列改为整数UTC epoch秒", _integer_timestamps),
+    (8, "奖品拆分到prizes表", _create_prizes_table),
+    (9, "创建draw_orders开奖顺序表", _create_draw_orders),
+    (10, "创建leases选主租约表", _create_leases),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    """读取当前表结构版本"""
+    async with conn.execute('PRAGMA user_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+async def migrate(conn: aiosqlite.Connection) -> int:
+    """执行所有未应用的迁移，返回迁移后的版本
+    
+    连接需要处于自动提交模式（isolation_level=None），事务由这里显式控制。
+    """
+    current = await get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"数据库版本 {current} 高于程序支持的版本 {SCHEMA_VERSION}")
+    
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        await conn.execute('BEGIN IMMEDIATE')
+        # 多个进程可能同时启动，取得写锁后重新读取版本，跳过其他进程已应用的迁移
+        current = await get_schema_version(conn)
+        if version <= current:
+            await conn.execute('ROLLBACK')
+            continue
+        
+        logger.info(f"应用数据库迁移 v{version}: {description}")
+        try:
+            await apply(conn)
+            # user_version不支持参数绑定
+            await conn.execute(f'PRAGMA user_version = {version}')
+            await conn.execute('COMMIT')
+        except Exception as e:
+            await conn.execute('ROLLBACK')
+            logger.error(f"数据库迁移 v{version} 失败: {e}")
+            raise
+        current = version
+    
+    return current
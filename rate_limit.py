@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人限流
+
+令牌桶限流器：每个键一个桶，容量为capacity，每秒补充refill_rate个令牌，
+每次请求消耗一个令牌，桶空时拒绝。参与抽奖按用户限流，连续点击和脚本刷命令
+在defer和任何数据库操作之前就被拒绝；按抽奖的限流器只作为可选的数据库保护，默认关闭。
+桶按最近使用顺序保存，超过max_keys时淘汰最久未使用的桶。
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from clock import Clock, get_clock
+
+class RateLimiter:
+    """按键限流的令牌桶"""
+    
+    def __init__(self, capacity: float, refill_rate: float, max_keys: int = 100000,
+                 clock: Optional[Clock] = None):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        self.clock = clock or get_clock()
+        self._buckets: 'OrderedDict[Hashable, List[float]]' = OrderedDict()  # 键 -> [令牌数, 上次更新时间]
+        
+        # 指标
+        self.allowed = 0
+        self.rejected = 0
+    
+    def allow(self, key: Hashable) -> bool:
+        """为key消耗一个令牌，令牌不足时返回False"""
+        now = self.clock.time()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.capacity, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_rate)
+            bucket[1] = now
+        
+        if bucket[0] < 1:
+            self.rejected += 1
+            return False
+        bucket[0] -= 1
+        self.allowed += 1
+        return True
+    
+    def retry_after(self, key: Hashable) -> float:
+        """下一个令牌可用前还需等待的秒数"""
+        bucket = self._buckets.get(key)
+        if bucket is None or self.refill_rate <= 0:
+            return 0.0
+        tokens = min(self.capacity, bucket[0] + (self.clock.time() - bucket[1]) * self.refill_rate)
+        return max(0.0, (1 - tokens) / self.refill_rate)
+    
+    def stats(self) -> Dict:
+        """返回放行和拒绝计数"""
+        return {
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+            'keys': len(self._buckets)
+        }
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Discord中文抽奖机器人开奖调度器
+
+用最小堆保存待开奖抽奖的结束时间，调度协程精确睡眠到最早的一个到期，
+没有到期任务时不查询数据库。创建和取消抽奖时同步更新堆：
+取消采用惰性删除，过期的堆项在到达堆顶时丢弃。
+
+到期的抽奖交给DrawWorkerPool执行：固定数量的worker并发开奖，
+各服务器的队列轮流出队，单个服务器大量同时到期也不会饿死其他服务器。
+
+停机期间到期的抽奖不进入堆，由BacklogDrain在启动后按end_time顺序
+分批限速补开，避免重启时集中发送消息触发Discord的429限流。
+"""
+
+import asyncio
+import heapq
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from clock import Clock, get_clock
+
+logger = logging.getLogger(__name__)
+
+class LotteryScheduler:
+    """按结束时间（UTC epoch秒）触发开奖回调"""
+    
+    def __init__(self, callback: Callable[[int], Awaitable[None]], clock: Optional[Clock] = None):
+        self.callback = callback
+        self.clock = clock or get_clock()
+        self._heap: List[Tuple[int, int]] = []  # (end_time, lottery_id)
+        self._deadlines: Dict[int, int] = {}  # lottery_id -> 当前有效的end_time
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._firing: Set[asyncio.Task] = set()  # 持有回调任务的引用，防止被回收
+    
+    def __len__(self) -> int:
+        return len(self._deadlines)
+    
+    def schedule(self, lottery_id: int, end_time: int):
+        """加入或改期一个抽奖"""
+        self._deadlines[lottery_id] = end_time
+        heapq.heappush(self._heap, (end_time, lottery_id))
+        # 新任务成为堆顶时唤醒调度协程重新计算睡眠时间
+        if self._heap[0] == (end_time, lottery_id):
+            self._wakeup.set()
+    
+    def cancel(self, lottery_id: int):
+        """取消一个抽奖的调度（惰性删除）"""
+        self._deadlines.pop(lottery_id, None)
+    
+    def clear(self):
+        """清空所有调度"""
+        self._heap.clear()
+        self._deadlines.clear()
+    
+    def next_due(self) -> Optional[Tuple[int, int]]:
+        """返回最早到期的 (end_time, lottery_id)，并丢弃已取消的堆项"""
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+    
+    def start(self):
+        """启动调度协程"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    def stop(self):
+        """停止调度协程"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            due = self.next_due()
+            if due is None:
+                await self._wakeup.wait()
+                continue
+            
+            end_time, lottery_id = due
+            delay = end_time - self.clock.time()
+            if delay > 0:
+                await self.clock.wait(self._wakeup, delay)
+                continue
+            
+            heapq.heappop(self._heap)
+            del self._deadlines[lottery_id]
+            task = asyncio.create_task(self._fire(lottery_id))
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+    
+    async def _fire(self, lottery_id: int):
+        try:
+            await self.callback(lottery_id)
+        except Exception as e:
+            logger.error(f'自动开奖失败 (抽奖ID: {lottery_id}): {e}')
+
+class DrawWorkerPool:
+    """有并发上限、按服务器公平轮转的开奖工作池"""
+    
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], concurrency: int, 
+                 latency_samples: int = 200, clock: Optional[Clock] = None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.clock = clock or get_clock()
+        self._queues: Dict[int, Deque[Tuple[Any, float]]] = {}  # guild_id -> [(任务, 到期时间)]
+        self._rotation: Deque[int] = deque()  # 有待处理任务的服务器，按轮转顺序
+        self._ready = asyncio.Condition()
+        self._workers: List[asyncio.Task] = []
+        
+        # 指标
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._lateness: Deque[float] = deque(maxlen=latency_samples)  # 到期到开始执行
+        self._durations: Deque[float] = deque(maxlen=latency_samples)  # 执行耗时
+    
+    def queue_depth(self) -> int:
+        """等待执行的任务数"""
+        return sum(len(queue) for queue in self._queues.values())
+    
+    async def submit(self, guild_id: int, item: Any, due_time: Optional[float] = None):
+        """提交一个开奖任务，due_time用于统计开奖延迟"""
+        async with self._ready:
+            queue = self._queues.get(guild_id)
+            if queue is None:
+                queue = self._queues[guild_id] = deque()
+                self._rotation.append(guild_id)
+            queue.append((item, due_time if due_time is not None else self.clock.time()))
+            self._ready.notify()
+    
+    def _take(self) -> Tuple[Any, float]:
+        """从轮转中的下一个服务器取出一个任务"""
+        guild_id = self._rotation.popleft()
+        queue = self._queues[guild_id]
+        entry = queue.popleft()
+        if queue:
+            self._rotation.append(guild_id)
+        else:
+            del self._queues[guild_id]
+        return entry
+    
+    def start(self):
+        """启动worker"""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+    
+    def stop(self):
+        """停止worker，未执行的任务保留在队列中"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+    
+    def clear(self):
+        """丢弃所有排队中的任务"""
+        self._queues.clear()
+        self._rotation.clear()
+    
+    async def _worker(self):
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: self._rotation)
+                item, due_time = self._take()
+            
+            started = self.clock.time()
+            self._lateness.append(max(0.0, started - due_time))
+            self.in_flight += 1
+            try:
+                await self.handler(item)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f'开奖任务执行失败: {e}')
+            finally:
+                self.in_flight -= 1
+                self._durations.append(self.clock.time() - started)
+    
+    def stats(self) -> Dict:
+        """返回队列深度和最近开奖延迟的统计"""
+        def summarize(samples: Deque[float]) -> Dict:
+            if not samples:
+                return {'avg': 0.0, 'p95': 0.0, 'max': 0.0}
+            ordered = sorted(samples)
+            return {
+                'avg': sum(ordered) / len(ordered),
+                'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                'max': ordered[-1]
+            }
+        
+        return {
+            'queue_depth': self.queue_depth(),
+            'queued_guilds': len(self._rotation),
+            'in_flight': self.in_flight,
+            'concurrency': self.concurrency,
+            'completed': self.completed,
+            'failed': self.failed,
+            'lateness': summarize(self._lateness),
+            'duration': summarize(self._durations)
+        }
+
+class BacklogDrain:
+    """按end_time顺序分批补开停机期间到期的抽奖"""
+    
+    def __init__(self, fetch_page: Callable[[int, Tuple[int, int], int], Awaitable[List[Dict]]],
+                 submit: Callable[[Dict], Awaitable[None]], batch_size: int, interval: float,
+                 clock: Optional[Clock] = None):
+        self.fetch_page = fetch_page  # (cutoff, after, limit) -> 抽奖列表
+        self.submit = submit
+        self.batch_size = batch_size
+        self.interval = interval
+        self.clock = clock or get_clock()
+        self.total = 0
+        self.submitted = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self, cutoff: int, total: int):
+        """开始补开end_time不晚于cutoff的抽奖，total用于显示进度"""
+        self.total = total
+        self.submitted = 0
+        self.started_at = self.clock.time()
+        self.finished_at = None
+        self._task = asyncio.create_task(self._run(cutoff))
+    
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    async def _run(self, cutoff: int):
+        after = (0, 0)
+        try:
+            while True:
+                page = await self.fetch_page(cutoff, after, self.batch_size)
+                for lottery in page:
+                    await self.submit(lottery)
+                self.submitted += len(page)
+                if len(page) < self.batch_size:
+                    break
+                
+                after = (page[-1]['end_time'], page[-1]['id'])
+                await self.clock.sleep(self.interval)
+        except Exception as e:
+            logger.error(f'补开积压抽奖失败: {e}')
+        finally:
+            self.finished_at = self.clock.time()
+            logger.info(f'积压抽奖补开结束: {self.submitted}/{self.total}')
+    
+    def progress(self) -> Dict:
+        """返回补开进度"""
+        return {
+            'total': self.total,
+            'submitted': self.submitted,
+            'running': self.is_running(),
+            'elapsed': ((self.finished_at or self.clock.time()) - self.started_at) if self.started_at else 0.0
+        }
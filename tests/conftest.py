@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共设置
+
+模块都在仓库根目录下，直接加入sys.path。config在导入时校验DISCORD_TOKEN，
+测试不连接Discord，这里提供一个占位值。
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DISCORD_TOKEN', 'test-token')
+
+import clock  # noqa: E402
+
+@pytest.fixture
+def db_path(tmp_path):
+    """临时数据库文件路径"""
+    return str(tmp_path / 'lottery_test.db')
+
+@pytest.fixture(autouse=True)
+def restore_clock():
+    """测试可能替换进程默认时钟，结束后恢复"""
+    original = clock.get_clock()
+    yield
+    clock.set_clock(original)
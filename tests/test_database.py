@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DatabaseManager测试：开奖CAS、重抽、批量参与和写入队列
+"""
+
+import asyncio
+from array import array
+
+import clock
+from clock import SimulatedClock
+from database import (DatabaseManager, JOIN_ALREADY, JOIN_CLOSED, JOIN_EXPIRED, JOIN_FULL,
+                      JOIN_JOINED, JOIN_NOT_FOUND, JOIN_WEIGHT_ADDED)
+
+GUILD_ID = 1
+CHANNEL_ID = 10
+CREATOR_ID = 100
+
+def run_with_db(db_path, scenario):
+    """打开数据库执行scenario(db)，结束后关闭连接"""
+    async def run():
+        db = DatabaseManager(db_path)
+        await db.connect()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+    return asyncio.run(run())
+
+async def create(db, **kwargs) -> int:
+    return await db.create_lottery(GUILD_ID, CHANNEL_ID, CREATOR_ID, '测试抽奖',
+                                   [{'name': '奖品', 'quantity': 1}], **kwargs)
+
+async def user_stats(db, user_id: int):
+    return await db.fetchone('''
+        SELECT participations, wins FROM user_guild_stats WHERE guild_id = ? AND user_id = ?
+    ''', (GUILD_ID, user_id))
+
+# ---- 开奖 ----
+
+def test_complete_lottery_only_first_call_wins(db_path):
+    async def scenario(db):
+        lottery_id = await create(db)
+        await db.join_lottery_many(lottery_id, [1, 2, 3])
+        
+        # 并发开奖只有一个调用写入结果
+        results = await asyncio.gather(
+            db.complete_lottery(lottery_id, [(1, '奖品')], array('q', [1, 2, 3])),
+            db.complete_lottery(lottery_id, [(2, '奖品')], array('q', [2, 1, 3])),
+        )
+        assert sorted(results) == [False, True]
+        winners = await db.get_lottery_winners(lottery_id)
+        assert len(winners) == 1
+        
+        # 已结束的抽奖不能再开奖或取消
+        assert not await db.complete_lottery(lottery_id, [(3, '奖品')])
+        assert not await db.update_lottery_status(lottery_id, 'cancelled')
+        
+        lottery = await db.get_lottery(lottery_id)
+        assert lottery['status'] == 'ended'
+        assert lottery_id not in db.active_lotteries
+        stats = await db.get_guild_summary(GUILD_ID)
+        assert stats['active_lotteries'] == 0
+        assert stats['total_wins'] == 1
+    
+    run_with_db(db_path, scenario)
+
+def test_reroll_winner_walks_the_waitlist(db_path):
+    async def scenario(db):
+        lottery_id = await create(db)
+        await db.join_lottery_many(lottery_id, [1, 2, 3, 4])
+        assert await db.complete_lottery(lottery_id, [(1, '奖品')], array('q', [1, 3, 4]))
+        assert await db.get_waitlist(lottery_id) == [3, 4]
+        
+        # 不是中奖者时不重抽
+        assert await db.reroll_winner(lottery_id, 2) is None
+        
+        assert await db.reroll_winner(lottery_id, 1) == (3, '奖品')
+        assert await db.get_waitlist(lottery_id) == [4]
+        assert [w['user_id'] for w in await db.get_lottery_winners(lottery_id)] == [3]
+        assert tuple(await user_stats(db, 1)) == (1, 0)
+        assert tuple(await user_stats(db, 3)) == (1, 1)
+        
+        assert await db.reroll_winner(lottery_id, 3) == (4, '奖品')
+        # 候补已用完
+        assert await db.reroll_winner(lottery_id, 4) is None
+        assert await db.get_waitlist(lottery_id) == []
+        assert [w['user_id'] for w in await db.get_lottery_winners(lottery_id)] == [4]
+    
+    run_with_db(db_path, scenario)
+
+# ---- 批量参与 ----
+
+def test_join_lottery_many_weights(db_path):
+    async def scenario(db):
+        lottery_id = await create(db, allow_multiple=True)
+        results = await db.join_lottery_many(lottery_id, [1, 2, 1, 1])
+        assert results == [(JOIN_JOINED, 1), (JOIN_JOINED, 2), (JOIN_WEIGHT_ADDED, 2), (JOIN_WEIGHT_ADDED, 2)]
+        assert await db.join_lottery_many(lottery_id, [2]) == [(JOIN_WEIGHT_ADDED, 2)]
+        
+        assert dict(await db.get_participants(lottery_id)) == {1: 3, 2: 2}
+        lottery = await db.get_lottery(lottery_id)
+        assert (lottery['participant_count'], lottery['total_weight']) == (2, 5)
+        # 增加权重不重复计入参与次数
+        assert tuple(await user_stats(db, 1)) == (1, 0)
+    
+    run_with_db(db_path, scenario)
+
+def test_join_lottery_many_rejections(db_path):
+    async def scenario(db):
+        lottery_id = await create(db, max_participants=2)
+        assert await db.join_lottery_many(lottery_id, [1, 1, 2, 3]) == [
+            (JOIN_JOINED, 1), (JOIN_ALREADY, 1), (JOIN_JOINED, 2), (JOIN_FULL, 2)
+        ]
+        # 热状态已知人数已满，不经过写事务也返回同样的结果
+        assert await db.join_lottery_many(lottery_id, [4]) == [(JOIN_FULL, 2)]
+        db.active_lotteries.clear()
+        assert await db.join_lottery_many(lottery_id, [4]) == [(JOIN_FULL, 2)]
+        assert await db.join_lottery_many(999, [1]) == [(JOIN_NOT_FOUND, 0)]
+        
+        assert await db.update_lottery_status(lottery_id, 'cancelled')
+        assert await db.join_lottery_many(lottery_id, [5]) == [(JOIN_CLOSED, 2)]
+    
+    run_with_db(db_path, scenario)
+
+def test_join_lottery_many_expiry(db_path):
+    sim = SimulatedClock(1_700_000_000)
+    clock.set_clock(sim)
+    
+    async def scenario(db):
+        lottery_id = await create(db, end_time=1_700_000_060)
+        assert await db.join_lottery_many(lottery_id, [1]) == [(JOIN_JOINED, 1)]
+        
+        await sim.run_until(1_700_000_060)
+        # 热状态判定过期
+        assert await db.join_lottery_many(lottery_id, [2]) == [(JOIN_EXPIRED, 1)]
+        # 没有热状态时由写事务判定
+        db.active_lotteries.clear()
+        assert await db.join_lottery_many(lottery_id, [2]) == [(JOIN_EXPIRED, 1)]
+        assert await db.get_participant_count(lottery_id) == 1
+    
+    run_with_db(db_path, scenario)
+
+# ---- 写入队列 ----
+
+def test_cancelled_write_is_skipped(db_path):
+    async def scenario(db):
+        started = asyncio.Event()
+        ran = []
+        
+        async def slow(conn):
+            started.set()
+            await asyncio.sleep(0.1)
+        
+        async def op(conn):
+            ran.append(True)
+        
+        blocker = asyncio.ensure_future(db.write(slow))
+        await started.wait()
+        # 排在慢操作之后，执行前调用方已放弃等待
+        waiter = asyncio.ensure_future(db.write(op))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await blocker
+        await db.write(lambda conn: conn.execute('SELECT 1'))
+        assert ran == []
+    
+    run_with_db(db_path, scenario)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选主租约测试：抢占、续约、fencing和接管
+"""
+
+import asyncio
+import sqlite3
+
+import aiosqlite
+
+import migrations
+from clock import SimulatedClock
+from leader import LeaderElector, try_acquire
+
+T0 = 1_700_000_000
+TTL = 15
+HEARTBEAT = 5
+
+def test_try_acquire_takeover_and_fencing():
+    async def run():
+        conn = await aiosqlite.connect(':memory:', isolation_level=None)
+        try:
+            await migrations.migrate(conn)
+            assert await try_acquire(conn, 'scheduler', 'a', TTL, T0)
+            # 租约未过期时其他进程不能抢占
+            assert not await try_acquire(conn, 'scheduler', 'b', TTL, T0 + 5)
+            # 持有者用上次写入的过期时间续约
+            assert await try_acquire(conn, 'scheduler', 'a', TTL, T0 + 5, T0 + TTL)
+            # 过期时间对不上（例如降级后凭旧状态续约）时失败
+            assert not await try_acquire(conn, 'scheduler', 'a', TTL, T0 + 6, T0 + TTL)
+            # 没有fencing值时只能接管空闲或过期的租约
+            assert not await try_acquire(conn, 'scheduler', 'a', TTL, T0 + 6)
+            
+            # 过期后其他进程接管，原持有者不能再续约
+            assert await try_acquire(conn, 'scheduler', 'b', TTL, T0 + 5 + TTL)
+            assert not await try_acquire(conn, 'scheduler', 'a', TTL, T0 + 5 + TTL, T0 + 5 + TTL)
+            async with conn.execute('SELECT holder, acquired_at FROM leases') as cursor:
+                assert tuple(await cursor.fetchone()) == ('b', T0 + 5 + TTL)
+        finally:
+            await conn.close()
+    
+    asyncio.run(run())
+
+class _Cursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+    
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+class _Execution:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = _Cursor(cursor)
+    
+    def __await__(self):
+        yield from ()
+        return self._cursor
+    
+    async def __aenter__(self):
+        return self._cursor
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+class SyncConnection:
+    """在事件循环线程中同步执行SQL
+    
+    aiosqlite在后台线程执行语句，模拟时钟推进虚拟时间时不会等待这些线程；
+    这里让每次写入在当前协程内完成，虚拟时间下的结果是确定的。
+    """
+    
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', isolation_level=None)
+        self.conn.execute('''
+            CREATE TABLE leases (
+                name TEXT PRIMARY KEY, holder TEXT NOT NULL,
+                expires_at INTEGER NOT NULL, acquired_at INTEGER NOT NULL
+            )
+        ''')
+    
+    def execute(self, sql: str, params=()):
+        return _Execution(self.conn.execute(sql, params))
+
+class Node:
+    """一个参与选主的进程，stall为True时写入一直排队"""
+    
+    def __init__(self, holder: str, lease_db: SyncConnection, clock: SimulatedClock, events: list):
+        self.stall = False
+        
+        async def write(op):
+            while self.stall:
+                await clock.sleep(HEARTBEAT)
+            return await op(lease_db)
+        
+        async def elected():
+            events.append((holder, 'elected', clock.time()))
+        
+        async def demoted():
+            events.append((holder, 'demoted', clock.time()))
+        
+        self.elector = LeaderElector(write, 'scheduler', TTL, HEARTBEAT, elected, demoted,
+                                     holder=holder, clock=clock)
+
+def test_standby_takes_over_after_leader_dies():
+    async def run():
+        clock = SimulatedClock(T0)
+        lease_db = SyncConnection()
+        events = []
+        a = Node('a', lease_db, clock, events)
+        b = Node('b', lease_db, clock, events)
+        
+        a.elector.start()
+        await clock.run_until(T0 + 1)
+        b.elector.start()
+        await clock.run_until(T0 + 60)
+        # 持有者按时续约，备用进程一直拿不到租约
+        assert events == [('a', 'elected', T0)]
+        assert a.elector.is_leader and not b.elector.is_leader
+        
+        # 持有者卡死：不再续约也不释放租约
+        a.elector._task.cancel()
+        await clock.run_until(T0 + 120)
+        assert b.elector.is_leader
+        takeover = events[-1]
+        assert takeover[:2] == ('b', 'elected')
+        # 最后一次续约在T0+60，租约在T0+75过期，下一次心跳接管
+        assert T0 + 75 <= takeover[2] <= T0 + 75 + HEARTBEAT
+        
+        await b.elector.stop()
+    
+    asyncio.run(run())
+
+def test_leader_steps_down_when_renewal_stalls():
+    async def run():
+        clock = SimulatedClock(T0)
+        lease_db = SyncConnection()
+        events = []
+        a = Node('a', lease_db, clock, events)
+        b = Node('b', lease_db, clock, events)
+        
+        a.elector.start()
+        await clock.run_until(T0 + 1)
+        b.elector.start()
+        await clock.run_until(T0 + 12)
+        
+        # T0+10的续约已写入，租约到T0+25；之后的续约一直排队
+        a.stall = True
+        await clock.run_until(T0 + 40)
+        assert events[:2] == [('a', 'elected', T0), ('a', 'demoted', T0 + 25)]
+        assert events[2][:2] == ('b', 'elected')
+        assert T0 + 25 <= events[2][2] <= T0 + 25 + HEARTBEAT
+        
+        # 写入恢复后，原leader不会凭旧租约重新成为leader
+        a.stall = False
+        await clock.run_until(T0 + 80)
+        assert b.elector.is_leader and not a.elector.is_leader
+        assert len(events) == 3
+        
+        await a.elector.stop()
+        await b.elector.stop()
+    
+    asyncio.run(run())
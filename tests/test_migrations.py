@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库迁移测试
+"""
+
+import asyncio
+import sqlite3
+
+import aiosqlite
+
+import migrations
+
+# 旧版bot.py建出的表：没有updated_at列，统计表没有guild_id唯一约束，时间列是文本
+LEGACY_SCHEMA = '''
+    CREATE TABLE lotteries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        creator_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        prizes TEXT NOT NULL,
+        max_participants INTEGER DEFAULT -1,
+        end_time TIMESTAMP,
+        status TEXT DEFAULT 'active',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        winner_selection_method TEXT DEFAULT 'random',
+        allow_multiple_entries BOOLEAN DEFAULT FALSE,
+        required_roles TEXT,
+        blacklisted_users TEXT
+    );
+    CREATE TABLE participants (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lottery_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        discord_id TEXT,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        weight INTEGER DEFAULT 1,
+        UNIQUE(lottery_id, user_id)
+    );
+    CREATE TABLE winners (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lottery_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        prize_name TEXT NOT NULL,
+        won_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE statistics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        total_lotteries INTEGER DEFAULT 0,
+        total_participants INTEGER DEFAULT 0,
+        total_winners INTEGER DEFAULT 0,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+def build_legacy_db(path: str):
+    """写入一份旧版数据：两个服务器、三个抽奖，最后一个抽奖已被删除"""
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany('''
+        INSERT INTO lotteries (guild_id, channel_id, creator_id, title, prizes, end_time, status, created_at)
+        VALUES (?, 10, ?, ?, ?, ?, ?, '2024-01-01 00:00:00')
+    ''', [
+        (1, 100, '周年抽奖', '[{"name": "Nitro", "quantity": 2}, {"name": "徽章"}]', '2024-01-02 08:00:00', 'ended'),
+        (1, 101, '面板抽奖', '["3个奖品"]', None, 'active'),
+        (2, 102, '已删除', '["奖品"]', None, 'ended'),
+    ])
+    conn.execute('DELETE FROM lotteries WHERE id = 3')
+    conn.executemany('INSERT INTO participants (lottery_id, user_id, weight) VALUES (?, ?, ?)',
+                     [(1, 500, 1), (1, 501, 3), (2, 500, 1)])
+    conn.execute("INSERT INTO winners (lottery_id, user_id, prize_name) VALUES (1, 501, 'Nitro')")
+    # 旧版每次更新都插入一条统计，同一服务器有多行
+    conn.executemany('INSERT INTO statistics (guild_id, total_lotteries) VALUES (?, ?)', [(1, 1), (1, 2)])
+    conn.commit()
+    conn.close()
+
+async def migrate_file(path: str) -> int:
+    conn = await aiosqlite.connect(path, isolation_level=None)
+    try:
+        await conn.execute('PRAGMA journal_mode = WAL')
+        await conn.execute('PRAGMA busy_timeout = 30000')
+        return await migrations.migrate(conn)
+    finally:
+        await conn.close()
+
+def test_migrate_legacy_database(db_path):
+    build_legacy_db(db_path)
+    assert asyncio.run(migrate_file(db_path)) == migrations.SCHEMA_VERSION
+    
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == migrations.SCHEMA_VERSION
+        
+        lottery = conn.execute('SELECT * FROM lotteries WHERE id = 1').fetchone()
+        assert lottery['participant_count'] == 2
+        assert lottery['total_weight'] == 4
+        assert isinstance(lottery['end_time'], int)
+        assert lottery['created_at'] == 1704067200
+        assert 'prizes' not in lottery.keys()
+        
+        prizes = conn.execute('SELECT lottery_id, name, quantity FROM prizes ORDER BY lottery_id, position').fetchall()
+        assert [tuple(row) for row in prizes] == [(1, 'Nitro', 2), (1, '徽章', 1), (2, '奖品', 3)]
+        
+        stats = conn.execute('SELECT * FROM statistics').fetchall()
+        assert len(stats) == 1
+        assert (stats[0]['guild_id'], stats[0]['total_lotteries'], stats[0]['active_lotteries'],
+                stats[0]['total_participants'], stats[0]['total_winners']) == (1, 2, 1, 3, 1)
+        
+        user = conn.execute('SELECT * FROM user_guild_stats WHERE guild_id = 1 AND user_id = 501').fetchone()
+        assert (user['participations'], user['wins']) == (1, 1)
+        assert isinstance(user['last_win_at'], int)
+        
+        # 重建表后已删除的抽奖ID不会被重新分配
+        conn.execute("INSERT INTO lotteries (guild_id, channel_id, creator_id, title) VALUES (1, 10, 100, '新抽奖')")
+        assert conn.execute('SELECT MAX(id) FROM lotteries').fetchone()[0] == 4
+    finally:
+        conn.close()
+
+def test_migrate_is_idempotent(db_path):
+    assert asyncio.run(migrate_file(db_path)) == migrations.SCHEMA_VERSION
+    assert asyncio.run(migrate_file(db_path)) == migrations.SCHEMA_VERSION
+
+def test_concurrent_migrate(db_path):
+    build_legacy_db(db_path)
+    
+    async def run():
+        return await asyncio.gather(*(migrate_file(db_path) for _ in range(3)))
+    
+    assert asyncio.run(run()) == [migrations.SCHEMA_VERSION] * 3
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM prizes').fetchone()[0] == 3
+        assert conn.execute('SELECT COUNT(*) FROM lotteries').fetchone()[0] == 2
+    finally:
+        conn.close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+开奖调度器测试（模拟时钟）
+"""
+
+import asyncio
+
+from clock import SimulatedClock
+from scheduler import LotteryScheduler
+
+T0 = 1_700_000_000
+
+def run_scheduler(scenario):
+    """创建模拟时钟上的调度器，scenario(clock, scheduler, fired)执行完后停止调度"""
+    async def run():
+        clock = SimulatedClock(T0)
+        fired = []
+        
+        async def callback(lottery_id: int):
+            fired.append((lottery_id, clock.time()))
+        
+        scheduler = LotteryScheduler(callback, clock=clock)
+        scheduler.start()
+        try:
+            await scenario(clock, scheduler, fired)
+        finally:
+            scheduler.stop()
+    
+    asyncio.run(run())
+
+def test_fires_in_end_time_order():
+    async def scenario(clock, scheduler, fired):
+        scheduler.schedule(1, T0 + 30)
+        scheduler.schedule(2, T0 + 10)
+        scheduler.schedule(3, T0 + 20)
+        assert len(scheduler) == 3
+        
+        await clock.run_until(T0 + 100)
+        assert fired == [(2, T0 + 10), (3, T0 + 20), (1, T0 + 30)]
+        assert len(scheduler) == 0
+    
+    run_scheduler(scenario)
+
+def test_earlier_lottery_wakes_the_scheduler():
+    async def scenario(clock, scheduler, fired):
+        scheduler.schedule(1, T0 + 3600)
+        await clock.run_until(T0 + 10)
+        # 调度协程正在睡到T0+3600，新的堆顶要让它提前醒来
+        scheduler.schedule(2, T0 + 20)
+        
+        await clock.run_until(T0 + 7200)
+        assert fired == [(2, T0 + 20), (1, T0 + 3600)]
+    
+    run_scheduler(scenario)
+
+def test_cancel_and_reschedule():
+    async def scenario(clock, scheduler, fired):
+        scheduler.schedule(1, T0 + 10)
+        scheduler.schedule(2, T0 + 20)
+        scheduler.schedule(3, T0 + 30)
+        
+        scheduler.cancel(2)
+        # 改期只按最新的结束时间触发一次
+        scheduler.schedule(3, T0 + 5)
+        scheduler.schedule(1, T0 + 40)
+        assert len(scheduler) == 2
+        
+        await clock.run_until(T0 + 100)
+        assert fired == [(3, T0 + 5), (1, T0 + 40)]
+        assert scheduler.next_due() is None
+    
+    run_scheduler(scenario)
+
+def test_overdue_lottery_fires_immediately():
+    async def scenario(clock, scheduler, fired):
+        scheduler.schedule(1, T0 - 60)
+        await clock.run_until(T0)
+        assert fired == [(1, T0)]
+    
+    run_scheduler(scenario)